@@ -0,0 +1,112 @@
+"""
+Compares the Flask app with the ASGI app under many concurrent clients.
+
+Run from the backend folder, against a Postgres database since the ASGI app queries it through asyncpg:
+
+    python -m benchmarks.asgi --database-path postgresql://localhost/trivia_bench --reset --concurrency 64
+
+The questions and categories tables of that database are dropped and a bank of --rows
+questions is generated in it (this needs --reset). The Flask app is then served by
+"flask run", one thread per connection, and the ASGI app by uvicorn, each in its own
+process with the same DB_POOL_SIZE, and every scenario of benchmarks.suite is sent
+--requests times from --concurrency threads to each of them.
+"""
+import argparse
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+from .common import bench_app, generate, reset_bank
+from .suite import HTTPTransport, scenarios, run_scenario
+
+# Seconds a server has to start and answer its first request
+STARTUP_TIMEOUT = 120
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(command, port, environment):
+    """
+    Starts a server process and waits until it answers.
+    @returns the process.
+    """
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.Popen(command, cwd=backend, env=dict(os.environ, **environment),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    transport = HTTPTransport(port)
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while True:
+        try:
+            if transport.send('GET', '/categories', None) == 200:
+                return process
+        except OSError:
+            transport = HTTPTransport(port)
+        if process.poll() is not None or time.monotonic() > deadline:
+            process.kill()
+            raise RuntimeError('{} did not start'.format(' '.join(command)))
+        time.sleep(0.2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--database-path', required=True, help='a Postgres database URL')
+    parser.add_argument('--reset', action='store_true', help='allow dropping the questions and categories tables of --database-path')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--requests', type=int, default=2000, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--pool-size', type=int, default=10, help='database connections of each server')
+    parser.add_argument('--scenarios', default=None, help='comma-separated scenarios, all by default')
+    args = parser.parse_args()
+    if not args.reset:
+        parser.error('--database-path drops the questions and categories tables, pass --reset to confirm')
+
+    random.seed(0)
+    bank, _ = bench_app(args.database_path)
+    with bank.app_context():
+        reset_bank()
+        generate(args.rows)
+    environment = {
+        'DATABASE_URL': args.database_path,
+        'DB_POOL_SIZE': str(args.pool_size),
+        'DB_MAX_OVERFLOW': '0',
+        'FAST_START': 'true',
+        'WARM_CACHES': 'true',
+        'FLASK_APP': 'flaskr'
+    }
+    servers = (
+        ('flask', [sys.executable, '-m', 'flask', 'run', '--with-threads']),
+        ('asgi', [sys.executable, '-m', 'uvicorn', '--factory', 'flaskr.asgi:create_asgi_app', '--log-level', 'warning'])
+    )
+    selected = scenarios(args.rows)
+    if args.scenarios:
+        selected = {name: selected[name] for name in args.scenarios.split(',')}
+    results = {}
+    for server, command in servers:
+        port = free_port()
+        process = start_server(command + ['--port', str(port)], port, environment)
+        try:
+            transport = HTTPTransport(port)
+            for name, make_request in selected.items():
+                results[name, server] = run_scenario(transport, make_request, args.requests, args.concurrency)
+        finally:
+            process.terminate()
+            process.wait()
+
+    print('== {} questions, {} clients, {} connections per server'.format(args.rows, args.concurrency, args.pool_size))
+    print('{:<18} {:<6} {:>9} {:>9} {:>9} {:>10} {:>7}'.format('scenario', 'server', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'errors'))
+    for name in selected:
+        for server, _ in servers:
+            result = results[name, server]
+            print('{:<18} {:<6} {:>9.2f} {:>9.2f} {:>9.2f} {:>10.1f} {:>7}'.format(
+                name, server, result['p50_ms'], result['p95_ms'], result['p99_ms'], result['throughput_rps'], result['errors']))
+
+
+if __name__ == '__main__':
+    main()
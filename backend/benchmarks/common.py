@@ -0,0 +1,75 @@
+"""
+Synthetic question banks and timing helpers shared by the benchmarks.
+"""
+import os
+import random
+import tempfile
+import time
+
+from flask import Flask
+
+from models import setup_db, db, Question, Category
+
+WORDS = (
+    'which', 'what', 'who', 'country', 'painting', 'river', 'world', 'cup', 'title', 'movie',
+    'element', 'planet', 'artist', 'century', 'king', 'battle', 'ocean', 'author', 'novel', 'team',
+)
+CATEGORIES = ('Science', 'Art', 'Geography', 'History', 'Entertainment', 'Sports')
+
+
+def bench_app(database_path=None):
+    """
+    Builds a bare app bound to the benchmark database.
+    @param database_path - a database URL, a new temporary SQLite database when None.
+    @returns a tuple of the app and whether the database is a new one.
+    """
+    fresh = database_path is None
+    path = database_path or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    app = Flask(__name__)
+    setup_db(app, path)
+    return app, fresh
+
+
+def reset_bank():
+    """
+    Drops and creates again the questions and categories tables of the current app.
+    The other tables, such as the quiz results, are left as they are, and only created when missing.
+    """
+    tables = [Question.__table__, Category.__table__]
+    db.Model.metadata.drop_all(bind=db.engine, tables=tables)
+    db.create_all()
+
+
+def generate(rows, seed=0):
+    """
+    Fills the categories and questions tables with random questions, in chunks with a Core insert,
+    the ORM would make the setup slower than the benchmarks.
+    @param rows - the number of questions.
+    @param seed - the seed of the random texts.
+    """
+    randomizer = random.Random(seed)
+    if not Category.query.count():
+        db.session.execute(Category.__table__.insert(), [{'type': name} for name in CATEGORIES])
+    chunk = []
+    for i in range(rows):
+        text = ' '.join(randomizer.choice(WORDS) for _ in range(randomizer.randint(6, 14))) + '?'
+        chunk.append({
+            'question': text,
+            'answer': randomizer.choice(WORDS),
+            'category': randomizer.randint(1, len(CATEGORIES)),
+            'difficulty': randomizer.randint(1, 5),
+        })
+        if len(chunk) == 10000 or i == rows - 1:
+            db.session.execute(Question.__table__.insert(), chunk)
+            db.session.commit()
+            chunk = []
+
+
+def timed(function, repeat):
+    """
+    @returns a tuple of the mean milliseconds of a call to function and the result of the last call.
+    """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    return (time.perf_counter() - start) / repeat * 1000, result
@@ -0,0 +1,76 @@
+"""
+Query plans and timings of the category listing and the quiz, without and with the category indexes.
+
+Run from the backend folder:
+
+    python -m benchmarks.query_plans --rows 100000
+
+By default the questions are generated in a temporary SQLite database, which shows
+EXPLAIN QUERY PLAN. Pass --database-path to run against a Postgres database, which
+shows EXPLAIN ANALYZE. The indexes are dropped for the "before" run and created again.
+"""
+import argparse
+
+from sqlalchemy import text
+
+from models import db, Question
+from .common import bench_app, generate, timed
+
+CATEGORY = 3
+PREVIOUS_QUESTIONS = (1, 2, 3, 4, 5)
+QUERIES = (
+    ('category page', 'SELECT * FROM questions WHERE category = :category ORDER BY id LIMIT 10 OFFSET 100'),
+    ('category count', 'SELECT count(id) FROM questions WHERE category = :category'),
+    ('category seek', 'SELECT * FROM questions WHERE category = :category AND id > :after ORDER BY id LIMIT 11'),
+    ('quiz random', 'SELECT * FROM questions WHERE category = :category AND id NOT IN (1, 2, 3, 4, 5) ORDER BY random() LIMIT 1'),
+    ('quiz by difficulty', 'SELECT id FROM questions WHERE category = :category AND difficulty = :difficulty'),
+)
+PARAMETERS = {'category': CATEGORY, 'after': 1000, 'difficulty': 3}
+
+
+def set_indexes(enabled):
+    for index in Question.__table__.indexes:
+        db.session.execute(text('DROP INDEX IF EXISTS {}'.format(index.name)))
+        db.session.commit()
+        if enabled:
+            index.create(db.engine)
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(text('ANALYZE questions'))
+    else:
+        db.session.execute(text('ANALYZE'))
+    db.session.commit()
+
+
+def plan(sql):
+    explain = 'EXPLAIN ANALYZE ' if db.engine.dialect.name == 'postgresql' else 'EXPLAIN QUERY PLAN '
+    rows = db.session.execute(text(explain + sql), PARAMETERS).fetchall()
+    return '\n'.join('    ' + ' '.join(str(column) for column in row) for row in rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--database-path', default=None)
+    args = parser.parse_args()
+
+    app, fresh = bench_app(args.database_path)
+    with app.app_context():
+        if fresh:
+            generate(args.rows)
+        results = {}
+        for phase, enabled in (('before', False), ('after', True)):
+            set_indexes(enabled)
+            print('== {} ({} indexes)'.format(phase, 'with' if enabled else 'without'))
+            for name, sql in QUERIES:
+                milliseconds, _ = timed(lambda: db.session.execute(text(sql), PARAMETERS).fetchall(), args.repeat)
+                results.setdefault(name, {})[phase] = milliseconds
+                print('{}: {:.2f} ms\n{}'.format(name, milliseconds, plan(sql)))
+        print('== summary')
+        print('{:<20} {:>10} {:>10}'.format('query', 'before ms', 'after ms'))
+        for name, timings in results.items():
+            print('{:<20} {:>10.2f} {:>10.2f}'.format(name, timings['before'], timings['after']))
+
+
+if __name__ == '__main__':
+    main()
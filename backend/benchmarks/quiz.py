@@ -0,0 +1,62 @@
+"""
+Compares drawing an adaptive quiz question from the (category, difficulty) pools
+with the ORDER BY random() query it replaces.
+
+Run from the backend folder:
+
+    python -m benchmarks.quiz --rows 100000
+
+By default the questions are generated in a temporary SQLite database,
+pass --database-path to run against a Postgres database instead.
+"""
+import argparse
+import random
+
+from sqlalchemy import func
+
+from models import Question
+from flaskr.quiz import ALL_CATEGORIES, QuizPools
+from .common import bench_app, generate, timed
+
+# (category, difficulty, number of previous questions) of each case
+CASES = ((ALL_CATEGORIES, 3, 0), (ALL_CATEGORIES, 3, 20), (2, 5, 0), (2, 5, 20), (2, 1, 200))
+
+
+def random_order(category, difficulty, previous_questions):
+    #the query a quiz without pools needs, the database sorts every candidate row by a random key.
+    query = Question.query.filter(Question.difficulty == difficulty, ~Question.id.in_(previous_questions))
+    if category != ALL_CATEGORIES:
+        query = query.filter(Question.category == category)
+    return query.order_by(func.random()).first()
+
+
+def from_pools(pools, category, difficulty, previous_questions):
+    question_ids = pools.sample(category, set(previous_questions), 1, difficulty)
+    return Question.query.get(question_ids[0]) if question_ids else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--database-path', default=None)
+    args = parser.parse_args()
+
+    app, fresh = bench_app(args.database_path)
+    with app.app_context():
+        if fresh:
+            generate(args.rows)
+        pools = QuizPools()
+        build_ms, _ = timed(pools.build, 1)
+        print('pools build: {:.1f} ms for {} questions'.format(build_ms, len(pools.keys)))
+        print('{:<9} {:>10} {:>9} {:>14} {:>10}'.format('category', 'difficulty', 'previous', 'random() ms', 'pools ms'))
+        for category, difficulty, previous in CASES:
+            previous_questions = random.sample(range(1, args.rows + 1), previous)
+            scan_ms, scanned = timed(lambda: random_order(category, difficulty, previous_questions), args.repeat)
+            pools_ms, drawn = timed(lambda: from_pools(pools, category, difficulty, previous_questions), args.repeat)
+            assert scanned.difficulty == drawn.difficulty == difficulty
+            print('{:<9} {:>10} {:>9} {:>14.2f} {:>10.2f}'.format(category, difficulty, previous, scan_ms, pools_ms))
+
+
+if __name__ == '__main__':
+    main()
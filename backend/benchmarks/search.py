@@ -0,0 +1,44 @@
+"""
+Compares the trigram question index with the ILIKE scan it replaces.
+
+Run from the backend folder:
+
+    python -m benchmarks.search --rows 100000
+
+By default the questions are generated in a temporary SQLite database,
+pass --database-path to run against a Postgres database instead.
+"""
+import argparse
+
+from models import Question
+from flaskr.search import QuestionIndex
+from .common import bench_app, generate, timed
+
+TERMS = ('title', 'world cup', 'zzzz', 'ean', 'painting by')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--database-path', default=None)
+    args = parser.parse_args()
+
+    app, fresh = bench_app(args.database_path)
+    with app.app_context():
+        if fresh:
+            generate(args.rows)
+        index = QuestionIndex()
+        build_ms, _ = timed(index.build, 1)
+        print('index build: {:.1f} ms for {} questions'.format(build_ms, len(index.texts)))
+        print('{:<14} {:>12} {:>12} {:>8}'.format('term', 'ilike ms', 'index ms', 'matches'))
+        for term in TERMS:
+            scan = Question.query.filter(Question.question.ilike('%{}%'.format(term))).with_entities(Question.id)
+            scan_ms, scan_rows = timed(scan.all, args.repeat)
+            index_ms, ids = timed(lambda: index.search(term), args.repeat)
+            assert len(scan_rows) == len(ids)
+            print('{:<14} {:>12.2f} {:>12.2f} {:>8}'.format(term, scan_ms, index_ms, len(ids)))
+
+
+if __name__ == '__main__':
+    main()
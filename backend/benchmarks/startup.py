@@ -0,0 +1,58 @@
+"""
+Measures how long create_app takes to boot, and the first request after it, with and without FAST_START.
+
+Run from the backend folder:
+
+    python -m benchmarks.startup --rows 100000
+
+By default the questions are generated in a temporary SQLite database,
+pass --database-path to run against a Postgres database instead.
+"""
+import argparse
+import time
+
+from flaskr import create_app
+from .common import bench_app, generate
+
+MODES = (
+    ('default', {}),
+    ('fast start', {'FAST_START': True}),
+    ('fast start + warm caches', {'FAST_START': True, 'WARM_CACHES': True}),
+)
+
+
+def boot(config):
+    """
+    @returns a tuple of the milliseconds create_app took and those of the first quiz request.
+    """
+    start = time.perf_counter()
+    app = create_app(config)
+    booted = time.perf_counter()
+    app.test_client().post('/quiz', json={'previous_questions': [], 'category': 0})
+    return (booted - start) * 1000, (time.perf_counter() - booted) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--database-path', default=None)
+    args = parser.parse_args()
+
+    app, fresh = bench_app(args.database_path)
+    with app.app_context():
+        if fresh:
+            generate(args.rows)
+    path = app.config['SQLALCHEMY_DATABASE_URI']
+    print('{:<26} {:>10} {:>16}'.format('mode', 'boot ms', 'first quiz ms'))
+    for name, config in MODES:
+        runs = [boot(dict(config, DATABASE_URL=path)) for _ in range(args.repeat)]
+        print('{:<26} {:>10.1f} {:>16.1f}'.format(
+            name,
+            sorted(run[0] for run in runs)[len(runs) // 2],
+            sorted(run[1] for run in runs)[len(runs) // 2],
+        ))
+
+
+if __name__ == '__main__':
+    main()
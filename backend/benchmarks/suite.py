@@ -0,0 +1,227 @@
+"""
+Load tests the trivia API on generated question banks and saves the latencies as JSON.
+
+Run from the backend folder:
+
+    python -m benchmarks.suite --sizes 10000,100000,1000000
+
+For every size a bank is generated in a temporary SQLite database, or in the
+Postgres database given with --database-path, whose questions and categories
+tables are dropped and created again for each size (this needs --reset). Then every
+scenario sends --requests requests from --concurrency threads, through the Flask
+test client or, with --server, through a local WSGI server over HTTP.
+
+The results go to benchmarks/results/<commit>.json. Pass --compare with an older
+results file to print the change of every percentile.
+"""
+import argparse
+import datetime
+import http.client
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import make_server
+
+from flaskr import create_app
+from flaskr.pagination import encode_cursor
+from .common import WORDS, CATEGORIES, bench_app, generate, reset_bank
+
+RESULTS_FOLDER = os.path.join(os.path.dirname(__file__), 'results')
+
+
+def scenarios(rows):
+    """
+    The requests of each scenario, drawn at random so caches do not answer all of them.
+    @param rows - the number of questions in the bank.
+    @returns a dict of scenario names to functions returning (method, path, JSON body).
+    """
+    pages = max(1, rows // 10)
+    return {
+        'questions_page': lambda: ('GET', '/questions?page={}'.format(random.randint(1, pages)), None),
+        #the cursor starts at the same random depth as questions_page, where OFFSET has to skip the rows before it.
+        'questions_cursor': lambda: ('GET', '/questions?limit=10&after={}'.format(encode_cursor(10 * (random.randint(1, pages) - 1))), None),
+        'category_page': lambda: ('GET', '/categories/{}/questions?page={}'.format(random.randint(1, len(CATEGORIES)), random.randint(1, max(1, pages // len(CATEGORIES)))), None),
+        'search': lambda: ('POST', '/questions/search', {'searchTerm': ' '.join(random.sample(WORDS, random.randint(1, 2)))}),
+        'quiz': lambda: ('POST', '/quiz', {'category': random.randint(0, len(CATEGORIES)), 'previous_questions': random.sample(range(1, rows + 1), 4)}),
+        'create_question': lambda: ('POST', '/questions', {'question': 'Benchmark question?', 'answer': 'answer', 'category': random.randint(1, len(CATEGORIES)), 'difficulty': 3}),
+    }
+
+
+class TestClientTransport:
+    """
+    Sends requests through the Flask test client, one client per thread.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.local = threading.local()
+
+    def send(self, method, path, body):
+        if not hasattr(self.local, 'client'):
+            self.local.client = self.app.test_client()
+        return self.local.client.open(path, method=method, json=body).status_code
+
+    def close(self):
+        pass
+
+
+class HTTPTransport:
+    """
+    Sends HTTP requests to a local server, over one kept-alive connection per thread.
+    """
+
+    def __init__(self, port):
+        self.port = port
+        self.local = threading.local()
+
+    def send(self, method, path, body):
+        if not hasattr(self.local, 'connection'):
+            self.local.connection = http.client.HTTPConnection('127.0.0.1', self.port)
+        data = json.dumps(body) if body is not None else None
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        self.local.connection.request(method, path, body=data, headers=headers)
+        response = self.local.connection.getresponse()
+        response.read()
+        return response.status
+
+    def close(self):
+        pass
+
+
+class ServerTransport(HTTPTransport):
+    """
+    Serves the app with a threaded werkzeug server on a free local port and sends HTTP requests to it.
+    """
+
+    def __init__(self, app):
+        #the request log of the server would drown the results.
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        super().__init__(self.server.server_port)
+
+    def close(self):
+        self.server.shutdown()
+
+
+def percentile(latencies, fraction):
+    #nearest-rank percentile of sorted latencies.
+    return latencies[min(len(latencies) - 1, max(0, int(round(fraction * len(latencies))) - 1))]
+
+
+def run_scenario(transport, make_request, requests, concurrency):
+    """
+    Sends requests of a scenario from concurrent threads.
+    @returns a dict of the count, errors, latency percentiles in milliseconds and throughput.
+    """
+    def one(_):
+        method, path, body = make_request()
+        start = time.perf_counter()
+        status = transport.send(method, path, body)
+        return (time.perf_counter() - start) * 1000, status
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        outcomes = list(executor.map(one, range(requests)))
+    elapsed = time.perf_counter() - start
+    latencies = sorted(latency for latency, _ in outcomes)
+    return {
+        'count': len(outcomes),
+        'errors': sum(status >= 500 for _, status in outcomes),
+        'mean_ms': sum(latencies) / len(latencies),
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+        'throughput_rps': len(outcomes) / elapsed,
+    }
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(results, path):
+    #prints the change of each percentile against an older results file, negative is faster.
+    with open(path) as file:
+        previous = json.load(file)
+    print('== compared with {} ({})'.format(previous.get('commit'), path))
+    for size, scenarios_results in results['results'].items():
+        for name, result in scenarios_results.items():
+            old = previous.get('results', {}).get(size, {}).get(name)
+            if old is None:
+                continue
+            changes = ' '.join(
+                '{} {:+.1f}%'.format(key[:-3], (result[key] - old[key]) / old[key] * 100 if old[key] else 0)
+                for key in ('p50_ms', 'p95_ms', 'p99_ms')
+            )
+            print('{:>8} {:<18} {}'.format(size, name, changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='10000,100000,1000000', help='comma-separated bank sizes')
+    parser.add_argument('--requests', type=int, default=500, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--scenarios', default=None, help='comma-separated scenarios, all by default')
+    parser.add_argument('--server', action='store_true', help='send HTTP requests to a local WSGI server')
+    parser.add_argument('--database-path', default=None)
+    parser.add_argument('--reset', action='store_true', help='allow dropping the questions and categories tables of --database-path')
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--compare', default=None, help='an older results file')
+    args = parser.parse_args()
+    if args.database_path and not args.reset:
+        parser.error('--database-path drops the questions and categories tables, pass --reset to confirm')
+
+    random.seed(0)
+    results = {
+        'commit': current_commit(),
+        'created': datetime.datetime.utcnow().isoformat() + 'Z',
+        'python': platform.python_version(),
+        'transport': 'server' if args.server else 'test_client',
+        'concurrency': args.concurrency,
+        'results': {},
+    }
+    for size in [int(size) for size in args.sizes.split(',')]:
+        bank, _ = bench_app(args.database_path)
+        with bank.app_context():
+            if args.database_path:
+                reset_bank()
+            generate(size)
+        path = bank.config['SQLALCHEMY_DATABASE_URI']
+        results['database'] = path.split(':')[0]
+        app = create_app({'DATABASE_URL': path, 'FAST_START': True, 'WARM_CACHES': True})
+        transport = ServerTransport(app) if args.server else TestClientTransport(app)
+        selected = scenarios(size)
+        if args.scenarios:
+            selected = {name: selected[name] for name in args.scenarios.split(',')}
+        print('== {} questions'.format(size))
+        print('{:<18} {:>9} {:>9} {:>9} {:>10} {:>7}'.format('scenario', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'errors'))
+        for name, make_request in selected.items():
+            result = run_scenario(transport, make_request, args.requests, args.concurrency)
+            results['results'].setdefault(str(size), {})[name] = result
+            print('{:<18} {:>9.2f} {:>9.2f} {:>9.2f} {:>10.1f} {:>7}'.format(
+                name, result['p50_ms'], result['p95_ms'], result['p99_ms'], result['throughput_rps'], result['errors']))
+        transport.close()
+
+    output = args.output or os.path.join(RESULTS_FOLDER, '{}.json'.format(results['commit']))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2, sort_keys=True)
+    print('saved {}'.format(output))
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,26 +1,27 @@
 import os
-from flask import Flask, request, abort, jsonify
+import click
+from flask import Flask, Response, request, abort, jsonify, stream_with_context
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 import random
-from sqlalchemy import func
 
-from models import setup_db, Question, Category
+from models import setup_db, config_value, flag, read_only, db, Question
+from .pagination import count_questions, paginate_questions, paginate_ids, tail_page, cursor_args, seek_questions
+from .search import SEARCH_MODES, init_search, search_question_ids, question_index
+from .quiz import MAX_QUIZ_BATCH, DIFFICULTIES, init_quiz, target_difficulty, quiz_pools
+from .categories import init_categories, category_cache
+from .versioning import init_versioning, conditional
+from .bulk import IMPORT_FORMATS, IMPORT_CHUNK_SIZE, parse_ndjson, parse_csv, import_questions, bulk_filters, bulk_values, delete_questions, update_questions
+from .export import export_rows, export_ndjson
+from .serialization import init_serialization, json_response
+from .snapshot import init_snapshot, catalog_snapshot, build_snapshot, draw_quiz_questions
+from .query_cache import SEARCH, CATEGORIES, init_query_cache, cached_query, query_key, normalize_term, category_namespace
+from .results import MAX_PLAYER_LENGTH, LEADERBOARD_LIMIT, init_results, quiz_results
+from .stats import init_stats, question_stats
+from .metrics import init_metrics, render_metrics
+from .compression import init_compression
+from .sessions import init_quiz_sessions, start_quiz_session, get_quiz_session, save_quiz_session, end_quiz_session
 
-# To be used in paginating the questions
-QUESTIONS_PER_PAGE = 10
-
-def paginate_questions(request, selection):
-        #sets a default value for the "page" variable, which is 1 unless otherwise specified.
-        page = request.args.get('page', 1, type=int)
-        #sets a default value for the "start" variable
-        start =  (page - 1) * QUESTIONS_PER_PAGE
-        #sets a default value for the "end" variable
-        end = start + QUESTIONS_PER_PAGE
-        #creates a list of questions from the selection
-        questions = [question.format() for question in selection]
-        #returns the questions from the list, starting at the "start" variable and ending at the "end" variable.
-        return questions[start:end]
 
 def create_app(test_config=None):
     """
@@ -30,21 +31,70 @@ def create_app(test_config=None):
     """
     # create and configure the app
     app = Flask(__name__)
-    setup_db(app)
-    CORS(app)
+    if test_config is not None:
+        app.config.from_mapping(test_config)
+    #FAST_START leaves the schema to "flask init-db" instead of checking it on every boot,
+    #WARM_CACHES loads the categories, the quiz pools and the search index before the first request,
+    #or builds the catalog snapshot in place of the pools and the index when there is one.
+    app.config['FAST_START'] = bool(config_value(app, 'FAST_START', flag))
+    app.config['WARM_CACHES'] = bool(config_value(app, 'WARM_CACHES', flag))
+    setup_db(app, create_tables=not app.config['FAST_START'])
+    init_metrics(app)
+    init_serialization(app)
+    init_versioning(app)
+    init_categories(app)
+    init_search(app)
+    init_quiz(app)
+    init_quiz_sessions(app)
+    init_stats(app)
+    init_results(app)
+    init_query_cache(app)
+    init_snapshot(app)
+    init_compression(app)
 
     """
     @TODO: Set up CORS. Allow '*' for origins. Delete the sample route after completing the TODOs
     """
     cors = CORS(app, resources={r"/*": {"origins": "*"}})
 
+    if app.config['WARM_CACHES']:
+        with app.app_context():
+            category_cache().all()
+            question_stats().ensure_built()
+            if app.config['CATALOG_SNAPSHOT']:
+                build_snapshot()
+            else:
+                quiz_pools().ensure_built()
+                if question_index() is not None:
+                    question_index().ensure_built()
+
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create the tables and indexes that do not exist yet."""
+        db.create_all()
+        click.echo('created the missing tables')
+
+    @app.cli.command('build-snapshot')
+    def build_snapshot_command():
+        """Write the catalog snapshot named by CATALOG_SNAPSHOT."""
+        if not app.config['CATALOG_SNAPSHOT']:
+            raise click.UsageError('CATALOG_SNAPSHOT is not set')
+        build_snapshot(force=True)
+        click.echo('wrote {}'.format(app.config['CATALOG_SNAPSHOT']))
+
+    if app.config['METRICS']:
+        @app.route('/metrics')
+        def metrics():
+            #Prometheus scrapes the request, SQL and cache metrics of this process.
+            return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
     """
     @TODO: Use the after_request decorator to set Access-Control-Allow
     """
     @app.after_request
     def after_request(response):
         response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization,true')
-        response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
+        response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,PATCH,POST,DELETE,OPTIONS')
         return response
 
     """
@@ -53,15 +103,17 @@ def create_app(test_config=None):
     for all available categories.
     """
     @app.route('/categories')
+    @read_only
+    @conditional
     def get_all_categories():
         #defines a function that will return a JSON response with the category types for a given category id.
-        categories = Category.query.all()
+        categories = category_cache().all()
         categoriesDict = {}
         """
-        The code iterates through all of the category objects in the Category.query.all() collection and stores the type for each category in a dictionary.
+        The code iterates through all of the cached categories and stores the type for each category in a dictionary.
         """
         for category in categories:
-            categoriesDict[category.id] = category.type 
+            categoriesDict[category['id']] = category['type']
         #returns the JSON response with the success flag set to True and the categories dictionary as the value.
         return jsonify({
             'success': True,
@@ -84,12 +136,36 @@ def create_app(test_config=None):
     """
 
     @app.route('/questions')
+    @read_only
+    @conditional
     def retrieve_questions():
-        #Retrieves all questions from the database.
-        questions = Question.query.order_by(Question.id).all()
-        #Retrieves all categories from the database
-        current_questions = paginate_questions(request, questions)
-        categories = Category.query.all()
+        #Reads the "after" and "limit" arguments of cursor pagination, a malformed cursor is a bad request.
+        try:
+            cursor = cursor_args(request)
+        except ValueError:
+            abort(400)
+        #With a catalog snapshot, the questions are read from it instead of the database.
+        snapshot = catalog_snapshot()
+        if cursor is not None:
+            #Seeks on the primary key instead of counting and skipping rows, the listing ends when "next_cursor" is None.
+            if snapshot is not None:
+                current_questions, next_cursor = snapshot.seek(None, *cursor)
+            else:
+                current_questions, next_cursor = seek_questions(Question.query, *cursor)
+            return json_response({
+                'success': True,
+                'questions': current_questions,
+                'next_cursor': next_cursor,
+                "categories": category_cache().all(),
+                'current_category': None
+            })
+        #Retrieves the current page of questions and the total number of questions from the database.
+        if snapshot is not None:
+            current_questions, total_questions = snapshot.paginate(request)
+        else:
+            current_questions, total_questions = paginate_questions(request, Question.query.order_by(Question.id))
+        #Retrieves all categories from the category cache
+        categories = category_cache().all()
         #Checks to see if there are any questions. If there are no questions, it sends back a 404 error.
         if len(current_questions) == 0:
             abort(404)
@@ -101,11 +177,11 @@ def create_app(test_config=None):
         - "categories" is a list of all the categories in the database. 
         - "current_category" is set to None if the user is not currently on a category page.
         """
-        return jsonify({
+        return json_response({
             'success': True,
             'questions': current_questions,
-            'total_questions': len(questions),
-            "categories": [category.format() for category in categories],
+            'total_questions': total_questions,
+            "categories": categories,
             'current_category': None
         })
 
@@ -136,6 +212,55 @@ def create_app(test_config=None):
         except:
             abort(422)
 
+    """
+    Bulk delete and update of the questions matching a list of ids, a category and a difficulty,
+    each one statement in one transaction instead of one request and one commit per question.
+    """
+    @app.route('/questions', methods=['DELETE'])
+    def delete_questions_endpoint():
+        body = request.get_json()
+        #The code needs at least one filter, a body without any would delete every question.
+        if not isinstance(body, dict):
+            abort(400)
+        try:
+            conditions = bulk_filters(body)
+        except ValueError:
+            abort(422)
+        if conditions is None:
+            abort(400)
+        try:
+            deleted = delete_questions(conditions)
+        except Exception:
+            abort(422)
+        #returns the number of questions deleted.
+        return jsonify({
+            'success': True,
+            'deleted': deleted
+        })
+
+    @app.route('/questions', methods=['PATCH'])
+    def update_questions_endpoint():
+        body = request.get_json()
+        #The new values are under 'set', the filters pick the questions as for the bulk delete.
+        if not isinstance(body, dict) or body.get('set') is None:
+            abort(400)
+        try:
+            conditions = bulk_filters(body)
+            values = bulk_values(body['set'], category_ids())
+        except ValueError:
+            abort(422)
+        if conditions is None:
+            abort(400)
+        try:
+            updated = update_questions(conditions, values)
+        except Exception:
+            abort(422)
+        #returns the number of questions updated.
+        return jsonify({
+            'success': True,
+            'updated': updated
+        })
+
     """
     @TODO:
     Create an endpoint to POST a new question,
@@ -170,27 +295,96 @@ def create_app(test_config=None):
             )
             #The code will then insert the new Question object into the questions list.
             new_question.insert()
-            #The code will then get a list of all the questions in the database and paginate them using the paginate_questions function.
-            questions = Question.query.order_by(Question.id).all()
-            current_questions = paginate_questions(request, questions)
+            #The code will then count the questions, which only reads the primary key index.
+            total_questions = count_questions(Question.query)
             """
             The code will then send back a JSON response with the following information:
 
             - "success" will be set to True if the question was created successfully.
             - "created" will be set to the ID of the newly created question.
-            - "questions" will be set to the list of questions that were paginated.
+            - "question" will be set to the newly created question.
             - "total_questions" will be set to the total number of questions in the database.
+
+            The 'response' argument asks for more:
+            - "tail" adds "questions", the last page, where the new question is, and its "page" number.
+            - "full" adds "questions", the page given by the 'page' argument, as this endpoint used to return.
             """
-            return jsonify({
+            response = {
                 'success': True,
                 'created': new_question.id,
-                'questions': current_questions,
-                'total_questions': len(questions)
-            })
+                'question': new_question.format(),
+                'total_questions': total_questions
+            }
+            mode = request.args.get('response', 'lean')
+            if mode == 'tail':
+                response['questions'], response['page'] = tail_page(total_questions)
+            elif mode == 'full':
+                response['questions'], _ = paginate_questions(request, Question.query.order_by(Question.id))
+            return jsonify(response)
 
         except:
             abort(422)
 
+    """
+    Bulk import of questions, as NDJSON (one JSON object per line) or CSV with a header row.
+    The rows are streamed into the database in chunks instead of one commit per question.
+    """
+    def import_format(requested, content_type=None, filename=None):
+        #The format is taken from the 'format' argument, then from the content type or the file name.
+        if requested:
+            return requested
+        if 'csv' in (content_type or '') or (filename or '').endswith('.csv'):
+            return 'csv'
+        return 'ndjson'
+
+    def category_ids():
+        return {category['id'] for category in category_cache().all()}
+
+    @app.route('/questions/import', methods=['POST'])
+    def import_questions_endpoint():
+        file_format = import_format(request.args.get('format'), request.content_type)
+        if file_format not in IMPORT_FORMATS:
+            abort(400)
+        #The code reads the body line by line from the request stream, it is never loaded whole.
+        parse = parse_csv if file_format == 'csv' else parse_ndjson
+        report = import_questions(parse(request.stream), category_ids())
+        return jsonify(dict(report.format(), success=True))
+
+    @app.cli.command('import-questions')
+    @click.argument('file', type=click.File('rb'))
+    @click.option('--format', 'file_format', type=click.Choice(IMPORT_FORMATS), help='Defaults to csv for .csv files, ndjson otherwise.')
+    @click.option('--chunk-size', default=IMPORT_CHUNK_SIZE, show_default=True, help='Rows loaded per transaction.')
+    def import_questions_command(file, file_format, chunk_size):
+        """Import questions from an NDJSON or CSV file, - reads standard input."""
+        parse = parse_csv if import_format(file_format, filename=file.name) == 'csv' else parse_ndjson
+        report = import_questions(parse(file), category_ids(), chunk_size)
+        for error in report.errors:
+            click.echo('line {}: {}'.format(error['line'], error['error']), err=True)
+        click.echo('imported {} questions, {} rejected'.format(report.imported, report.total_errors))
+
+    """
+    Export of the whole question bank as NDJSON, for backups and other services.
+    """
+    @app.route('/questions/export')
+    @read_only
+    def export_questions():
+        #Optional filters on the category and the difficulty, a filter that is not a number is a bad request
+        #rather than no filter, which would export every question.
+        category = request.args.get('category', type=int)
+        difficulty = request.args.get('difficulty', type=int)
+        if ('category' in request.args and category is None) or ('difficulty' in request.args and difficulty is None):
+            abort(400)
+        #The export is gzip'd when the client accepts it.
+        compress = 'gzip' in request.accept_encodings
+        rows = export_rows(category, difficulty)
+        #The rows are streamed as they are read, so memory use does not grow with the number of questions.
+        response = Response(stream_with_context(export_ndjson(rows, compress)), mimetype='application/x-ndjson')
+        response.headers['Content-Disposition'] = 'attachment; filename=questions.ndjson'
+        if compress:
+            response.headers['Content-Encoding'] = 'gzip'
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+
     """
     @TODO:
     Create a POST endpoint to get questions based on a search term.
@@ -202,32 +396,55 @@ def create_app(test_config=None):
     Try using the word "title" to start.
     """
     @app.route('/questions/search', methods=['POST'])
+    @read_only
     def search_questions():
         body = request.get_json()
         """
         The code begins by checking if the body of the request is empty or if the 'searchTerm' key is empty.
         If either is true, the code aborts and sends a 400 HTTP status code.
         """
+        #'searchMode' is 'substring' (the default) to match the whole term, or 'words' to match every word of it,
+        #any other mode is unprocessable, checked before the lookup whose failures all end in 404.
+        if isinstance(body, dict) and body.get('searchMode', 'substring') not in SEARCH_MODES:
+            abort(422)
         try:
             if body is None or body['searchTerm'] is None:
                 abort(400)
             #sets the 'searchTerm' key to the value of the 'body.get('searchTerm')' expression.
             searchTerm = body.get('searchTerm')
-            #The code uses the 'Question.query.filter(Question.question.ilike(f'%{'searchTerm'}%')).all()' expression to get a list of all questions that match the search term.
-            results = Question.query.filter(Question.question.ilike(f'%{searchTerm}%')).all()
-            #checks if the length of the list of questions is zero. If it is, the code aborts and sends a 404 HTTP status code.
-            if len(results) == 0:
+            searchMode = body.get('searchMode', 'substring')
+
+            def search():
+                #The code looks the term up in the catalog snapshot, or else in the question index, which return the matches best match first.
+                snapshot = catalog_snapshot()
+                ids = search_question_ids(searchTerm, searchMode) if snapshot is None else None
+                if snapshot is not None:
+                    matching_questions, total_results = snapshot.search_page(request, searchTerm, searchMode)
+                elif ids is not None:
+                    matching_questions, total_results = paginate_ids(request, ids)
+                else:
+                    #Without an index, the code uses the 'Question.question.ilike' filter to build a query for all questions that match the search term.
+                    words = searchTerm.split() if searchMode == 'words' else [searchTerm]
+                    results = Question.query.filter(*[Question.question.ilike(f'%{word}%') for word in words]).order_by(Question.id)
+                    #paginate the matching questions.
+                    matching_questions, total_results = paginate_questions(request, results)
+                return {'questions': matching_questions, 'total_results': total_results}
+
+            #Popular terms are served from the query cache, keyed by the normalized term and the page arguments,
+            #results ranked by the index or the snapshot of this process are not shared with the other workers.
+            key = query_key('search', searchMode, normalize_term(searchTerm, searchMode), sorted(request.args.items(multi=True)))
+            result = cached_query([SEARCH], key, search, shared=question_index() is None and 'catalog_snapshot' not in app.extensions)
+            #checks if there are no matching questions. If so, the code aborts and sends a 404 HTTP status code.
+            if result['total_results'] == 0:
                 abort(404)
-            #paginate the list of questions.
-            matching_questions = paginate_questions(request, results)
             """
             The code sets the 'success' key to True and the 'questions' key to the list of matching questions.
             The code sets the 'total_results' key to the length of the list of questions.
             """
-            return jsonify({
+            return json_response({
                 'success': True,
-                'questions': matching_questions,
-                'total_results': len(results)
+                'questions': result['questions'],
+                'total_results': result['total_results']
             })
 
         except:
@@ -242,31 +459,84 @@ def create_app(test_config=None):
     category to be shown.
     """
     @app.route('/categories/<int:category_id>/questions')
+    @read_only
+    @conditional
     def questions_by_category(category_id):
-        
+        #Reads the "after" and "limit" arguments of cursor pagination, a malformed cursor is a bad request.
+        try:
+            cursor = cursor_args(request)
+        except ValueError:
+            abort(400)
+
         try:
             #The code tries to get a category by the given category_id.
-            category =  Category.query.filter(Category.id == category_id).one_or_none()
+            category = category_cache().get(category_id)
             #If the category is not found, the code aborts and sends a 404 error.
             if category is None:
                 abort(404)
-            #The code gets all the questions in the given category and paginates them.
-            category_questions = Question.query.filter(Question.category==category_id).all()
-            questions = paginate_questions(request, category_questions)
+
+            def listing():
+                snapshot = catalog_snapshot()
+                if snapshot is not None:
+                    if cursor is not None:
+                        questions, next_cursor = snapshot.seek(category_id, *cursor)
+                        return {'questions': questions, 'next_cursor': next_cursor}
+                    questions, total_results = snapshot.paginate(request, category_id)
+                    return {'questions': questions, 'total_results': total_results}
+                if cursor is not None:
+                    #The code seeks on (category, id) past the cursor instead of counting and skipping rows.
+                    questions, next_cursor = seek_questions(Question.query.filter(Question.category==category_id), *cursor)
+                    return {'questions': questions, 'next_cursor': next_cursor}
+                #The code gets all the questions in the given category and paginates them.
+                category_questions = Question.query.filter(Question.category==category_id).order_by(Question.id)
+                questions, total_results = paginate_questions(request, category_questions)
+                return {'questions': questions, 'total_results': total_results}
+
+            #The listing is served from the query cache, which a write to this category or to the categories invalidates,
+            #listings of an app serving from the snapshot it maps are not shared with the other workers.
+            key = query_key('category', category_id, sorted(request.args.items(multi=True)))
+            result = cached_query([CATEGORIES, category_namespace(category_id)], key, listing, shared='catalog_snapshot' not in app.extensions)
+            if cursor is not None:
+                return json_response(dict(result, success=True, current_category=category_id))
             #If there are no questions in the category, the code sends a 404 error.
-            if len(questions) == 0:
+            if len(result['questions']) == 0:
                 abort(404)
             #The code returns the success, questions, and total_results variables.
-            return jsonify({
+            return json_response({
             'success': True,
-            'questions': questions,
-            'total_results': len(category_questions),
+            'questions': result['questions'],
+            'total_results': result['total_results'],
             'current_category': category_id
             })
 
         except:
             abort(404)
 
+    """
+    GET endpoint for the number of questions by category and by difficulty.
+    The counts are kept in memory, so no question is read to answer it.
+    """
+    @app.route('/stats')
+    @read_only
+    @conditional
+    def get_stats():
+        total, by_category, by_difficulty, breakdown = question_stats().summary()
+        #every category is listed, those without questions with zeros.
+        categories = {}
+        for category in category_cache().all():
+            categories[category['id']] = {
+                'type': category['type'],
+                'total_questions': by_category.get(category['id'], 0),
+                'difficulties': {difficulty: count for difficulty, count in breakdown.get(category['id'], {}).items() if difficulty is not None}
+            }
+        return jsonify({
+            'success': True,
+            'total_questions': total,
+            'uncategorized_questions': by_category.get(None, 0),
+            'difficulties': {difficulty: count for difficulty, count in by_difficulty.items() if difficulty is not None},
+            'categories': categories
+        })
+
     """
     @TODO:
     Create a POST endpoint to get questions to play the quiz.
@@ -279,6 +549,7 @@ def create_app(test_config=None):
     and shown whether they were correct or not.
     """
     @app.route('/quiz', methods=['POST'])
+    @read_only
     def play_quiz():
         body = request.get_json()
         #The code checks if the request is empty or if the previous questions and category are empty.
@@ -291,27 +562,148 @@ def create_app(test_config=None):
             previous_questions = body.get('previous_questions')
             category = body.get('category')
             
-            if category == 0:
-                #If the category is 0, the code randomly selects questions from the Question model to be used in the quiz.
-                questions = Question.query.order_by(func.random())
-            else:
-                #Else, the code filters the questions by category and orders them randomly.
-                questions = Question.query.filter(Question.category==category).order_by(func.random())
-            #The code retrieves the first question from the filtered questions and formats it.
-            question = questions.filter(Question.id.notin_(previous_questions)).first()
-            #If the question is None, the code returns a success message.
-            if question is None:
+            #With 'recent_answers', whether each answer so far was right, the quiz is adaptive:
+            #the code aims at a difficulty next to that of the last question ('difficulty'), higher after right answers and lower after wrong ones.
+            difficulty = None
+            adaptive = {}
+            recent_answers = body.get('recent_answers')
+            if recent_answers is not None:
+                last_difficulty = body.get('difficulty')
+                if not isinstance(recent_answers, list) or not all(isinstance(answer, bool) for answer in recent_answers):
+                    abort(422)
+                if last_difficulty is not None and (isinstance(last_difficulty, bool) or last_difficulty not in DIFFICULTIES):
+                    abort(422)
+                difficulty = target_difficulty(recent_answers, last_difficulty)
+                adaptive = {'target_difficulty': difficulty}
+
+            count = body.get('count')
+            if count is not None:
+                #With a 'count', the code returns up to that many distinct questions at once, so a client can prefetch a whole round.
+                if not isinstance(count, int) or isinstance(count, bool) or count < 1 or count > MAX_QUIZ_BATCH:
+                    abort(422)
+                questions = draw_quiz_questions(category, previous_questions, count, difficulty)
                 return jsonify({
-                'success': True
+                'success': True,
+                'questions': questions,
+                **adaptive
+                })
+            #The code draws a random question id of the category (0 meaning all of them) that is not among the previous questions,
+            #from the in-memory quiz pools, and only loads that question.
+            #With a catalog snapshot, the question is read from it instead of the database.
+            questions = draw_quiz_questions(category, previous_questions, 1, difficulty)
+            #If there is no question left, the code returns a success message.
+            if not questions:
+                return jsonify({
+                'success': True,
+                **adaptive
                 })
             #Otherwise, the code returns the success message and the formatted question
             return jsonify({
                 'success': True,
-                'question': question.format()
+                'question': questions[0],
+                **adaptive
             })
         except:
             abort(422)
 
+    """
+    Quiz sessions keep the previous questions on the server,
+    so a client only sends its session token to get the next question.
+    """
+    @app.route('/quiz/sessions', methods=['POST'])
+    def create_quiz_session():
+        body = request.get_json()
+        #The code checks that a category was sent, 0 meaning all categories, a category that is not a valid id is unprocessable.
+        if not isinstance(body, dict) or body.get('category') is None:
+            abort(400)
+        try:
+            token = start_quiz_session(body['category'])
+        except ValueError:
+            abort(422)
+        return jsonify({
+            'success': True,
+            'session': token,
+            'expires_in': app.config['QUIZ_SESSION_TTL']
+        })
+
+    @app.route('/quiz/sessions/<token>/next', methods=['POST'])
+    @read_only
+    def next_session_question(token):
+        #Unknown and expired sessions are both reported as not found.
+        session = get_quiz_session(token)
+        if session is None:
+            abort(404)
+        try:
+            #The code draws a question the session has not seen yet, exactly as play_quiz does with previous_questions.
+            questions = draw_quiz_questions(session.category, session.seen, 1)
+        except:
+            abort(422)
+        #If there is no question left, the code returns a success message.
+        if not questions:
+            return jsonify({
+            'success': True
+            })
+        #The code remembers the question in the session before returning it.
+        session.seen.append(questions[0]['id'])
+        save_quiz_session(token, session)
+        return jsonify({
+            'success': True,
+            'question': questions[0]
+        })
+
+    @app.route('/quiz/sessions/<token>', methods=['DELETE'])
+    def delete_quiz_session(token):
+        if not end_quiz_session(token):
+            abort(404)
+        return jsonify({
+            'success': True,
+            'deleted': token
+        })
+
+    """
+    Quiz results are buffered and written in batches, the leaderboards are served from memory.
+    """
+    @app.route('/quiz/results', methods=['POST'])
+    def record_quiz_result():
+        body = request.get_json()
+        if body is None:
+            abort(400)
+        player = body.get('player')
+        category = body.get('category')
+        score = body.get('score')
+        questions = body.get('questions')
+        #The code checks the player name and that the score is a whole number of right answers out of the questions asked.
+        if not isinstance(player, str) or not player.strip() or len(player.strip()) > MAX_PLAYER_LENGTH:
+            abort(422)
+        if not all(isinstance(value, int) and not isinstance(value, bool) for value in (category, score, questions)):
+            abort(422)
+        if questions < 1 or not 0 <= score <= questions:
+            abort(422)
+        #The category is 0 for a quiz of all categories, or one that exists.
+        if category != 0 and category_cache().get(category) is None:
+            abort(422)
+        rank = quiz_results().record(player.strip(), category, score, questions)
+        return jsonify({
+            'success': True,
+            'rank': rank
+        })
+
+    @app.route('/leaderboard')
+    @read_only
+    def get_leaderboard():
+        category = request.args.get('category', 0, type=int)
+        limit = request.args.get('limit', min(LEADERBOARD_LIMIT, app.config['LEADERBOARD_SIZE']), type=int)
+        if limit < 1 or limit > app.config['LEADERBOARD_SIZE']:
+            abort(422)
+        if category != 0 and category_cache().get(category) is None:
+            abort(404)
+        results = quiz_results().top(category, limit)
+        return jsonify({
+            'success': True,
+            'category': category,
+            'leaderboard': [dict(result, created=result['created'].isoformat()) for result in results]
+        })
+
     """
     @TODO:
     Create error handlers for all expected errors
@@ -0,0 +1,618 @@
+import asyncio
+import json
+import logging
+import time
+from urllib.parse import parse_qsl
+
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import HTTPException, BadRequest, abort
+from werkzeug.routing import Map, Rule
+
+from models import config_value, default_database_path
+from .pagination import QUESTIONS_PER_PAGE, encode_cursor, cursor_args
+from .quiz import MAX_QUIZ_BATCH, DIFFICULTIES, QuizPools, target_difficulty
+from .query_cache import QUERY_CACHE_SIZE, QUERY_CACHE_TTL, SEARCH, MemoryCacheBackend, QueryCache, query_key, normalize_term
+from .search import SEARCH_BACKENDS, SEARCH_MODES, QuestionIndex
+from .versioning import CATALOG_CHECK_INTERVAL
+from .serialization import QUESTION_FIELDS, make_encoder
+
+# Messages of the error bodies, those of the error handlers of the Flask app
+ERROR_MESSAGES = {
+    400: 'bad request',
+    404: 'resource not found',
+    405: 'method not allowed',
+    422: 'request cannot be processed',
+    500: 'internal server error'
+}
+# Headers the Flask app adds to every response
+CORS_HEADERS = [
+    (b'access-control-allow-headers', b'Content-Type,Authorization,true'),
+    (b'access-control-allow-methods', b'GET,PUT,PATCH,POST,DELETE,OPTIONS')
+]
+# Connections of each asyncpg pool, unless DB_POOL_SIZE and DB_MAX_OVERFLOW say otherwise, as for SQLAlchemy
+POOL_SIZE = 5
+MAX_OVERFLOW = 10
+# Columns of a formatted question, in the order of QUESTION_FIELDS
+QUESTION_COLUMNS = ', '.join(QUESTION_FIELDS)
+
+logger = logging.getLogger(__name__)
+
+
+def asyncpg_dsn(url):
+    #asyncpg takes postgresql:// and postgres:// URLs, without the "+driver" of a SQLAlchemy URL.
+    scheme, rest = url.split('://', 1)
+    return '{}://{}'.format(scheme.split('+')[0], rest)
+
+
+def as_integer(value):
+    #Postgres casts the strings psycopg2 sends for an integer column, asyncpg wants an int.
+    return int(value) if isinstance(value, str) else value
+
+
+def where(conditions):
+    return ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+
+
+def question_dicts(rows):
+    return [dict(row) for row in rows]
+
+
+async def paginate_questions(connection, request, conditions=(), params=()):
+    """
+    Reads the page given by the "page" argument of a question listing, and counts the listing.
+    @param connection - an asyncpg connection.
+    @param request - the current request.
+    @param conditions - the SQL conditions of the listing, numbered from $1.
+    @param params - their arguments.
+    @returns a tuple of the formatted questions of the page and the total number of matching questions.
+    """
+    page = request.args.get('page', 1, type=int)
+    total = await connection.fetchval('SELECT count(id) FROM questions{}'.format(where(conditions)), *params)
+    #pages start at 1, anything lower can never have questions in it.
+    if page < 1:
+        return [], total
+    rows = await connection.fetch(
+        'SELECT {} FROM questions{} ORDER BY id OFFSET ${} LIMIT ${}'.format(
+            QUESTION_COLUMNS, where(conditions), len(params) + 1, len(params) + 2),
+        *params, (page - 1) * QUESTIONS_PER_PAGE, QUESTIONS_PER_PAGE)
+    return question_dicts(rows), total
+
+
+async def seek_questions(connection, after, limit, conditions=(), params=()):
+    """
+    Keyset pagination of a question listing, as pagination.seek_questions does.
+    @returns a tuple of the formatted questions and the cursor of the next page, None on the last page.
+    """
+    conditions = list(conditions) + ['id > ${}'.format(len(params) + 1)]
+    rows = await connection.fetch(
+        'SELECT {} FROM questions{} ORDER BY id LIMIT ${}'.format(QUESTION_COLUMNS, where(conditions), len(params) + 2),
+        *params, after, limit + 1)
+    next_cursor = encode_cursor(rows[limit - 1]['id']) if len(rows) > limit else None
+    return question_dicts(rows[:limit]), next_cursor
+
+
+async def fetch_questions(connection, question_ids):
+    #loads questions by primary key, in one query.
+    rows = await connection.fetch('SELECT {} FROM questions WHERE id = ANY($1::int[])'.format(QUESTION_COLUMNS), question_ids)
+    return {row['id']: dict(row) for row in rows}
+
+
+async def bump_revision(connection):
+    """
+    Counts a write in the shared catalog revision, in the transaction of the write, as models.bump_revision does.
+    @returns the value of the revision the write makes, None when the row is missing.
+    """
+    return await connection.fetchval(
+        'UPDATE catalog_revision SET value = value + 1, modified = CASE WHEN modified >= $1 THEN modified + 1 ELSE $1 END '
+        'WHERE id = 1 RETURNING value',
+        int(time.time()))
+
+
+async def read_revision(connection):
+    #the value of the shared catalog revision, None before the table is created.
+    import asyncpg
+    try:
+        return await connection.fetchval('SELECT value FROM catalog_revision WHERE id = 1')
+    except asyncpg.UndefinedTableError:
+        return None
+
+
+async def read_body(receive):
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+    return body
+
+
+class AsyncRequest:
+    """
+    The parts of an ASGI request the views read, "args" and get_json behave as those of a Flask request.
+    """
+
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.args = MultiDict(parse_qsl(scope['query_string'].decode('latin-1'), keep_blank_values=True))
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+        self.body = body
+
+    def get_json(self):
+        #as with Flask, a body not sent as JSON is None and malformed JSON is a bad request.
+        mimetype = self.headers.get('content-type', '').split(';')[0].strip().lower()
+        if mimetype != 'application/json' and not (mimetype.startswith('application/') and mimetype.endswith('+json')):
+            return None
+        try:
+            return json.loads(self.body.decode('utf-8'))
+        except ValueError:
+            raise BadRequest()
+
+
+class AsyncTriviaApp:
+    """
+    ASGI variant of the app create_app builds, served by uvicorn or any other ASGI server.
+    It has the categories, question listing, search, quiz, creation and deletion endpoints,
+    with the JSON bodies and errors of the Flask app, and queries Postgres through asyncpg,
+    so one worker waits on many queries at once instead of one per thread.
+    The quiz pools and the search index are loaded when the server starts and kept in step with the questions written through this app,
+    the shared catalog revision is read every CATALOG_CHECK_INTERVAL seconds and they are loaded again after writes of other processes.
+    The ranked ids of the searches are cached in the process, unless QUERY_CACHE is "off".
+    Conditional requests, the response cache and the catalog snapshot are left to the Flask app.
+    """
+
+    def __init__(self, test_config=None):
+        self.config = {
+            'SEARCH_BACKEND': 'index',
+            'CATEGORY_CACHE_TTL': None,
+            'QUERY_CACHE': 'memory',
+            'QUERY_CACHE_SIZE': QUERY_CACHE_SIZE,
+            'QUERY_CACHE_TTL': QUERY_CACHE_TTL,
+            'CATALOG_CHECK_INTERVAL': CATALOG_CHECK_INTERVAL,
+            'JSON_ENCODER': 'auto',
+            'JSON_SORT_KEYS': True,
+            'JSON_AS_ASCII': True
+        }
+        if test_config is not None:
+            self.config.update(test_config)
+        if self.config['SEARCH_BACKEND'] not in SEARCH_BACKENDS:
+            raise ValueError('unknown SEARCH_BACKEND {}'.format(self.config['SEARCH_BACKEND']))
+        self.encoder = make_encoder(self.config['JSON_ENCODER'], self.config['JSON_SORT_KEYS'], self.config['JSON_AS_ASCII'])
+        self.url_map = Map([
+            Rule('/categories', endpoint='get_all_categories', methods=['GET']),
+            Rule('/questions', endpoint='retrieve_questions', methods=['GET']),
+            Rule('/questions', endpoint='create_question', methods=['POST']),
+            Rule('/questions/<int:question_id>', endpoint='delete_question', methods=['DELETE']),
+            Rule('/questions/search', endpoint='search_questions', methods=['POST']),
+            Rule('/categories/<int:category_id>/questions', endpoint='questions_by_category', methods=['GET']),
+            Rule('/quiz', endpoint='play_quiz', methods=['POST'])
+        ])
+        self.quiz_pools = QuizPools()
+        self.question_index = QuestionIndex() if self.config['SEARCH_BACKEND'] == 'index' else None
+        #ranking the matches of a common term takes long enough to hold up every other request of the worker.
+        self.query_cache = None
+        if self.config['QUERY_CACHE'] != 'off':
+            self.query_cache = QueryCache(MemoryCacheBackend(self.config['QUERY_CACHE_SIZE']), self.config['QUERY_CACHE_TTL'])
+        self.categories = None
+        self.categories_by_id = None
+        self.categories_loaded_at = None
+        self.pool = None
+        self.replica = None
+        self.startup = None
+        #the shared revision every write of which the pools and the index hold, and when it was last read.
+        self.revision = None
+        self.checked_at = None
+        self.loading = False
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            request = AsyncRequest(scope, await read_body(receive))
+            status, payload, headers = await self.dispatch(request)
+            await self.respond(send, request, status, payload, headers)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.start()
+                except Exception as error:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(error)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def start(self):
+        #the lifespan startup, or the first request with servers that have none, opens the pools once.
+        if self.startup is None:
+            self.startup = asyncio.ensure_future(self.open())
+        try:
+            await self.startup
+        except Exception:
+            self.startup = None
+            raise
+
+    async def open(self):
+        #asyncpg is only needed by the ASGI app.
+        import asyncpg
+        url = config_value(self, 'DATABASE_URL') or default_database_path
+        replica_url = config_value(self, 'DATABASE_REPLICA_URL')
+        size = config_value(self, 'DB_POOL_SIZE', int)
+        overflow = config_value(self, 'DB_MAX_OVERFLOW', int)
+        size = POOL_SIZE if size is None else size
+        options = {'min_size': size, 'max_size': size + (MAX_OVERFLOW if overflow is None else overflow)}
+        timeout = config_value(self, 'DB_STATEMENT_TIMEOUT', int)
+        if timeout is not None:
+            options['server_settings'] = {'statement_timeout': str(timeout)}
+        self.pool = await asyncpg.create_pool(asyncpg_dsn(url), **options)
+        #the read endpoints query DATABASE_REPLICA_URL when it is set, as read_only does for the Flask app.
+        self.replica = await asyncpg.create_pool(asyncpg_dsn(replica_url), **options) if replica_url else self.pool
+        await self.load()
+
+    async def load(self):
+        """
+        Loads the quiz pools and the search index from one query, in new objects that replace the old ones once built,
+        so requests go on being served meanwhile. Writes of this app made while it runs are left to the next load.
+        """
+        self.loading = True
+        try:
+            async with self.replica.acquire() as connection:
+                #the rows are read after the revision, so they hold every write it counts,
+                #and in id order, so the index appends every id to the end of its posting lists.
+                revision = await read_revision(connection)
+                rows = await connection.fetch('SELECT id, question, category, difficulty FROM questions ORDER BY id')
+            quiz_pools, question_index = await asyncio.get_event_loop().run_in_executor(None, self.build, rows)
+            self.quiz_pools, self.question_index = quiz_pools, question_index
+            self.categories = None
+            self.invalidate_searches()
+            self.revision = revision
+        finally:
+            self.loading = False
+
+    def build(self, rows):
+        #builds the mirrors in a thread, a large question bank would hold up the event loop.
+        quiz_pools = QuizPools()
+        quiz_pools.built = True
+        for row in rows:
+            quiz_pools.add(row['id'], row['category'], row['difficulty'])
+        question_index = None
+        if self.config['SEARCH_BACKEND'] == 'index':
+            question_index = QuestionIndex()
+            question_index.built = True
+            for row in rows:
+                question_index.add(row['id'], row['question'])
+        return quiz_pools, question_index
+
+    async def sync(self):
+        #reads the shared revision every CATALOG_CHECK_INTERVAL seconds at most, and loads again after writes of other processes.
+        now = time.monotonic()
+        if self.loading or (self.checked_at is not None and now - self.checked_at < self.config['CATALOG_CHECK_INTERVAL']):
+            return
+        self.checked_at = now
+        async with self.replica.acquire() as connection:
+            revision = await read_revision(connection)
+        if revision != self.revision:
+            await self.load()
+
+    def written(self, revision):
+        #a write of this app, already applied to the pools and the index, needs no load when it directly follows the revision they hold.
+        if not self.loading and revision is not None and self.revision is not None and revision == self.revision + 1:
+            self.revision = revision
+
+    async def close(self):
+        if self.replica is not None and self.replica is not self.pool:
+            await self.replica.close()
+        if self.pool is not None:
+            await self.pool.close()
+        self.pool = self.replica = self.startup = None
+
+    async def dispatch(self, request):
+        """
+        Runs the view of a request.
+        @returns a tuple of the status, the payload to send as JSON, None for an empty body, and extra headers.
+        """
+        adapter = self.url_map.bind('localhost')
+        try:
+            if request.method == 'OPTIONS':
+                #CORS preflights get an empty answer for every route, as flask-cors gives them.
+                methods = adapter.allowed_methods(request.path)
+                if not methods:
+                    abort(404)
+                return 200, None, [(b'allow', ', '.join(sorted(set(methods) | {'OPTIONS'})).encode())]
+            endpoint, view_args = adapter.match(request.path, request.method)
+            await self.start()
+            await self.sync()
+            return 200, await getattr(self, endpoint)(request, **view_args), []
+        except HTTPException as error:
+            return error.code, self.error(error.code, error.name.lower()), []
+        except Exception:
+            logger.exception('Exception on %s [%s]', request.path, request.method)
+            return 500, self.error(500), []
+
+    def error(self, code, name=None):
+        return {
+            'success': False,
+            'error': code,
+            'message': ERROR_MESSAGES.get(code, name)
+        }
+
+    async def respond(self, send, request, status, payload, headers):
+        body = self.encoder(payload) if payload is not None else b''
+        headers = headers + CORS_HEADERS + [(b'content-length', str(len(body)).encode())]
+        if payload is not None:
+            headers.append((b'content-type', b'application/json'))
+        #a request from a page echoes its origin, as flask-cors does with "*" origins.
+        origin = request.headers.get('origin')
+        if origin is not None:
+            headers += [(b'access-control-allow-origin', origin.encode('latin-1')), (b'vary', b'Origin')]
+        else:
+            headers.append((b'access-control-allow-origin', b'*'))
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body if request.method != 'HEAD' else b''})
+
+    async def category_list(self):
+        """
+        Process-local copy of the categories table, reloaded after CATEGORY_CACHE_TTL seconds when it is set.
+        @returns the formatted categories, ordered by id.
+        """
+        ttl = self.config['CATEGORY_CACHE_TTL']
+        if self.categories is None or (ttl is not None and time.monotonic() - self.categories_loaded_at >= ttl):
+            async with self.replica.acquire() as connection:
+                rows = await connection.fetch('SELECT id, type FROM categories ORDER BY id')
+            categories = [dict(row) for row in rows]
+            self.categories, self.categories_by_id = categories, {category['id']: category for category in categories}
+            self.categories_loaded_at = time.monotonic()
+        return self.categories
+
+    async def category(self, category_id):
+        await self.category_list()
+        return self.categories_by_id.get(category_id)
+
+    async def get_all_categories(self, request):
+        categories = await self.category_list()
+        return {
+            'success': True,
+            'categories': {category['id']: category['type'] for category in categories}
+        }
+
+    async def retrieve_questions(self, request):
+        #a malformed cursor is a bad request.
+        try:
+            cursor = cursor_args(request)
+        except ValueError:
+            abort(400)
+        categories = await self.category_list()
+        async with self.replica.acquire() as connection:
+            if cursor is not None:
+                questions, next_cursor = await seek_questions(connection, *cursor)
+                return {
+                    'success': True,
+                    'questions': questions,
+                    'next_cursor': next_cursor,
+                    'categories': categories,
+                    'current_category': None
+                }
+            questions, total_questions = await paginate_questions(connection, request)
+        if len(questions) == 0:
+            abort(404)
+        return {
+            'success': True,
+            'questions': questions,
+            'total_questions': total_questions,
+            'categories': categories,
+            'current_category': None
+        }
+
+    async def delete_question(self, request, question_id):
+        try:
+            async with self.pool.acquire() as connection, connection.transaction():
+                row = await connection.fetchrow('DELETE FROM questions WHERE id = $1 RETURNING id', question_id)
+                revision = await bump_revision(connection) if row is not None else None
+            if row is None:
+                abort(404)
+            self.quiz_pools.remove(question_id)
+            if self.question_index is not None:
+                self.question_index.remove(question_id)
+            self.invalidate_searches()
+            self.written(revision)
+            return {
+                'success': True,
+                'deleted': question_id
+            }
+        except Exception:
+            abort(422)
+
+    async def create_question(self, request):
+        body = request.get_json()
+        question = body.get('question', None)
+        answer = body.get('answer', None)
+        category = body.get('category', None)
+        difficulty = body.get('difficulty', None)
+
+        if question is None or answer is None or category is None or difficulty is None:
+            abort(400)
+        try:
+            async with self.pool.acquire() as connection:
+                async with connection.transaction():
+                    row = await connection.fetchrow(
+                        'INSERT INTO questions (question, answer, category, difficulty) VALUES ($1, $2, $3, $4) RETURNING {}'.format(QUESTION_COLUMNS),
+                        question, answer, as_integer(category), as_integer(difficulty))
+                    revision = await bump_revision(connection)
+                new_question = dict(row)
+                self.quiz_pools.add(new_question['id'], new_question['category'], new_question['difficulty'])
+                if self.question_index is not None:
+                    self.question_index.add(new_question['id'], new_question['question'])
+                self.invalidate_searches()
+                self.written(revision)
+                total_questions = await connection.fetchval('SELECT count(id) FROM questions')
+                response = {
+                    'success': True,
+                    'created': new_question['id'],
+                    'question': new_question,
+                    'total_questions': total_questions
+                }
+                #the 'response' argument adds the last page ("tail") or the page of the 'page' argument ("full").
+                mode = request.args.get('response', 'lean')
+                if mode == 'tail':
+                    last_page = max(1, (total_questions - 1) // QUESTIONS_PER_PAGE + 1)
+                    rows = await connection.fetch(
+                        'SELECT {} FROM questions ORDER BY id DESC LIMIT $1'.format(QUESTION_COLUMNS),
+                        total_questions - (last_page - 1) * QUESTIONS_PER_PAGE)
+                    response['questions'], response['page'] = question_dicts(rows)[::-1], last_page
+                elif mode == 'full':
+                    response['questions'], _ = await paginate_questions(connection, request)
+            return response
+        except Exception:
+            abort(422)
+
+    async def search_questions(self, request):
+        body = request.get_json()
+        if isinstance(body, dict) and body.get('searchMode', 'substring') not in SEARCH_MODES:
+            abort(422)
+        try:
+            if body is None or body['searchTerm'] is None:
+                abort(400)
+            search_term = body.get('searchTerm')
+            search_mode = body.get('searchMode', 'substring')
+            async with self.replica.acquire() as connection:
+                if self.question_index is not None:
+                    #the index ranks the matching ids, only those of the page are loaded.
+                    ids = self.ranked_ids(search_term, search_mode)
+                    page = request.args.get('page', 1, type=int)
+                    start = (page - 1) * QUESTIONS_PER_PAGE
+                    page_ids = ids[start:start + QUESTIONS_PER_PAGE] if page >= 1 else []
+                    rows = await fetch_questions(connection, page_ids) if page_ids else {}
+                    questions = [rows[question_id] for question_id in page_ids if question_id in rows]
+                    total_results = len(ids)
+                else:
+                    words = search_term.split() if search_mode == 'words' else [search_term]
+                    conditions = ['question ILIKE ${}'.format(position) for position in range(1, len(words) + 1)]
+                    questions, total_results = await paginate_questions(
+                        connection, request, conditions, ['%{}%'.format(word) for word in words])
+            if total_results == 0:
+                abort(404)
+            return {
+                'success': True,
+                'questions': questions,
+                'total_results': total_results
+            }
+        except Exception:
+            abort(404)
+
+    def ranked_ids(self, search_term, search_mode):
+        if self.query_cache is None:
+            return self.question_index.search(search_term, search_mode)
+        key = query_key('search_ids', search_mode, normalize_term(search_term, search_mode))
+        return self.query_cache.fetch([SEARCH], key, lambda: self.question_index.search(search_term, search_mode))
+
+    def invalidate_searches(self):
+        if self.query_cache is not None:
+            self.query_cache.invalidate(SEARCH)
+
+    async def questions_by_category(self, request, category_id):
+        #a malformed cursor is a bad request.
+        try:
+            cursor = cursor_args(request)
+        except ValueError:
+            abort(400)
+        try:
+            if await self.category(category_id) is None:
+                abort(404)
+            async with self.replica.acquire() as connection:
+                if cursor is not None:
+                    questions, next_cursor = await seek_questions(connection, *cursor, ['category = $1'], [category_id])
+                    return {
+                        'success': True,
+                        'questions': questions,
+                        'next_cursor': next_cursor,
+                        'current_category': category_id
+                    }
+                questions, total_results = await paginate_questions(connection, request, ['category = $1'], [category_id])
+            if len(questions) == 0:
+                abort(404)
+            return {
+                'success': True,
+                'questions': questions,
+                'total_results': total_results,
+                'current_category': category_id
+            }
+        except Exception:
+            abort(404)
+
+    async def draw_quiz_questions(self, category, previous_questions, count, difficulty=None):
+        """
+        Draws distinct quiz questions from the quiz pools, as quiz.next_quiz_questions does.
+        @returns a list of at most count formatted questions.
+        """
+        excluded = set(previous_questions)
+        questions = []
+        while len(questions) < count:
+            question_ids = self.quiz_pools.sample(category, excluded, count - len(questions), difficulty)
+            if not question_ids:
+                break
+            async with self.replica.acquire() as connection:
+                rows = await fetch_questions(connection, question_ids)
+            missing = []
+            for question_id in question_ids:
+                excluded.add(question_id)
+                if question_id in rows:
+                    questions.append(rows[question_id])
+                else:
+                    missing.append(question_id)
+            if missing and self.replica is not self.pool:
+                #a replica may not have a question just written yet, only those the primary lacks as well were deleted.
+                async with self.pool.acquire() as connection:
+                    found = await fetch_questions(connection, missing)
+                missing = [question_id for question_id in missing if question_id not in found]
+            #the questions deleted by another process are dropped, another one is drawn in their place.
+            for question_id in missing:
+                self.quiz_pools.remove(question_id)
+        return questions
+
+    async def play_quiz(self, request):
+        body = request.get_json()
+        if body is None or body['previous_questions'] is None or body['category'] is None:
+            abort(400)
+        try:
+            previous_questions = body.get('previous_questions')
+            category = body.get('category')
+            #'recent_answers' makes the quiz adaptive, as with the Flask app.
+            difficulty = None
+            adaptive = {}
+            recent_answers = body.get('recent_answers')
+            if recent_answers is not None:
+                last_difficulty = body.get('difficulty')
+                if not isinstance(recent_answers, list) or not all(isinstance(answer, bool) for answer in recent_answers):
+                    abort(422)
+                if last_difficulty is not None and (isinstance(last_difficulty, bool) or last_difficulty not in DIFFICULTIES):
+                    abort(422)
+                difficulty = target_difficulty(recent_answers, last_difficulty)
+                adaptive = {'target_difficulty': difficulty}
+
+            count = body.get('count')
+            if count is not None:
+                if not isinstance(count, int) or isinstance(count, bool) or count < 1 or count > MAX_QUIZ_BATCH:
+                    abort(422)
+                questions = await self.draw_quiz_questions(category, previous_questions, count, difficulty)
+                return dict({'success': True, 'questions': questions}, **adaptive)
+            questions = await self.draw_quiz_questions(category, previous_questions, 1, difficulty)
+            if not questions:
+                return dict({'success': True}, **adaptive)
+            return dict({'success': True, 'question': questions[0]}, **adaptive)
+        except Exception:
+            abort(422)
+
+
+def create_asgi_app(test_config=None):
+    """
+    Create the ASGI app, for "uvicorn --factory flaskr.asgi:create_asgi_app".
+    @param test_config - the test config for the app itself.
+    @returns the ASGI app
+    """
+    return AsyncTriviaApp(test_config)
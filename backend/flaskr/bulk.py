@@ -0,0 +1,289 @@
+import csv
+import io
+import json
+
+from models import db, Question, bump_revision, notify_question_listeners
+
+# Rows loaded per transaction
+IMPORT_CHUNK_SIZE = 5000
+# Row errors listed in an import report, the others are only counted
+MAX_REPORTED_ERRORS = 1000
+# Formats the importer reads
+IMPORT_FORMATS = ('ndjson', 'csv')
+# Columns of an imported question, in COPY order
+IMPORT_COLUMNS = ('question', 'answer', 'category', 'difficulty')
+# Ids a bulk delete or update can list
+MAX_BULK_IDS = 1000
+# Columns a bulk delete or update can filter on, besides the ids, and that a bulk update can set
+BULK_COLUMNS = ('category', 'difficulty')
+
+
+def parse_ndjson(lines):
+    """
+    Reads one JSON object per line, blank lines are skipped.
+    @param lines - an iterable of str or bytes lines.
+    @returns a generator of (line number, row or ValueError) tuples.
+    """
+    for number, line in enumerate(lines, 1):
+        try:
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+        except UnicodeDecodeError as error:
+            yield number, ValueError('invalid UTF-8: {}'.format(error))
+            continue
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError as error:
+            yield number, ValueError('invalid JSON: {}'.format(error))
+
+
+class DecodedLines:
+    """
+    The lines of a CSV import as str for the csv module, with the number of the last one read.
+    A line that is not UTF-8 is read as a blank line, which the reader skips, and its error is kept.
+    """
+
+    def __init__(self, lines):
+        self.lines = iter(lines)
+        self.number = 0
+        self.errors = []
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = next(self.lines)
+        self.number += 1
+        if isinstance(line, bytes):
+            try:
+                line = line.decode('utf-8')
+            except UnicodeDecodeError as error:
+                self.errors.append((self.number, ValueError('invalid UTF-8: {}'.format(error))))
+                line = '\n'
+        return line
+
+
+def parse_csv(lines):
+    """
+    Reads CSV with a header row naming the question, answer, category and difficulty columns.
+    @param lines - an iterable of str or bytes lines.
+    @returns a generator of (line number, row or ValueError) tuples.
+    """
+    decoded = DecodedLines(lines)
+    reader = csv.DictReader(decoded)
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            break
+        except csv.Error as error:
+            #the reader goes on with the next line, as it does after a row it could read.
+            row = ValueError('invalid CSV: {}'.format(error))
+        yield from decoded.errors
+        del decoded.errors[:]
+        yield decoded.number, row
+    yield from decoded.errors
+
+
+def validate_row(row, categories):
+    """
+    Checks an imported row and converts it to the values of the questions table.
+    @param row - the parsed row.
+    @param categories - the ids of the existing categories.
+    @returns a dict of the IMPORT_COLUMNS.
+    @raises ValueError with the reason the row is rejected.
+    """
+    if not isinstance(row, dict):
+        raise ValueError('row is not an object')
+    values = {}
+    for column in ('question', 'answer'):
+        value = row.get(column)
+        if not isinstance(value, str) or not value.strip():
+            raise ValueError('{} is missing'.format(column))
+        values[column] = value
+    for column in ('category', 'difficulty'):
+        value = row.get(column)
+        #JSON integers, booleans aside, and the digit strings of CSV, a float or "1.9" is not truncated.
+        if isinstance(value, str) and value.strip().isdecimal():
+            value = int(value)
+        if not is_integer(value):
+            raise ValueError('{} is not an integer'.format(column))
+        values[column] = value
+    if values['category'] not in categories:
+        raise ValueError('category {} does not exist'.format(values['category']))
+    if not 1 <= values['difficulty'] <= 5:
+        raise ValueError('difficulty must be between 1 and 5')
+    return values
+
+
+def copy_chunk(connection, chunk):
+    #Postgres loads the chunk with COPY, through the DBAPI connection under the SQLAlchemy one.
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for values in chunk:
+        writer.writerow([values[column] for column in IMPORT_COLUMNS])
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    cursor.copy_expert('COPY questions ({}) FROM STDIN WITH (FORMAT csv)'.format(', '.join(IMPORT_COLUMNS)), buffer)
+
+
+def load_chunk(chunk):
+    """
+    Loads validated rows in a single transaction, with COPY on Postgres and an executemany INSERT elsewhere.
+    @param chunk - a list of dicts of the IMPORT_COLUMNS.
+    """
+    with db.engine.begin() as connection:
+        if connection.dialect.name == 'postgresql':
+            copy_chunk(connection, chunk)
+        else:
+            connection.execute(Question.__table__.insert(), chunk)
+        bump_revision(connection)
+
+
+class ImportReport:
+    """
+    The outcome of an import: the number of rows loaded and the rows rejected, with their line and reason.
+    """
+
+    def __init__(self):
+        self.imported = 0
+        self.errors = []
+        self.total_errors = 0
+
+    def reject(self, lines, reason):
+        for line in lines:
+            self.total_errors += 1
+            if len(self.errors) < MAX_REPORTED_ERRORS:
+                self.errors.append({'line': line, 'error': reason})
+
+    def format(self):
+        return {
+            'imported': self.imported,
+            'errors': self.errors,
+            'total_errors': self.total_errors
+        }
+
+
+def import_questions(rows, categories, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Streams parsed rows into the questions table, chunk by chunk, so memory stays bounded by the chunk size.
+    Invalid rows are reported and skipped, a chunk the database refuses is reported as a whole.
+    @param rows - the (line number, row) tuples of parse_ndjson or parse_csv.
+    @param categories - the ids of the existing categories.
+    @param chunk_size - the rows loaded per transaction.
+    @returns an ImportReport.
+    """
+    report = ImportReport()
+    chunk, lines = [], []
+
+    def flush():
+        try:
+            load_chunk(chunk)
+            report.imported += len(chunk)
+        except Exception as error:
+            report.reject(lines, 'database error: {}'.format(str(error).splitlines()[0]))
+        del chunk[:], lines[:]
+
+    try:
+        for line, row in rows:
+            try:
+                if isinstance(row, ValueError):
+                    raise row
+                chunk.append(validate_row(row, categories))
+                lines.append(line)
+            except ValueError as error:
+                report.reject([line], str(error))
+                continue
+            if len(chunk) >= chunk_size:
+                flush()
+        if chunk:
+            flush()
+    finally:
+        #the ids COPY assigned are not known here, so whatever mirrors the questions reloads them,
+        #even when reading the rows failed after some chunks were committed.
+        if report.imported:
+            notify_question_listeners('reload', None)
+    return report
+
+
+def is_integer(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def bulk_filters(body):
+    """
+    Reads which questions a bulk delete or update applies to, those matching every filter given.
+    @param body - the JSON body, with "ids", a list of question ids, "category" and "difficulty".
+    @returns a list of conditions on the questions, or None when the body has no filter.
+    @raises ValueError if a filter is not valid.
+    """
+    conditions = []
+    ids = body.get('ids')
+    if ids is not None:
+        if not isinstance(ids, list) or not ids or len(ids) > MAX_BULK_IDS or not all(is_integer(value) for value in ids):
+            raise ValueError('ids must be a list of at most {} question ids'.format(MAX_BULK_IDS))
+        conditions.append(Question.id.in_(ids))
+    for column in BULK_COLUMNS:
+        value = body.get(column)
+        if value is not None:
+            if not is_integer(value):
+                raise ValueError('{} is not an integer'.format(column))
+            conditions.append(getattr(Question, column) == value)
+    return conditions or None
+
+
+def bulk_values(values, categories):
+    """
+    Checks the values a bulk update sets.
+    @param values - a dict of new values, for some of the BULK_COLUMNS.
+    @param categories - the ids of the existing categories.
+    @returns the values.
+    @raises ValueError if the values are not valid.
+    """
+    if not isinstance(values, dict) or not values or not set(values) <= set(BULK_COLUMNS):
+        raise ValueError('only {} can be set'.format(' and '.join(BULK_COLUMNS)))
+    if not all(is_integer(value) for value in values.values()):
+        raise ValueError('the values must be integers')
+    if 'category' in values and values['category'] not in categories:
+        raise ValueError('category {} does not exist'.format(values['category']))
+    if 'difficulty' in values and not 1 <= values['difficulty'] <= 5:
+        raise ValueError('difficulty must be between 1 and 5')
+    return values
+
+
+def run_bulk(statement):
+    """
+    Runs a bulk statement in one transaction, rolled back if it fails.
+    @param statement - a function issuing the statement and returning the number of rows it matched.
+    @returns that number.
+    """
+    try:
+        count = statement()
+        if count:
+            bump_revision(db.session)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    if count:
+        #which questions changed is not read back, so whatever mirrors the questions reloads them.
+        notify_question_listeners('reload', None)
+    return count
+
+
+def delete_questions(conditions):
+    """
+    Deletes the questions matching every condition with a single DELETE.
+    @returns the number of questions deleted.
+    """
+    return run_bulk(lambda: Question.query.filter(*conditions).delete(synchronize_session=False))
+
+
+def update_questions(conditions, values):
+    """
+    Sets the values on the questions matching every condition with a single UPDATE.
+    @returns the number of questions updated.
+    """
+    return run_bulk(lambda: Question.query.filter(*conditions).update(values, synchronize_session=False))
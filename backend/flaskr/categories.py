@@ -0,0 +1,78 @@
+import threading
+import time
+
+from flask import current_app, has_app_context
+
+from models import Category, add_category_listener
+
+
+class CategoryCache:
+    """
+    Process-local copy of the categories table.
+    It is loaded on first use and dropped by invalidate(), which runs on every category write,
+    and after CATEGORY_CACHE_TTL seconds when a TTL is set.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.categories = None
+        self.by_id = None
+        self.loaded_at = None
+        self.hits = 0
+        self.misses = 0
+
+    def expired(self):
+        return self.ttl is not None and time.monotonic() - self.loaded_at >= self.ttl
+
+    def load(self):
+        with self.lock:
+            if self.categories is not None and not self.expired():
+                self.hits += 1
+                return self.categories, self.by_id
+            self.misses += 1
+            categories = [category.format() for category in Category.query.order_by(Category.id)]
+            self.categories = categories
+            self.by_id = {category['id']: category for category in categories}
+            self.loaded_at = time.monotonic()
+            return self.categories, self.by_id
+
+    def all(self):
+        """
+        @returns the formatted categories, ordered by id.
+        """
+        return self.load()[0]
+
+    def get(self, category_id):
+        """
+        @param category_id - the id of a category.
+        @returns the formatted category, or None if there is no such category.
+        """
+        return self.load()[1].get(category_id)
+
+    def invalidate(self):
+        with self.lock:
+            self.categories = None
+            self.by_id = None
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+def init_categories(app):
+    """
+    Attaches an empty category cache to the app, CATEGORY_CACHE_TTL sets its TTL in seconds.
+    @param app - the app itself.
+    """
+    app.extensions['category_cache'] = CategoryCache(app.config.setdefault('CATEGORY_CACHE_TTL', None))
+
+
+def category_cache():
+    return current_app.extensions['category_cache']
+
+
+@add_category_listener
+def invalidate_category_cache(action, category):
+    #any write to the categories drops the cached copy of the current app.
+    if has_app_context() and 'category_cache' in current_app.extensions:
+        category_cache().invalidate()
@@ -0,0 +1,126 @@
+import zlib
+
+from flask import current_app, request
+
+from .versioning import ResponseCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Encodings that can be picked with the COMPRESSION setting, "auto" adds brotli when it is installed
+COMPRESSION_MODES = ('auto', 'gzip', 'br', 'off')
+# Bodies smaller than this many bytes are sent as they are, unless COMPRESSION_MIN_SIZE says otherwise
+COMPRESSION_MIN_SIZE = 1024
+# Compressed bodies kept by the compressed cache, unless COMPRESSION_CACHE_SIZE says otherwise
+COMPRESSION_CACHE_SIZE = 256
+# zlib level of gzip bodies
+GZIP_LEVEL = 6
+# Quality of brotli bodies, the higher levels are too slow for bodies built on every request
+BROTLI_QUALITY = 5
+# Mimetypes worth compressing
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/plain', 'text/html', 'text/csv')
+# Cache-Control of successful GET responses by endpoint, CACHE_CONTROL adds to it and None removes an entry
+CACHE_CONTROL = {
+    'get_all_categories': 'public, max-age=3600',
+    'retrieve_questions': 'public, max-age=30',
+    'questions_by_category': 'public, max-age=30',
+    'get_stats': 'public, max-age=60'
+}
+
+
+def gzip_body(data):
+    #wbits 31 writes a gzip header and trailer around the deflate stream, with no timestamp in it.
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def brotli_body(data):
+    return brotli.compress(data, quality=BROTLI_QUALITY)
+
+
+# Compressors by Content-Encoding
+COMPRESSORS = {'br': brotli_body, 'gzip': gzip_body}
+
+
+def negotiate(accept_encodings, encodings):
+    """
+    Picks the encoding of a response.
+    @param accept_encodings - the parsed Accept-Encoding of the request.
+    @param encodings - the encodings the app offers, preferred first.
+    @returns the encoding the client weighs most, the preferred one on a tie, or None when it accepts none of them.
+    """
+    best = None
+    best_quality = 0
+    for encoding in encodings:
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def init_compression(app):
+    """
+    Compresses the responses of the app and sends the Cache-Control of CACHE_CONTROL.
+    COMPRESSION picks the encodings, COMPRESSION_MIN_SIZE the smallest body compressed
+    and COMPRESSION_CACHE_SIZE the size of the LRU of compressed conditional bodies.
+    @param app - the app itself.
+    """
+    mode = app.config.setdefault('COMPRESSION', 'auto')
+    min_size = app.config.setdefault('COMPRESSION_MIN_SIZE', COMPRESSION_MIN_SIZE)
+    if mode not in COMPRESSION_MODES:
+        raise ValueError('unknown COMPRESSION {}'.format(mode))
+    if mode == 'br' and brotli is None:
+        raise ValueError('COMPRESSION is br but brotli is not installed')
+    policies = dict(CACHE_CONTROL)
+    policies.update(app.config.setdefault('CACHE_CONTROL', {}))
+    policies = {endpoint: policy for endpoint, policy in policies.items() if policy is not None}
+    if mode == 'auto':
+        encodings = ('br', 'gzip') if brotli is not None else ('gzip',)
+    elif mode == 'off':
+        encodings = ()
+    else:
+        encodings = (mode,)
+    if encodings:
+        app.extensions['compressed_cache'] = ResponseCache(app.config.setdefault('COMPRESSION_CACHE_SIZE', COMPRESSION_CACHE_SIZE))
+
+    def cache_control(response):
+        policy = policies.get(request.endpoint)
+        if policy and request.method in ('GET', 'HEAD') and response.status_code in (200, 304) and 'Cache-Control' not in response.headers:
+            response.headers['Cache-Control'] = policy
+
+    def compress(response):
+        #streamed bodies and those already encoded, such as the gzip export, are left alone.
+        if response.is_streamed or response.direct_passthrough or 'Content-Encoding' in response.headers:
+            return
+        if response.status_code != 304 and response.mimetype not in COMPRESSIBLE_MIMETYPES:
+            return
+        #the body depends on Accept-Encoding even when this one is sent as it is.
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate(request.accept_encodings, encodings)
+        if encoding is None or response.content_length is None or response.content_length < min_size:
+            return
+        etag, weak = response.get_etag()
+        key = None
+        if etag is not None:
+            #the ETag names the catalog version, so a conditional body is compressed once per version.
+            key = (etag, request.path, tuple(sorted(request.args.items(multi=True))), encoding)
+        cache = current_app.extensions['compressed_cache']
+        body = cache.get(key) if key is not None else None
+        if body is None:
+            body = COMPRESSORS[encoding](response.get_data())
+            if key is not None:
+                cache.put(key, body)
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        #the encoded bytes differ from the identity ones, a weak tag still matches If-None-Match.
+        if etag is not None and not weak:
+            response.set_etag(etag, weak=True)
+
+    @app.after_request
+    def after_request(response):
+        cache_control(response)
+        if encodings:
+            compress(response)
+        return response
@@ -0,0 +1,55 @@
+import json
+import zlib
+
+from models import Question
+
+# Rows fetched from the database at a time
+EXPORT_BATCH_SIZE = 1000
+# Bytes gathered before a piece of the export is sent
+EXPORT_FLUSH_SIZE = 64 * 1024
+# Columns of an exported question, the keys of Question.format
+EXPORT_COLUMNS = ('id', 'question', 'answer', 'category', 'difficulty')
+
+
+def export_rows(category=None, difficulty=None):
+    """
+    Reads the questions to export in id order, as plain column tuples.
+    On Postgres stream_results keeps them in a server-side cursor, fetched EXPORT_BATCH_SIZE rows at a time.
+    @param category - only export this category, when given.
+    @param difficulty - only export this difficulty, when given.
+    @returns an iterator of tuples of the EXPORT_COLUMNS.
+    """
+    query = Question.query.with_entities(*[getattr(Question, column) for column in EXPORT_COLUMNS])
+    if category is not None:
+        query = query.filter(Question.category == category)
+    if difficulty is not None:
+        query = query.filter(Question.difficulty == difficulty)
+    return query.order_by(Question.id).execution_options(stream_results=True).yield_per(EXPORT_BATCH_SIZE)
+
+
+def export_ndjson(rows, compress=False):
+    """
+    Turns exported rows into NDJSON, one question per line, in pieces of about EXPORT_FLUSH_SIZE bytes.
+    @param rows - the tuples of export_rows.
+    @param compress - gzip the output.
+    @returns a generator of bytes.
+    """
+    #wbits 31 writes a gzip header and trailer around the deflate stream.
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buffer = []
+    size = 0
+    for row in rows:
+        line = json.dumps(dict(zip(EXPORT_COLUMNS, row))).encode() + b'\n'
+        buffer.append(line)
+        size += len(line)
+        if size >= EXPORT_FLUSH_SIZE:
+            data = b''.join(buffer)
+            buffer, size = [], 0
+            data = compressor.compress(data) if compressor else data
+            if data:
+                yield data
+    data = b''.join(buffer)
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
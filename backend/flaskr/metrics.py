@@ -0,0 +1,221 @@
+import bisect
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from models import config_value, flag
+
+# Upper bounds of the request latency buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Upper bounds of the response size buckets, in bytes
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+# Requests slower than this many milliseconds are logged with their SQL, unless SLOW_REQUEST_MS says otherwise
+SLOW_REQUEST_MS = 500
+# Statements kept per request for the slow-request log
+MAX_LOGGED_STATEMENTS = 50
+# Caches whose hit ratio is exported, by extension name, each has a stats() of hits and misses
+CACHE_EXTENSIONS = {'category_cache': 'categories', 'response_cache': 'responses', 'query_cache': 'queries', 'compressed_cache': 'compressed'}
+
+
+class Histogram:
+    """
+    Prometheus-style histogram: a count per bucket, the sum and the count of the observed values.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        #the exposition format counts every value under each bound, the last bucket is +Inf.
+        total = 0
+        for bound, count in zip(list(self.buckets) + ['+Inf'], self.counts):
+            total += count
+            yield bound, total
+
+
+class RequestMetrics:
+    """
+    What one request spent: its start, the SQL statements it ran and their total time.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.statements = 0
+        self.db_time = 0.0
+        self.sql = []
+
+    def record(self, statement, elapsed):
+        self.statements += 1
+        self.db_time += elapsed
+        if len(self.sql) < MAX_LOGGED_STATEMENTS:
+            self.sql.append((statement, elapsed))
+
+
+class Metrics:
+    """
+    Process-wide counters of the app, grouped by endpoint and method.
+    Every request takes the lock once, to add its observations.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.latency = {}
+        self.sizes = {}
+        self.statements = {}
+        self.db_time = {}
+
+    def observe(self, endpoint, method, status, duration, size, request_metrics):
+        route = (endpoint, method)
+        with self.lock:
+            key = (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            if route not in self.latency:
+                self.latency[route] = Histogram(LATENCY_BUCKETS)
+                self.sizes[route] = Histogram(SIZE_BUCKETS)
+                self.statements[route] = 0
+                self.db_time[route] = 0.0
+            self.latency[route].observe(duration)
+            #streamed responses have no length.
+            if size is not None:
+                self.sizes[route].observe(size)
+            self.statements[route] += request_metrics.statements
+            self.db_time[route] += request_metrics.db_time
+
+    def render(self, caches):
+        """
+        @param caches - a dict of cache names to their stats().
+        @returns the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+
+        def header(name, kind, description):
+            lines.append('# HELP {} {}'.format(name, description))
+            lines.append('# TYPE {} {}'.format(name, kind))
+
+        def histogram(name, histograms):
+            for (endpoint, method), values in sorted(histograms.items()):
+                labels = 'endpoint="{}",method="{}"'.format(endpoint, method)
+                for bound, count in values.cumulative():
+                    lines.append('{}_bucket{{{},le="{}"}} {}'.format(name, labels, bound, count))
+                lines.append('{}_sum{{{}}} {}'.format(name, labels, values.sum))
+                lines.append('{}_count{{{}}} {}'.format(name, labels, values.count))
+
+        with self.lock:
+            header('trivia_requests_total', 'counter', 'Requests served, by endpoint, method and status.')
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append('trivia_requests_total{{endpoint="{}",method="{}",status="{}"}} {}'.format(endpoint, method, status, count))
+            header('trivia_request_duration_seconds', 'histogram', 'Time to build the response.')
+            histogram('trivia_request_duration_seconds', self.latency)
+            header('trivia_response_size_bytes', 'histogram', 'Size of the response bodies that have a length.')
+            histogram('trivia_response_size_bytes', self.sizes)
+            header('trivia_sql_statements_total', 'counter', 'SQL statements run while serving requests.')
+            for (endpoint, method), count in sorted(self.statements.items()):
+                lines.append('trivia_sql_statements_total{{endpoint="{}",method="{}"}} {}'.format(endpoint, method, count))
+            header('trivia_db_seconds_total', 'counter', 'Time spent in SQL statements while serving requests.')
+            for (endpoint, method), seconds in sorted(self.db_time.items()):
+                lines.append('trivia_db_seconds_total{{endpoint="{}",method="{}"}} {}'.format(endpoint, method, seconds))
+        header('trivia_cache_hits_total', 'counter', 'Lookups answered by a cache.')
+        for name, stats in sorted(caches.items()):
+            lines.append('trivia_cache_hits_total{{cache="{}"}} {}'.format(name, stats['hits']))
+        header('trivia_cache_misses_total', 'counter', 'Lookups a cache could not answer.')
+        for name, stats in sorted(caches.items()):
+            lines.append('trivia_cache_misses_total{{cache="{}"}} {}'.format(name, stats['misses']))
+        header('trivia_cache_hit_ratio', 'gauge', 'Hits over lookups since the process started.')
+        for name, stats in sorted(caches.items()):
+            lookups = stats['hits'] + stats['misses']
+            lines.append('trivia_cache_hit_ratio{{cache="{}"}} {}'.format(name, stats['hits'] / lookups if lookups else 0))
+        #the caches that report them also export their size and evictions.
+        for metric, key, kind, description in (
+            ('trivia_cache_entries', 'size', 'gauge', 'Entries held by a cache.'),
+            ('trivia_cache_evictions_total', 'evictions', 'counter', 'Entries a cache dropped to stay within its size.'),
+        ):
+            header(metric, kind, description)
+            for name, stats in sorted(caches.items()):
+                if key in stats:
+                    lines.append('{}{{cache="{}"}} {}'.format(metric, name, stats[key]))
+        return '\n'.join(lines) + '\n'
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_statement(connection, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'request_metrics' in g:
+        connection.info.setdefault('statement_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def end_statement(connection, cursor, statement, parameters, context, executemany):
+    starts = connection.info.get('statement_start')
+    if starts and has_request_context() and 'request_metrics' in g:
+        g.request_metrics.record(statement, time.perf_counter() - starts.pop())
+
+
+@event.listens_for(Engine, 'handle_error')
+def fail_statement(context):
+    #a failed statement has no after_cursor_execute, its start is dropped here.
+    starts = context.connection.info.get('statement_start') if context.connection is not None else None
+    if starts:
+        starts.pop()
+
+
+def start_request():
+    g.request_metrics = RequestMetrics()
+
+
+def end_request(response):
+    request_metrics = g.pop('request_metrics', None)
+    if request_metrics is None:
+        return response
+    duration = time.perf_counter() - request_metrics.start
+    endpoint = request.endpoint or 'unmatched'
+    current_app.extensions['metrics'].observe(
+        endpoint, request.method, response.status_code, duration, response.content_length, request_metrics)
+    response.headers['Server-Timing'] = 'app;dur={:.2f}, db;dur={:.2f};desc="{} statements"'.format(
+        duration * 1000, request_metrics.db_time * 1000, request_metrics.statements)
+    slow = current_app.config['SLOW_REQUEST_MS']
+    if slow is not None and duration * 1000 >= slow:
+        current_app.logger.warning(
+            'slow request %s %s %s in %.1fms, %d statements in %.1fms:\n%s',
+            request.method, request.full_path.rstrip('?'), response.status_code, duration * 1000,
+            request_metrics.statements, request_metrics.db_time * 1000,
+            '\n'.join('  {:.1f}ms {}'.format(elapsed * 1000, ' '.join(statement.split())) for statement, elapsed in request_metrics.sql))
+    return response
+
+
+def init_metrics(app):
+    """
+    Instruments the app when METRICS is set: every response gets a Server-Timing header,
+    its latency, size and SQL are added to the metrics, and requests slower than SLOW_REQUEST_MS are logged.
+    @param app - the app itself.
+    """
+    app.config['METRICS'] = bool(config_value(app, 'METRICS', flag))
+    slow = config_value(app, 'SLOW_REQUEST_MS', int)
+    app.config['SLOW_REQUEST_MS'] = SLOW_REQUEST_MS if slow is None else slow or None
+    if not app.config['METRICS']:
+        return
+    app.extensions['metrics'] = Metrics()
+    app.before_request(start_request)
+    app.after_request(end_request)
+
+
+def render_metrics():
+    """
+    @returns the metrics of the current app and the hit ratios of its caches, as Prometheus text.
+    """
+    caches = {
+        label: current_app.extensions[name].stats()
+        for name, label in CACHE_EXTENSIONS.items()
+        if name in current_app.extensions
+    }
+    return current_app.extensions['metrics'].render(caches)
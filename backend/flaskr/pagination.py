@@ -0,0 +1,142 @@
+import base64
+import binascii
+
+from sqlalchemy import func
+
+from models import Question
+from .serialization import question_rows
+
+# To be used in paginating the questions
+QUESTIONS_PER_PAGE = 10
+
+
+def count_questions(selection):
+    """
+    Counts the rows a question query would return without loading them.
+    @param selection - an un-executed Question query.
+    @returns the number of matching questions.
+    """
+    #drops any ORDER BY, since it only slows the count down, and asks the database for COUNT(id) instead of the rows.
+    return selection.order_by(None).with_entities(func.count(Question.id)).scalar()
+
+
+def paginate_questions(request, selection):
+    """
+    Paginates a question query inside the database.
+    Only the rows of the requested page are fetched and formatted,
+    the total comes from a separate COUNT query.
+    @param request - the current request, read for the "page" argument.
+    @param selection - an un-executed Question query, already ordered.
+    @returns a tuple of the formatted questions of the page and the total number of matching questions.
+    """
+    #sets a default value for the "page" variable, which is 1 unless otherwise specified.
+    page = request.args.get('page', 1, type=int)
+    #pages start at 1, anything lower can never have questions in it, the total is still that of the whole selection.
+    if page < 1:
+        return [], count_questions(selection)
+    #sets a default value for the "start" variable
+    start = (page - 1) * QUESTIONS_PER_PAGE
+    #lets the database skip to the "start" row and return at most QUESTIONS_PER_PAGE rows,
+    #and creates a list of questions from the rows of this page only.
+    questions = question_rows(selection.offset(start).limit(QUESTIONS_PER_PAGE))
+    return questions, count_questions(selection)
+
+
+def tail_page(total):
+    """
+    Reads the last page of the questions, the one a new question lands on, without skipping rows.
+    The page is read backwards from the highest id and put back in id order.
+    @param total - the total number of questions.
+    @returns a tuple of the formatted questions of the last page and its page number.
+    """
+    if total == 0:
+        return [], 1
+    page = (total - 1) // QUESTIONS_PER_PAGE + 1
+    size = total - (page - 1) * QUESTIONS_PER_PAGE
+    rows = question_rows(Question.query.order_by(Question.id.desc()).limit(size))
+    return rows[::-1], page
+
+
+def paginate_ids(request, ids):
+    """
+    Paginates an ordered list of question ids, such as the result of a search.
+    Only the questions of the requested page are loaded, by primary key.
+    @param request - the current request, read for the "page" argument.
+    @param ids - the ids of every matching question, in the order to return them.
+    @returns a tuple of the formatted questions of the page and the total number of ids.
+    """
+    page = request.args.get('page', 1, type=int)
+    if page < 1:
+        return [], len(ids)
+    start = (page - 1) * QUESTIONS_PER_PAGE
+    page_ids = ids[start:start + QUESTIONS_PER_PAGE]
+    if not page_ids:
+        return [], len(ids)
+    #loads the page in one query and puts it back in the order of the ids.
+    rows = {question['id']: question for question in question_rows(Question.query.filter(Question.id.in_(page_ids)))}
+    questions = [rows[question_id] for question_id in page_ids if question_id in rows]
+    return questions, len(ids)
+
+
+# Upper bound for the "limit" argument of cursor pagination
+MAX_QUESTIONS_PER_PAGE = 100
+
+
+def encode_cursor(question_id):
+    """
+    Builds the opaque cursor handed back to clients as "next_cursor".
+    @param question_id - the id of the last question of the current page.
+    @returns a url-safe string.
+    """
+    return base64.urlsafe_b64encode(str(question_id).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Reads back a cursor built by encode_cursor.
+    @param cursor - the value of the "after" argument.
+    @returns the question id the next page starts after.
+    @raises ValueError if the cursor was not built by encode_cursor.
+    """
+    #an empty cursor starts from the beginning of the listing.
+    if not cursor:
+        return 0
+    #restores the padding stripped by encode_cursor.
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        return int(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (binascii.Error, UnicodeDecodeError) as error:
+        raise ValueError('invalid cursor') from error
+
+
+def cursor_args(request):
+    """
+    Reads the cursor pagination arguments of a request.
+    Cursor mode is used whenever "after" or "limit" is given, otherwise the classic "page" mode applies.
+    @param request - the current request.
+    @returns a tuple of the id to seek after and the page size, or None when the request uses "page".
+    @raises ValueError if the cursor or the limit is invalid.
+    """
+    if 'after' not in request.args and 'limit' not in request.args:
+        return None
+    after = decode_cursor(request.args.get('after', ''))
+    limit = request.args.get('limit', QUESTIONS_PER_PAGE, type=int)
+    if limit < 1 or limit > MAX_QUESTIONS_PER_PAGE:
+        raise ValueError('invalid limit')
+    return after, limit
+
+
+def seek_questions(selection, after, limit):
+    """
+    Keyset pagination of a question query.
+    The database seeks straight to the first id after the cursor through the primary key,
+    so deep pages cost the same as the first one.
+    @param selection - an un-executed Question query, without ORDER BY.
+    @param after - the id the page starts after.
+    @param limit - the maximum number of questions in the page.
+    @returns a tuple of the formatted questions and the cursor of the next page, None on the last page.
+    """
+    #asks for one extra row to know if there is a next page without counting.
+    rows = question_rows(selection.filter(Question.id > after).order_by(Question.id).limit(limit + 1))
+    next_cursor = encode_cursor(rows[limit - 1]['id']) if len(rows) > limit else None
+    return rows[:limit], next_cursor
@@ -0,0 +1,225 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, has_app_context
+
+from models import add_question_listener, add_category_listener
+from .sessions import LocalRedis
+
+# Query cache backends, "memory" keeps the results in this process, "redis" shares them between workers
+QUERY_CACHE_BACKENDS = ('memory', 'redis', 'off')
+# Results kept by the in-process backend, unless QUERY_CACHE_SIZE says otherwise
+QUERY_CACHE_SIZE = 1024
+# Seconds a cached result is served, unless QUERY_CACHE_TTL says otherwise
+QUERY_CACHE_TTL = 300
+# Namespace of the search results, and of the listings of every category
+SEARCH = 'search'
+CATEGORIES = 'categories'
+
+
+def category_namespace(category_id):
+    return 'category:{}'.format(category_id)
+
+
+def query_key(name, *parts):
+    """
+    @param name - the name of the query.
+    @param parts - its arguments, JSON serializable.
+    @returns the string key of the query.
+    """
+    return '{}:{}'.format(name, json.dumps(parts, sort_keys=True, separators=(',', ':')))
+
+
+def normalize_term(term, mode):
+    #case does not change what a search matches, nor does the spacing between the words of a "words" search.
+    term = term.lower()
+    return ' '.join(term.split()) if mode == 'words' else term
+
+
+class MemoryCacheBackend:
+    """
+    LRU of query results with a TTL, in this process.
+    Generations live apart from the LRU, an evicted generation would bring stale results back.
+    """
+
+    def __init__(self, size=QUERY_CACHE_SIZE):
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.generations = {}
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires <= time.monotonic():
+                del self.entries[key]
+                self.expirations += 1
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        if self.size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def generation(self, namespace):
+        with self.lock:
+            return self.generations.get(namespace, 0)
+
+    def bump(self, namespace):
+        with self.lock:
+            self.generations[namespace] = self.generations.get(namespace, 0) + 1
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.entries), 'evictions': self.evictions, 'expirations': self.expirations}
+
+
+class RedisCacheBackend:
+    """
+    Keeps the query results in Redis, as JSON, so every worker shares them. Redis expires them after the TTL.
+    @param client - a redis-py client, or a LocalRedis.
+    """
+
+    def __init__(self, client, prefix='trivia:query:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        data = self.client.get(self.prefix + key)
+        return json.loads(data) if data is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, json.dumps(value), ex=ttl)
+
+    def generation(self, namespace):
+        value = self.client.get(self.prefix + 'generation:' + namespace)
+        return int(value) if value is not None else 0
+
+    def bump(self, namespace):
+        #generations never expire, so a write is seen by every worker.
+        self.client.incr(self.prefix + 'generation:' + namespace)
+
+    def stats(self):
+        #the entries of Redis are shared and evicted by Redis itself, only this worker's lookups are counted.
+        return {}
+
+
+class QueryCache:
+    """
+    Caches the results of the search and category listing queries.
+    Every key carries the generations of the namespaces its result depends on,
+    so a write bumps a generation instead of finding and deleting the results it affects,
+    and the stale results age out of the backend.
+    With a shared backend, results computed from the state of this process, the search index or the snapshot,
+    go to the local backend instead: another worker's state may lag behind a write whose generation is already shared.
+    """
+
+    def __init__(self, backend, ttl=QUERY_CACHE_TTL, local=None):
+        self.backend = backend
+        self.local = local
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def fetch(self, namespaces, key, compute, shared=True):
+        """
+        @param namespaces - the namespaces whose writes make the result stale.
+        @param key - a string naming the query and its arguments.
+        @param compute - runs the query, its result must be JSON serializable.
+        @param shared - False when compute reads the state of this process rather than the database.
+        @returns the cached result, or the computed one.
+        """
+        backend = self.backend if shared or self.local is None else self.local
+        generations = ','.join(str(backend.generation(namespace)) for namespace in namespaces)
+        key = '{}@{}'.format(key, generations)
+        value = backend.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = compute()
+        backend.set(key, value, self.ttl)
+        return value
+
+    def invalidate(self, *namespaces):
+        for namespace in namespaces:
+            self.backend.bump(namespace)
+            if self.local is not None:
+                self.local.bump(namespace)
+
+    def stats(self):
+        return dict(self.backend.stats(), hits=self.hits, misses=self.misses)
+
+
+def init_query_cache(app):
+    """
+    Attaches the query cache chosen by the QUERY_CACHE setting to the app, "off" leaves it out.
+    With "redis", QUERY_CACHE_REDIS_URL names the server, "local" uses the in-process LocalRedis.
+    @param app - the app itself.
+    """
+    name = app.config.setdefault('QUERY_CACHE', 'memory')
+    ttl = app.config.setdefault('QUERY_CACHE_TTL', QUERY_CACHE_TTL)
+    if name not in QUERY_CACHE_BACKENDS:
+        raise ValueError('unknown QUERY_CACHE {}'.format(name))
+    if name == 'off':
+        return
+    size = app.config.setdefault('QUERY_CACHE_SIZE', QUERY_CACHE_SIZE)
+    local = None
+    if name == 'memory':
+        backend = MemoryCacheBackend(size)
+    else:
+        url = app.config.setdefault('QUERY_CACHE_REDIS_URL', 'local')
+        if url == 'local':
+            client = LocalRedis()
+        else:
+            #redis is only needed when results are shared through a Redis server.
+            import redis
+            client = redis.Redis.from_url(url)
+        backend = RedisCacheBackend(client)
+        local = MemoryCacheBackend(size)
+    app.extensions['query_cache'] = QueryCache(backend, ttl, local)
+
+
+def cached_query(namespaces, key, compute, shared=True):
+    """
+    Serves a query result from the query cache of the current app, when it has one.
+    @param shared - False when compute reads the state of this process, see QueryCache.
+    @returns the result of compute, cached or not.
+    """
+    cache = current_app.extensions.get('query_cache')
+    if cache is None:
+        return compute()
+    return cache.fetch(namespaces, key, compute, shared)
+
+
+@add_question_listener
+def invalidate_question_queries(action, question):
+    #a question write changes the search results and its category's listings,
+    #an update may have moved the question and a reload may have touched any category.
+    if not has_app_context() or 'query_cache' not in current_app.extensions:
+        return
+    cache = current_app.extensions['query_cache']
+    if action in ('insert', 'delete'):
+        cache.invalidate(SEARCH, category_namespace(question.category))
+    else:
+        cache.invalidate(SEARCH, CATEGORIES)
+
+
+@add_category_listener
+def invalidate_category_queries(action, category):
+    if has_app_context() and 'query_cache' in current_app.extensions:
+        current_app.extensions['query_cache'].invalidate(CATEGORIES)
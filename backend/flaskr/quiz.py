@@ -0,0 +1,269 @@
+import random
+import threading
+
+from flask import current_app, has_app_context
+from sqlalchemy import select
+
+from models import db, Question, add_question_listener
+
+# Category id the quiz uses for "All"
+ALL_CATEGORIES = 0
+# Random draws tried per id before falling back to listing the unseen ids of a pool
+SAMPLE_ATTEMPTS = 8
+# Upper bound for the "count" argument of the quiz
+MAX_QUIZ_BATCH = 50
+# Difficulties a question can have, and the one an adaptive quiz starts at
+DIFFICULTIES = (1, 2, 3, 4, 5)
+START_DIFFICULTY = 3
+# Latest answers an adaptive quiz looks at, and the share of them right to go up or down a difficulty
+ADAPTIVE_WINDOW = 5
+RAISE_SCORE = 0.8
+LOWER_SCORE = 0.4
+
+
+def category_key(category):
+    """
+    Normalizes a category id sent by a client, which may come as a string such as "2", to the int the questions store.
+    @param category - the category id.
+    @returns the category id as an int when it is one.
+    """
+    try:
+        return int(category)
+    except (TypeError, ValueError):
+        return category
+
+
+class IdPool:
+    """
+    A set of question ids that can also be sampled from in constant time.
+    The ids are kept in a list, with the position of each id so removal can swap it with the last one.
+    """
+
+    def __init__(self):
+        self.ids = []
+        self.positions = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, question_id):
+        if question_id not in self.positions:
+            self.positions[question_id] = len(self.ids)
+            self.ids.append(question_id)
+
+    def remove(self, question_id):
+        position = self.positions.pop(question_id, None)
+        if position is None:
+            return
+        last = self.ids.pop()
+        if last != question_id:
+            self.ids[position] = last
+            self.positions[last] = position
+
+    def sample(self, excluded, count=1):
+        """
+        Picks distinct random ids that are not excluded.
+        @param excluded - a set of ids to skip.
+        @param count - the number of ids wanted.
+        @returns a list of at most count ids, empty when every id is excluded.
+        """
+        picked = []
+        #while most of the pool is unseen a few random draws per id find them.
+        for _ in range(min(SAMPLE_ATTEMPTS * count, len(self.ids))):
+            question_id = self.ids[random.randrange(len(self.ids))]
+            if question_id not in excluded and question_id not in picked:
+                picked.append(question_id)
+                if len(picked) == count:
+                    return picked
+        #near the end of a quiz the unseen ids are listed instead.
+        unseen = [question_id for question_id in self.ids if question_id not in excluded and question_id not in picked]
+        return picked + random.sample(unseen, min(count - len(picked), len(unseen)))
+
+
+def target_difficulty(recent_answers, difficulty=None):
+    """
+    Picks the difficulty of the next question of an adaptive quiz from the latest answers.
+    @param recent_answers - whether each answer so far was right, oldest first.
+    @param difficulty - the difficulty of the last question, START_DIFFICULTY when None.
+    @returns the difficulty one above when most of the ADAPTIVE_WINDOW latest answers were right,
+    one below when most were wrong, else the same, within DIFFICULTIES.
+    """
+    if difficulty is None:
+        difficulty = START_DIFFICULTY
+    window = recent_answers[-ADAPTIVE_WINDOW:]
+    if window:
+        score = sum(1 for answer in window if answer) / len(window)
+        if score >= RAISE_SCORE:
+            difficulty += 1
+        elif score <= LOWER_SCORE:
+            difficulty -= 1
+    return min(max(difficulty, DIFFICULTIES[0]), DIFFICULTIES[-1])
+
+
+def difficulty_band(difficulty):
+    #the target first, then the nearest difficulties, easier before harder.
+    return sorted(DIFFICULTIES, key=lambda other: (abs(other - difficulty), other))
+
+
+class QuizPools:
+    """
+    The ids of the questions of every category, plus one pool for "All",
+    and the same split by difficulty for the adaptive quiz.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.pools = {ALL_CATEGORIES: IdPool()}
+        self.buckets = {}
+        self.keys = {}
+        self.built = False
+
+    def build(self):
+        #loads the id, category and difficulty of every question, writes made meanwhile wait on the lock and apply afterwards.
+        with self.lock:
+            self.built = True
+            self.pools = {ALL_CATEGORIES: IdPool()}
+            self.buckets = {}
+            self.keys = {}
+            rows = Question.query.with_entities(Question.id, Question.category, Question.difficulty).yield_per(1000)
+            for question_id, category, difficulty in rows:
+                self.add(question_id, category, difficulty)
+
+    def reset(self):
+        #marks the mirror as stale, the next use builds it again from the table.
+        with self.lock:
+            self.built = False
+
+    def ensure_built(self):
+        with self.lock:
+            if not self.built:
+                self.build()
+
+    def add(self, question_id, category, difficulty=None):
+        with self.lock:
+            self.remove(question_id)
+            key = category_key(category)
+            difficulty = category_key(difficulty)
+            self.keys[question_id] = (key, difficulty)
+            self.pools[ALL_CATEGORIES].add(question_id)
+            self.pools.setdefault(key, IdPool()).add(question_id)
+            self.buckets.setdefault((ALL_CATEGORIES, difficulty), IdPool()).add(question_id)
+            self.buckets.setdefault((key, difficulty), IdPool()).add(question_id)
+
+    def remove(self, question_id):
+        with self.lock:
+            key, difficulty = self.keys.pop(question_id, (None, None))
+            self.pools[ALL_CATEGORIES].remove(question_id)
+            if key in self.pools:
+                self.pools[key].remove(question_id)
+            for bucket in ((ALL_CATEGORIES, difficulty), (key, difficulty)):
+                if bucket in self.buckets:
+                    self.buckets[bucket].remove(question_id)
+
+    def sample(self, category, previous_questions, count=1, difficulty=None):
+        """
+        Picks distinct random question ids of a category that are not among the previous questions.
+        @param category - the category id, 0 for all categories.
+        @param previous_questions - a set of the ids already asked.
+        @param count - the number of ids wanted.
+        @param difficulty - the target difficulty of an adaptive quiz, the nearest difficulties
+        are drawn from once the questions of the target are used up.
+        @returns a list of at most count ids, empty when the category has no more questions.
+        """
+        with self.lock:
+            key = category_key(category)
+            if difficulty is None:
+                pool = self.pools.get(key)
+                return pool.sample(previous_questions, count) if pool is not None else []
+            picked = []
+            for band in difficulty_band(difficulty):
+                pool = self.buckets.get((key, band))
+                if pool is not None:
+                    picked += pool.sample(previous_questions, count - len(picked))
+                    if len(picked) == count:
+                        break
+            return picked
+
+
+def init_quiz(app):
+    """
+    Attaches empty quiz pools to the app, they are built on the first quiz.
+    @param app - the app itself.
+    """
+    app.extensions['quiz_pools'] = QuizPools()
+
+
+def quiz_pools():
+    return current_app.extensions['quiz_pools']
+
+
+def next_quiz_questions(category, previous_questions, count, difficulty=None):
+    """
+    Draws distinct quiz questions from the pools of the current app.
+    @param category - the category id, 0 for all categories.
+    @param previous_questions - the ids already asked.
+    @param count - the number of questions wanted.
+    @param difficulty - the target difficulty of an adaptive quiz, any difficulty when None.
+    @returns a list of at most count questions, empty when the category has no more questions.
+    """
+    pools = quiz_pools()
+    pools.ensure_built()
+    excluded = set(previous_questions)
+    questions = []
+    while len(questions) < count:
+        question_ids = pools.sample(category, excluded, count - len(questions), difficulty)
+        if not question_ids:
+            break
+        #fetches only the drawn questions, in one query by primary key.
+        rows = {question.id: question for question in Question.query.filter(Question.id.in_(question_ids))}
+        missing = []
+        for question_id in question_ids:
+            excluded.add(question_id)
+            if question_id in rows:
+                questions.append(rows[question_id])
+            else:
+                missing.append(question_id)
+        #a missing question is skipped and another one is drawn, it is only dropped from the pools once the primary
+        #confirms it was deleted behind their back, a replica may not have a question just written yet.
+        for question_id in deleted_questions(missing):
+            pools.remove(question_id)
+    return questions
+
+
+def deleted_questions(question_ids):
+    """
+    @param question_ids - ids of questions the last read did not find.
+    @returns those of the ids the primary database does not have either.
+    """
+    if not question_ids:
+        return []
+    found = {row[0] for row in db.session.execute(select([Question.id]).where(Question.id.in_(question_ids)), bind=db.engine)}
+    return [question_id for question_id in question_ids if question_id not in found]
+
+
+def next_quiz_question(category, previous_questions, difficulty=None):
+    """
+    Draws the next quiz question from the pools of the current app.
+    @param category - the category id, 0 for all categories.
+    @param previous_questions - the ids already asked.
+    @param difficulty - the target difficulty of an adaptive quiz, any difficulty when None.
+    @returns the question, or None when the category has no more questions.
+    """
+    questions = next_quiz_questions(category, previous_questions, 1, difficulty)
+    return questions[0] if questions else None
+
+
+@add_question_listener
+def sync_quiz_pools(action, question):
+    #keeps the pools of the current app in step with writes, pools not built yet load them when they are.
+    if not has_app_context():
+        return
+    pools = current_app.extensions.get('quiz_pools')
+    if pools is None or not pools.built:
+        return
+    if action in ('reload', 'sync'):
+        pools.reset()
+    elif action == 'delete':
+        pools.remove(question.id)
+    else:
+        pools.add(question.id, question.category, question.difficulty)
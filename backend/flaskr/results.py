@@ -0,0 +1,223 @@
+import atexit
+import bisect
+import datetime
+import threading
+
+from flask import current_app
+from sqlalchemy import distinct
+
+from models import db, QuizResult
+
+# Results buffered before the flush thread is woken up, unless RESULTS_FLUSH_SIZE says otherwise
+RESULTS_FLUSH_SIZE = 500
+# Seconds between two flushes of the buffered results, unless RESULTS_FLUSH_INTERVAL says otherwise
+RESULTS_FLUSH_INTERVAL = 5
+# Results kept in memory when the database refuses them, the oldest are dropped past it
+MAX_PENDING_RESULTS = 100000
+# Longest player name a result can have
+MAX_PLAYER_LENGTH = 50
+# Entries kept per category leaderboard, unless LEADERBOARD_SIZE says otherwise
+LEADERBOARD_SIZE = 100
+# Entries a leaderboard request returns when it has no limit
+LEADERBOARD_LIMIT = 10
+# Seconds between two reloads of the leaderboards, which brings in the results of the other workers
+LEADERBOARD_REFRESH = 60
+
+
+def rank_key(result):
+    #the best score first, then the fewest questions to get it, then the earliest.
+    return (-result['score'], result['questions'], result['created'])
+
+
+class Leaderboard:
+    """
+    The best LEADERBOARD_SIZE results of a category, kept sorted so a read is a slice.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.keys = []
+        self.results = []
+
+    def add(self, result):
+        """
+        @param result - a dict of the QuizResult columns.
+        @returns the 1-based rank of the result, or None when it did not make the board.
+        """
+        key = rank_key(result)
+        position = bisect.bisect_right(self.keys, key)
+        if position >= self.size:
+            return None
+        self.keys.insert(position, key)
+        self.results.insert(position, result)
+        del self.keys[self.size:], self.results[self.size:]
+        return position + 1
+
+    def top(self, limit):
+        return self.results[:limit]
+
+
+class QuizResults:
+    """
+    Buffers quiz results and writes them in batches, and keeps the leaderboards of every category.
+    A result counts on the leaderboards as soon as it is recorded, before it reaches the database.
+    The buffer is written by a background thread every RESULTS_FLUSH_INTERVAL seconds,
+    or as soon as it holds RESULTS_FLUSH_SIZE results, and once more when the process exits.
+    """
+
+    def __init__(self, app, flush_size=RESULTS_FLUSH_SIZE, flush_interval=RESULTS_FLUSH_INTERVAL,
+                 leaderboard_size=LEADERBOARD_SIZE, refresh=LEADERBOARD_REFRESH):
+        self.app = app
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.leaderboard_size = leaderboard_size
+        self.refresh = refresh
+        self.lock = threading.RLock()
+        #only one flush writes at a time, so a reload of the boards sees every batch written before it.
+        self.flush_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.pending = []
+        self.boards = {}
+        self.built = False
+        self.loaded_at = None
+        self.thread = None
+        self.flushed = 0
+        self.dropped = 0
+
+    def load(self):
+        #the best results of each category, every query is a descending walk of the (category, score) index.
+        boards = {}
+        for (category,) in db.session.query(distinct(QuizResult.category)):
+            board = boards[category] = Leaderboard(self.leaderboard_size)
+            query = QuizResult.query.filter(QuizResult.category == category) \
+                .order_by(QuizResult.score.desc(), QuizResult.questions, QuizResult.created).limit(self.leaderboard_size)
+            for result in query:
+                board.add(dict(result.format(), created=result.created))
+        return boards
+
+    def build(self):
+        #results recorded but not written yet are added on top of those of the database.
+        with self.lock:
+            self.boards = self.load()
+            for result in self.pending:
+                self.board(result['category']).add(result)
+            self.built = True
+            self.loaded_at = datetime.datetime.utcnow()
+
+    def ensure_built(self):
+        with self.lock:
+            if not self.built:
+                self.build()
+
+    def stale(self):
+        #the other workers' results reach this one when the boards are loaded again.
+        return self.built and (datetime.datetime.utcnow() - self.loaded_at).total_seconds() >= self.refresh
+
+    def reload_if_stale(self):
+        #a batch being flushed is neither pending nor in the database yet, the reload waits for its flush to end.
+        with self.flush_lock:
+            with self.lock:
+                if self.stale():
+                    self.build()
+
+    def board(self, category):
+        return self.boards.setdefault(category, Leaderboard(self.leaderboard_size))
+
+    def record(self, player, category, score, questions):
+        """
+        Buffers a result and adds it to the leaderboard of its category.
+        @returns the 1-based rank of the result on the leaderboard, or None when it did not make it.
+        """
+        result = {
+            'player': player,
+            'category': category,
+            'score': score,
+            'questions': questions,
+            'created': datetime.datetime.utcnow()
+        }
+        with self.lock:
+            self.ensure_built()
+            self.pending.append(result)
+            rank = self.board(category).add(result)
+            self.start()
+            if len(self.pending) >= self.flush_size:
+                self.wake.set()
+        return rank
+
+    def top(self, category, limit):
+        #a worker that serves the leaderboards but records no results has nothing to flush, it reloads them here.
+        if self.stale():
+            self.reload_if_stale()
+        with self.lock:
+            self.ensure_built()
+            return list(self.board(category).top(limit)) if category in self.boards else []
+
+    def flush(self):
+        """
+        Writes the buffered results in one transaction.
+        When the database refuses them they go back to the buffer, to be tried again by the next flush.
+        @returns the number of results written.
+        """
+        with self.flush_lock:
+            with self.lock:
+                batch, self.pending = self.pending, []
+            if batch:
+                try:
+                    with db.engine.begin() as connection:
+                        connection.execute(QuizResult.__table__.insert(), batch)
+                except Exception:
+                    current_app.logger.exception('could not write %d quiz results', len(batch))
+                    with self.lock:
+                        self.pending[:0] = batch
+                        overflow = len(self.pending) - MAX_PENDING_RESULTS
+                        if overflow > 0:
+                            del self.pending[:overflow]
+                            self.dropped += overflow
+                    return 0
+                self.flushed += len(batch)
+            if self.stale():
+                self.build()
+            return len(batch)
+
+    def start(self):
+        #the flush thread starts with the first result, apps that never get one have none.
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='quiz-results-flush', daemon=True)
+            self.thread.start()
+            atexit.register(self.flush_in_context)
+
+    def run(self):
+        while True:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            try:
+                self.flush_in_context()
+            except Exception:
+                #the thread has to outlive a failed reload of the boards, the next flush tries again.
+                self.app.logger.exception('could not flush the quiz results')
+
+    def flush_in_context(self):
+        with self.app.app_context():
+            self.flush()
+
+    def stats(self):
+        with self.lock:
+            return {'pending': len(self.pending), 'flushed': self.flushed, 'dropped': self.dropped}
+
+
+def init_results(app):
+    """
+    Attaches the quiz results buffer to the app. RESULTS_FLUSH_SIZE, RESULTS_FLUSH_INTERVAL,
+    LEADERBOARD_SIZE and LEADERBOARD_REFRESH override the defaults of the module.
+    @param app - the app itself.
+    """
+    app.extensions['quiz_results'] = QuizResults(
+        app,
+        app.config.setdefault('RESULTS_FLUSH_SIZE', RESULTS_FLUSH_SIZE),
+        app.config.setdefault('RESULTS_FLUSH_INTERVAL', RESULTS_FLUSH_INTERVAL),
+        app.config.setdefault('LEADERBOARD_SIZE', LEADERBOARD_SIZE),
+        app.config.setdefault('LEADERBOARD_REFRESH', LEADERBOARD_REFRESH))
+
+
+def quiz_results():
+    return current_app.extensions['quiz_results']
@@ -0,0 +1,211 @@
+import threading
+from array import array
+from bisect import bisect_left
+
+from flask import current_app, has_app_context
+
+from models import Question, add_question_listener
+
+# Search backends, "index" keeps an in-process trigram index, "scan" runs ILIKE against the database
+SEARCH_BACKENDS = ('index', 'scan')
+# Search modes, "substring" matches the whole term, "words" matches every word of the term anywhere
+SEARCH_MODES = ('substring', 'words')
+# Posting lists this many times longer than the other one are binary-searched rather than walked through
+GALLOP_RATIO = 16
+
+
+def trigrams(text):
+    """
+    Splits a lower-cased text into its set of three-character sequences.
+    @param text - the text to split.
+    @returns a set of trigrams, empty for texts shorter than three characters.
+    """
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def rank(text, term):
+    """
+    Scores how well a question text matches a term, lower is better.
+    Matches at the start of a word come first, then earlier matches, then shorter questions.
+    @param text - the lower-cased question text.
+    @param term - the lower-cased term, which must be a substring of the text.
+    @returns a sortable tuple.
+    """
+    position = text.find(term)
+    word_start = position == 0 or not text[position - 1].isalnum()
+    return (0 if word_start else 1, position, len(text))
+
+
+def intersect(small, large):
+    """
+    Intersects two sorted lists of ids.
+    @param small - the shorter list.
+    @param large - the longer list.
+    @returns the ids in both, sorted, as an unsigned int array.
+    """
+    if len(small) * GALLOP_RATIO >= len(large):
+        #lists of similar lengths are both read through, by the set operations written in C.
+        return array('I', sorted(set(small).intersection(large)))
+    #each id of a much shorter list is binary-searched in the longer one, from the last position found onwards.
+    common = array('I')
+    low = 0
+    for question_id in small:
+        low = bisect_left(large, question_id, low)
+        if low == len(large):
+            break
+        if large[low] == question_id:
+            common.append(question_id)
+    return common
+
+
+class QuestionIndex:
+    """
+    In-process trigram index over the question texts.
+    A search only verifies the questions holding every trigram of the term,
+    so it keeps the substring semantics of ILIKE without scanning the table.
+    The posting list of each trigram is a sorted unsigned int array, four bytes per id,
+    instead of a set that costs an order of magnitude more per entry.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.texts = {}
+        self.postings = {}
+        self.built = False
+
+    def build(self):
+        #loads the id and text of every question, without building ORM objects.
+        #the index counts as built from the start so writes made meanwhile wait on the lock and apply afterwards.
+        with self.lock:
+            self.built = True
+            self.texts = {}
+            self.postings = {}
+            #in id order every id is appended to the end of its posting lists.
+            rows = Question.query.with_entities(Question.id, Question.question).order_by(Question.id).yield_per(1000)
+            for question_id, text in rows:
+                self.add(question_id, text)
+
+    def reset(self):
+        #marks the mirror as stale, the next use builds it again from the table.
+        with self.lock:
+            self.built = False
+
+    def ensure_built(self):
+        with self.lock:
+            if not self.built:
+                self.build()
+
+    def add(self, question_id, text):
+        with self.lock:
+            self.remove(question_id)
+            #NULL questions never match ILIKE, so they are left out of the index.
+            if text is None:
+                return
+            text = text.lower()
+            self.texts[question_id] = text
+            for trigram in trigrams(text):
+                ids = self.postings.get(trigram)
+                if ids is None:
+                    self.postings[trigram] = array('I', [question_id])
+                elif ids[-1] < question_id:
+                    #new questions have the highest id, they go at the end.
+                    ids.append(question_id)
+                else:
+                    ids.insert(bisect_left(ids, question_id), question_id)
+
+    def remove(self, question_id):
+        with self.lock:
+            text = self.texts.pop(question_id, None)
+            if text is None:
+                return
+            for trigram in trigrams(text):
+                ids = self.postings.get(trigram)
+                if ids is None:
+                    continue
+                position = bisect_left(ids, question_id)
+                if position < len(ids) and ids[position] == question_id:
+                    del ids[position]
+                if not ids:
+                    del self.postings[trigram]
+
+    def candidates(self, term):
+        #terms shorter than a trigram can only be checked against every question.
+        grams = trigrams(term)
+        if not grams:
+            return self.texts.keys()
+        #intersects the smallest posting lists first, so each step walks the shortest list yet.
+        postings = sorted((self.postings.get(trigram, array('I')) for trigram in grams), key=len)
+        common = postings[0]
+        for ids in postings[1:]:
+            if not common:
+                break
+            common = intersect(common, ids)
+        return common
+
+    def search(self, term, mode='substring'):
+        """
+        Finds the questions matching a search term.
+        @param term - the search term, matched case-insensitively.
+        @param mode - "substring" to match the whole term, "words" to match every word of it.
+        @returns the ids of the matching questions, best match first.
+        """
+        term = term.lower()
+        words = term.split() if mode == 'words' else [term]
+        if not words:
+            words = ['']
+        with self.lock:
+            #the longest word has the most selective trigrams, the others are checked on its candidates.
+            longest = max(words, key=len)
+            matches = [
+                question_id for question_id in self.candidates(longest)
+                if all(word in self.texts[question_id] for word in words)
+            ]
+            return sorted(matches, key=lambda question_id: rank(self.texts[question_id], longest) + (question_id,))
+
+
+def init_search(app):
+    """
+    Attaches the search backend chosen by the SEARCH_BACKEND setting to the app.
+    @param app - the app itself.
+    """
+    backend = app.config.setdefault('SEARCH_BACKEND', 'index')
+    if backend not in SEARCH_BACKENDS:
+        raise ValueError('unknown SEARCH_BACKEND {}'.format(backend))
+    app.extensions['question_index'] = QuestionIndex() if backend == 'index' else None
+
+
+def question_index():
+    """
+    @returns the question index of the current app, None with the "scan" backend.
+    """
+    return current_app.extensions.get('question_index')
+
+
+def search_question_ids(term, mode='substring'):
+    """
+    Searches the question index of the current app, building it on first use.
+    @param term - the search term.
+    @param mode - one of SEARCH_MODES.
+    @returns the ranked ids of the matching questions, or None when the app uses the "scan" backend.
+    """
+    index = question_index()
+    if index is None:
+        return None
+    index.ensure_built()
+    return index.search(term, mode)
+
+
+@add_question_listener
+def sync_question_index(action, question):
+    #keeps the index of the current app in step with writes, an index not built yet loads them when it is.
+    if not has_app_context():
+        return
+    index = current_app.extensions.get('question_index')
+    if index is None or not index.built:
+        return
+    if action in ('reload', 'sync'):
+        index.reset()
+    elif action == 'delete':
+        index.remove(question.id)
+    else:
+        index.add(question.id, question.question)
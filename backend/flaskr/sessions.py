@@ -0,0 +1,186 @@
+import secrets
+import struct
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+from flask import current_app
+
+# Session stores that can be picked with the QUIZ_SESSION_STORE setting
+QUIZ_SESSION_STORES = ('memory', 'redis')
+# Seconds a quiz session lives after its last use, unless QUIZ_SESSION_TTL says otherwise
+QUIZ_SESSION_TTL = 3600
+# Largest category a session holds, it is stored as a signed four-byte integer
+MAX_SESSION_CATEGORY = 2 ** 31 - 1
+
+
+class QuizSession:
+    """
+    The server-held state of a quiz: its category and the ids already asked.
+    The ids are kept in an unsigned int array, four bytes per question asked,
+    instead of a permutation or a bitset that would grow with the size of the question bank.
+    """
+
+    def __init__(self, category, seen=None):
+        self.category = category
+        self.seen = seen if seen is not None else array('I')
+
+    def to_bytes(self):
+        return struct.pack('!i', self.category) + self.seen.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        seen = array('I')
+        seen.frombytes(data[4:])
+        return cls(struct.unpack('!i', data[:4])[0], seen)
+
+
+class MemoryQuizSessionStore:
+    """
+    Keeps the quiz sessions of this process in memory.
+    Sessions are ordered by last use, so the expired ones are always at the front and are evicted on every write.
+    """
+
+    def __init__(self, ttl=QUIZ_SESSION_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.sessions = OrderedDict()
+
+    def evict(self, now):
+        while self.sessions:
+            token, (expires, _) = next(iter(self.sessions.items()))
+            if expires > now:
+                break
+            del self.sessions[token]
+
+    def get(self, token):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.sessions.get(token)
+            if entry is None or entry[0] <= now:
+                return None
+            return entry[1]
+
+    def put(self, token, session):
+        now = time.monotonic()
+        with self.lock:
+            self.evict(now)
+            self.sessions[token] = (now + self.ttl, session)
+            self.sessions.move_to_end(token)
+
+    def delete(self, token):
+        with self.lock:
+            return self.sessions.pop(token, None) is not None
+
+    def __len__(self):
+        return len(self.sessions)
+
+
+class LocalRedis:
+    """
+    An in-process stand-in for the few Redis commands the Redis stores use (GET, SET with EX, DEL, INCR),
+    so they can run without a Redis server in tests and on a single machine.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def get(self, name):
+        with self.lock:
+            entry = self.values.get(name)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires <= time.monotonic():
+                del self.values[name]
+                return None
+            return value
+
+    def set(self, name, value, ex=None):
+        with self.lock:
+            self.values[name] = (value, time.monotonic() + ex if ex is not None else None)
+        return True
+
+    def delete(self, *names):
+        with self.lock:
+            return sum(self.values.pop(name, None) is not None for name in names)
+
+    def incr(self, name):
+        with self.lock:
+            value, expires = self.values.get(name, (0, None))
+            self.values[name] = (int(value) + 1, expires)
+            return int(value) + 1
+
+
+class RedisQuizSessionStore:
+    """
+    Keeps the quiz sessions in Redis so every worker sees them, Redis expires them after the TTL.
+    @param client - a redis-py client, or a LocalRedis.
+    """
+
+    def __init__(self, client, ttl=QUIZ_SESSION_TTL, prefix='trivia:quiz:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, token):
+        data = self.client.get(self.prefix + token)
+        return QuizSession.from_bytes(data) if data is not None else None
+
+    def put(self, token, session):
+        self.client.set(self.prefix + token, session.to_bytes(), ex=self.ttl)
+
+    def delete(self, token):
+        return bool(self.client.delete(self.prefix + token))
+
+
+def init_quiz_sessions(app):
+    """
+    Attaches the quiz session store chosen by the QUIZ_SESSION_STORE setting to the app.
+    With "redis", QUIZ_SESSION_REDIS_URL names the server, "local" uses the in-process LocalRedis.
+    @param app - the app itself.
+    """
+    store = app.config.setdefault('QUIZ_SESSION_STORE', 'memory')
+    ttl = app.config.setdefault('QUIZ_SESSION_TTL', QUIZ_SESSION_TTL)
+    if store not in QUIZ_SESSION_STORES:
+        raise ValueError('unknown QUIZ_SESSION_STORE {}'.format(store))
+    if store == 'memory':
+        app.extensions['quiz_sessions'] = MemoryQuizSessionStore(ttl)
+        return
+    url = app.config.setdefault('QUIZ_SESSION_REDIS_URL', 'local')
+    if url == 'local':
+        client = LocalRedis()
+    else:
+        #redis is only needed when sessions are shared through a Redis server.
+        import redis
+        client = redis.Redis.from_url(url)
+    app.extensions['quiz_sessions'] = RedisQuizSessionStore(client, ttl)
+
+
+def start_quiz_session(category):
+    """
+    Opens a quiz session for a category.
+    @param category - the category id, 0 for all categories.
+    @returns the token of the session.
+    @raises ValueError if the category is not an integer from 0 to MAX_SESSION_CATEGORY.
+    """
+    if not isinstance(category, int) or isinstance(category, bool) or not 0 <= category <= MAX_SESSION_CATEGORY:
+        raise ValueError('category must be an integer from 0 to {}'.format(MAX_SESSION_CATEGORY))
+    token = secrets.token_urlsafe(16)
+    current_app.extensions['quiz_sessions'].put(token, QuizSession(category))
+    return token
+
+
+def get_quiz_session(token):
+    return current_app.extensions['quiz_sessions'].get(token)
+
+
+def save_quiz_session(token, session):
+    #saving also renews the TTL of the session.
+    current_app.extensions['quiz_sessions'].put(token, session)
+
+
+def end_quiz_session(token):
+    return current_app.extensions['quiz_sessions'].delete(token)
@@ -0,0 +1,569 @@
+import json
+import mmap
+import os
+import random
+import struct
+import sys
+import threading
+import time
+from array import array
+
+from flask import current_app, has_app_context, has_request_context
+
+from models import config_value, read_revision, Question, Category, add_question_listener, add_category_listener
+from .quiz import ALL_CATEGORIES, SAMPLE_ATTEMPTS, category_key, difficulty_band, next_quiz_questions
+from .pagination import QUESTIONS_PER_PAGE, encode_cursor
+from .search import trigrams, rank, intersect
+from .query_cache import SEARCH, CATEGORIES
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Magic bytes and layout version of a snapshot file
+SNAPSHOT_MAGIC = b'TRIVSNAP'
+SNAPSHOT_FORMAT = 2
+# magic, format, generation, build time, length of the JSON metadata that follows
+SNAPSHOT_HEADER = struct.Struct('<8sIQdI')
+# Seconds between two checks of the snapshot file for a newer one, unless SNAPSHOT_CHECK_INTERVAL says otherwise
+SNAPSHOT_CHECK_INTERVAL = 1
+# Seconds a rebuild waits after a write, so a burst of writes is rebuilt once, unless SNAPSHOT_REBUILD_DELAY says otherwise
+SNAPSHOT_REBUILD_DELAY = 0.5
+# Stored in place of a missing category or difficulty
+NULL = -1
+# Bytes of a trigram in the snapshot, its UTF-8 encoding padded with zeros
+GRAM_WIDTH = 12
+# Columns of a snapshot and their array type codes, every section is aligned on 8 bytes
+SECTIONS = (
+    ('ids', 'I'),
+    ('categories', 'i'),
+    ('difficulties', 'h'),
+    ('offsets', 'Q'),
+    ('texts', 'B'),
+    ('by_category', 'I'),
+    ('by_difficulty', 'I'),
+    ('grams', 'B'),
+    ('gram_offsets', 'Q'),
+    ('postings', 'I'),
+)
+
+
+def range_key(*values):
+    return ':'.join('null' if value is None else str(value) for value in values)
+
+
+def gram_key(trigram):
+    return trigram.encode('utf-8').ljust(GRAM_WIDTH, b'\0')
+
+
+def write_snapshot(path, generation, revision=None):
+    """
+    Writes the questions and categories to a snapshot file, then moves it over path in one rename,
+    so readers see either the old file or the new one, never a partial one.
+    @param path - the snapshot file.
+    @param generation - the generation recorded in the file.
+    @param revision - the value of the catalog revision read before the questions, None when there is no revision.
+    """
+    ids, categories, difficulties = array('I'), array('i'), array('h')
+    offsets, texts = array('Q', [0]), bytearray()
+    postings, null_questions = {}, []
+    columns = (Question.id, Question.question, Question.answer, Question.category, Question.difficulty)
+    rows = Question.query.with_entities(*columns).order_by(Question.id).yield_per(1000)
+    for question_id, question, answer, category, difficulty in rows:
+        #the trigram postings list positions in id order, as those of the search index list ids.
+        if question is None:
+            null_questions.append(len(ids))
+        else:
+            for trigram in trigrams(question.lower()):
+                positions = postings.setdefault(gram_key(trigram), array('I'))
+                if not positions or positions[-1] != len(ids):
+                    positions.append(len(ids))
+        ids.append(question_id)
+        categories.append(NULL if category is None else int(category))
+        difficulties.append(NULL if difficulty is None else int(difficulty))
+        #the question and the answer of position i are the texts between offsets 2i, 2i+1 and 2i+2.
+        for text in (question or '', answer or ''):
+            texts += text.encode('utf-8')
+            offsets.append(len(texts))
+    #positions grouped by category, then by (category, difficulty), in id order within each group, as the sorts are stable.
+    positions = range(len(ids))
+    by_category = array('I', sorted(positions, key=categories.__getitem__))
+    by_difficulty = array('I', sorted(positions, key=lambda position: (categories[position], difficulties[position])))
+    #the trigrams are sorted so a search finds them by binary search, their posting lists follow in the same order.
+    grams, gram_offsets, posting_lists = bytearray(), array('Q', [0]), array('I')
+    for key in sorted(postings):
+        grams += key
+        posting_lists.extend(postings[key])
+        gram_offsets.append(len(posting_lists))
+    metadata = {
+        'byteorder': sys.byteorder,
+        'revision': revision,
+        'count': len(ids),
+        'null_questions': null_questions,
+        'categories': [category.format() for category in Category.query.order_by(Category.id)],
+        'category_ranges': group_ranges(by_category, lambda position: range_key(categories[position])),
+        'difficulty_ranges': group_ranges(by_difficulty, lambda position: range_key(categories[position], difficulties[position])),
+    }
+    sections = {
+        'ids': ids, 'categories': categories, 'difficulties': difficulties, 'offsets': offsets,
+        'texts': array('B', bytes(texts)), 'by_category': by_category, 'by_difficulty': by_difficulty,
+        'grams': array('B', bytes(grams)), 'gram_offsets': gram_offsets, 'postings': posting_lists,
+    }
+    #the section offsets depend on the length of the metadata, which holds them, so they are relative to its end.
+    layout, position = {}, 0
+    for name, _ in SECTIONS:
+        size = len(sections[name]) * sections[name].itemsize
+        layout[name] = [position, size]
+        position += size + (-size % 8)
+    metadata['sections'] = layout
+    encoded = json.dumps(metadata).encode()
+    encoded += b' ' * (-(SNAPSHOT_HEADER.size + len(encoded)) % 8)
+
+    temporary = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temporary, 'wb') as file:
+        file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_FORMAT, generation, time.time(), len(encoded)))
+        file.write(encoded)
+        for name, _ in SECTIONS:
+            data = sections[name].tobytes()
+            file.write(data + b'\0' * (-len(data) % 8))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+
+def group_ranges(permutation, key):
+    """
+    @param permutation - positions sorted by key.
+    @param key - gives the group of a position.
+    @returns a dict of each group to the [start, end) range of its positions in the permutation.
+    """
+    ranges = {}
+    for index, position in enumerate(permutation):
+        group = key(position)
+        if group in ranges:
+            ranges[group][1] = index + 1
+        else:
+            ranges[group] = [index, index + 1]
+    return ranges
+
+
+def read_header(path):
+    """
+    @param path - the snapshot file.
+    @returns the generation and the metadata of the file, the metadata is None when this version cannot read it,
+    and the generation 0 when it is not a snapshot at all.
+    """
+    try:
+        with open(path, 'rb') as file:
+            magic, version, generation, _, length = SNAPSHOT_HEADER.unpack(file.read(SNAPSHOT_HEADER.size))
+            if magic != SNAPSHOT_MAGIC:
+                return 0, None
+            if version != SNAPSHOT_FORMAT:
+                return generation, None
+            return generation, json.loads(file.read(length).decode())
+    except (OSError, struct.error, ValueError):
+        return 0, None
+
+
+def read_generation(path):
+    return read_header(path)[0]
+
+
+class CatalogSnapshot:
+    """
+    A snapshot file mapped read-only into memory.
+    The columns are memoryviews of the mapping, so every worker mapping the same file
+    shares one copy of it in the page cache, and nothing is loaded until it is read.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.stat = os.fstat(file.fileno())
+        magic, version, self.generation, self.built_at, length = SNAPSHOT_HEADER.unpack_from(self.map)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_FORMAT:
+            raise ValueError('{} is not a snapshot this version can read'.format(path))
+        start = SNAPSHOT_HEADER.size
+        self.metadata = json.loads(self.map[start:start + length].decode())
+        if self.metadata['byteorder'] != sys.byteorder:
+            raise ValueError('{} was written on a machine of another byte order'.format(path))
+        start += length
+        view = memoryview(self.map)
+        for name, code in SECTIONS:
+            offset, size = self.metadata['sections'][name]
+            setattr(self, name, view[start + offset:start + offset + size].cast(code))
+        self.count = self.metadata['count']
+
+    def question(self, position):
+        """
+        @param position - the position of a question in id order.
+        @returns the formatted question, as Question.format returns it.
+        """
+        offsets = self.offsets
+        category = self.categories[position]
+        difficulty = self.difficulties[position]
+        return {
+            'id': self.ids[position],
+            'question': self.question_text(position),
+            'answer': bytes(self.texts[offsets[2 * position + 1]:offsets[2 * position + 2]]).decode('utf-8'),
+            'category': None if category == NULL else category,
+            'difficulty': None if difficulty == NULL else difficulty,
+        }
+
+    def question_text(self, position):
+        offsets = self.offsets
+        return bytes(self.texts[offsets[2 * position]:offsets[2 * position + 1]]).decode('utf-8')
+
+    def gram_postings(self, trigram):
+        #binary search of the sorted trigrams, the postings are a view of the mapping.
+        key = gram_key(trigram)
+        low, high = 0, len(self.gram_offsets) - 1
+        while low < high:
+            middle = (low + high) // 2
+            if bytes(self.grams[middle * GRAM_WIDTH:(middle + 1) * GRAM_WIDTH]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == len(self.gram_offsets) - 1 or bytes(self.grams[low * GRAM_WIDTH:(low + 1) * GRAM_WIDTH]) != key:
+            return array('I')
+        return self.postings[self.gram_offsets[low]:self.gram_offsets[low + 1]]
+
+    def candidates(self, term):
+        #as QuestionIndex.candidates, with positions for ids.
+        grams = trigrams(term)
+        if not grams:
+            null_questions = set(self.metadata['null_questions'])
+            return [position for position in range(self.count) if position not in null_questions]
+        postings = sorted((self.gram_postings(trigram) for trigram in grams), key=len)
+        common = postings[0]
+        for positions in postings[1:]:
+            if not common:
+                break
+            common = intersect(common, positions)
+        return common
+
+    def search(self, term, mode='substring'):
+        """
+        Finds the questions matching a search term, as QuestionIndex.search does.
+        @param term - the search term, matched case-insensitively.
+        @param mode - "substring" to match the whole term, "words" to match every word of it.
+        @returns the positions of the matching questions, best match first.
+        """
+        term = term.lower()
+        words = term.split() if mode == 'words' else [term]
+        if not words:
+            words = ['']
+        longest = max(words, key=len)
+        matches = {}
+        for position in self.candidates(longest):
+            text = self.question_text(position).lower()
+            if all(word in text for word in words):
+                matches[position] = text
+        #positions are in id order, so they break ties as the ids do.
+        return sorted(matches, key=lambda position: rank(matches[position], longest) + (position,))
+
+    def search_page(self, request, term, mode='substring'):
+        """
+        The page of a search, as paginate_ids returns it.
+        @returns a tuple of the formatted questions of the page and the total number of matches.
+        """
+        positions = self.search(term, mode)
+        page = request.args.get('page', 1, type=int)
+        if page < 1:
+            return [], len(positions)
+        first = (page - 1) * QUESTIONS_PER_PAGE
+        return [self.question(position) for position in positions[first:first + QUESTIONS_PER_PAGE]], len(positions)
+
+    def listing(self, category):
+        """
+        @param category - a category id, or None for every question.
+        @returns a tuple of the permutation and the [start, end) range of the listing in it, the permutation is None for id order.
+        """
+        if category is None:
+            return None, 0, self.count
+        start, end = self.metadata['category_ranges'].get(range_key(category), (0, 0))
+        return self.by_category, start, end
+
+    def positions(self, permutation, start, end):
+        return range(start, end) if permutation is None else permutation[start:end]
+
+    def paginate(self, request, category=None):
+        """
+        The page of a listing, as paginate_questions returns it.
+        @returns a tuple of the formatted questions of the page and the total number of questions of the listing.
+        """
+        permutation, start, end = self.listing(category)
+        page = request.args.get('page', 1, type=int)
+        if page < 1:
+            return [], end - start
+        first = start + (page - 1) * QUESTIONS_PER_PAGE
+        last = min(first + QUESTIONS_PER_PAGE, end)
+        return [self.question(position) for position in self.positions(permutation, first, max(first, last))], end - start
+
+    def seek(self, category, after, limit):
+        """
+        The page of a listing after a cursor, as seek_questions returns it.
+        @returns a tuple of the formatted questions and the cursor of the next page, None on the last page.
+        """
+        permutation, start, end = self.listing(category)
+        #binary search for the first id after the cursor, the ids of a listing are in ascending order.
+        low, high = start, end
+        while low < high:
+            middle = (low + high) // 2
+            position = middle if permutation is None else permutation[middle]
+            if self.ids[position] <= after:
+                low = middle + 1
+            else:
+                high = middle
+        questions = [self.question(position) for position in self.positions(permutation, low, min(low + limit, end))]
+        next_cursor = encode_cursor(questions[-1]['id']) if low + limit < end else None
+        return questions, next_cursor
+
+    def quiz_ranges(self, category, difficulty):
+        #the ranges of by_difficulty holding the questions of a category, or of every category for "All".
+        ranges = self.metadata['difficulty_ranges']
+        if category == ALL_CATEGORIES:
+            suffix = ':' + range_key(difficulty)
+            return [value for key, value in ranges.items() if key.endswith(suffix)]
+        key = range_key(category, difficulty)
+        return [ranges[key]] if key in ranges else []
+
+    def sample_ranges(self, permutation, ranges, excluded, count):
+        """
+        Picks distinct random positions of the ranges whose ids are not excluded, the way IdPool.sample does.
+        """
+        total = sum(end - start for start, end in ranges)
+        picked = []
+        if total == 0:
+            return picked
+
+        def position_at(index):
+            for start, end in ranges:
+                if index < end - start:
+                    return start + index if permutation is None else permutation[start + index]
+                index -= end - start
+
+        for _ in range(min(SAMPLE_ATTEMPTS * count, total)):
+            position = position_at(random.randrange(total))
+            if self.ids[position] not in excluded and position not in picked:
+                picked.append(position)
+                if len(picked) == count:
+                    return picked
+        unseen = [
+            position for position in (position_at(index) for index in range(total))
+            if self.ids[position] not in excluded and position not in picked
+        ]
+        return picked + random.sample(unseen, min(count - len(picked), len(unseen)))
+
+    def sample(self, category, excluded, count, difficulty=None):
+        """
+        Draws quiz questions, as QuizPools.sample does, straight from the snapshot.
+        @returns a list of at most count formatted questions.
+        """
+        category = category_key(category)
+        if difficulty is None:
+            if category == ALL_CATEGORIES:
+                positions = self.sample_ranges(None, [[0, self.count]], excluded, count)
+            else:
+                permutation, start, end = self.listing(category)
+                positions = self.sample_ranges(permutation, [[start, end]], excluded, count)
+        else:
+            positions = []
+            for band in difficulty_band(difficulty):
+                positions += self.sample_ranges(self.by_difficulty, self.quiz_ranges(category, band), excluded, count - len(positions))
+                if len(positions) == count:
+                    break
+        return [self.question(position) for position in positions]
+
+
+class SnapshotManager:
+    """
+    Maps the snapshot file of an app and keeps it current.
+    A write of this worker makes the snapshot stale, it is then not served until a background rebuild has replaced it,
+    and the file is checked every SNAPSHOT_CHECK_INTERVAL seconds for a snapshot written by another worker.
+    Rebuilds of all the workers take turns on a lock file next to the snapshot, and a rebuild only writes the file
+    when it is behind the catalog revision, so the snapshot of a write is written once however many workers see it.
+    """
+
+    def __init__(self, app, path, check_interval=SNAPSHOT_CHECK_INTERVAL, rebuild_delay=SNAPSHOT_REBUILD_DELAY):
+        self.app = app
+        self.path = path
+        self.check_interval = check_interval
+        self.rebuild_delay = rebuild_delay
+        self.lock = threading.Lock()
+        self.snapshot = None
+        self.checked_at = None
+        self.stale = False
+        self.rebuilding = False
+
+    def current(self):
+        """
+        @returns the mapped snapshot, or None while it is stale or has not been built yet.
+        """
+        now = time.monotonic()
+        with self.lock:
+            if self.checked_at is None or now - self.checked_at >= self.check_interval:
+                self.checked_at = now
+                self.reload()
+            return None if self.stale else self.snapshot
+
+    def reload(self):
+        #maps the file again when it is not the one mapped, the old mapping lives on until its last reader is done.
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self.schedule(0)
+            return
+        if self.snapshot is not None and (stat.st_ino, stat.st_mtime_ns) == (self.snapshot.stat.st_ino, self.snapshot.stat.st_mtime_ns):
+            return
+        try:
+            snapshot = CatalogSnapshot(self.path)
+        except (OSError, ValueError):
+            self.app.logger.exception('could not map the catalog snapshot %s', self.path)
+            self.schedule(0)
+            return
+        if self.snapshot is not None:
+            #the questions of another worker's writes are served from now on, the responses and listings cached before are dropped.
+            self.app.extensions['catalog_version'].bump()
+            if 'query_cache' in self.app.extensions:
+                self.app.extensions['query_cache'].invalidate(SEARCH, CATEGORIES)
+        self.snapshot = snapshot
+
+    def invalidate(self, background=True):
+        """
+        Stops serving the snapshot after a write of this process.
+        @param background - rebuild it after SNAPSHOT_REBUILD_DELAY seconds, else it is rebuilt by flush.
+        """
+        with self.lock:
+            self.stale = True
+            if background:
+                self.schedule(self.rebuild_delay)
+
+    def follow(self):
+        #the process that wrote rebuilds the file, and this worker maps it at a check, the snapshot is served meanwhile.
+        #a writer that keeps no snapshot, such as the ASGI app, leaves the file behind, the rebuild then catches it up.
+        with self.lock:
+            self.schedule(self.rebuild_delay + self.check_interval)
+
+    def flush(self):
+        #rebuilds once the writes made outside a request, which have no background rebuild scheduled.
+        with self.lock:
+            pending = self.stale and not self.rebuilding
+        if pending:
+            self.build()
+
+    def schedule(self, delay):
+        #one rebuild at a time, writes made while it runs are picked up by the next one.
+        if self.rebuilding:
+            return
+        self.rebuilding = True
+        timer = threading.Timer(delay, self.rebuild)
+        timer.daemon = True
+        timer.start()
+
+    def rebuild(self):
+        try:
+            with self.app.app_context():
+                self.build()
+        except Exception:
+            self.app.logger.exception('could not build the catalog snapshot %s', self.path)
+        finally:
+            with self.lock:
+                self.rebuilding = False
+                if self.stale:
+                    self.schedule(self.rebuild_delay)
+
+    def build(self, force=False):
+        """
+        Writes a new snapshot of the tables, unless the file already holds every write, and maps it.
+        @param force - write one even when the file is at the current catalog revision.
+        """
+        with self.lock:
+            #writes from here on are not in this snapshot, they mark it stale again.
+            self.stale = False
+        with open(self.path + '.lock', 'w') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            #every write counts in the revision, a file written at the current one holds them, whichever worker wrote it.
+            revision = read_revision()
+            generation, metadata = read_header(self.path)
+            if force or revision is None or metadata is None or metadata['revision'] != revision[0]:
+                write_snapshot(self.path, generation + 1, None if revision is None else revision[0])
+        with self.lock:
+            self.reload()
+
+
+def init_snapshot(app):
+    """
+    Serves the question listings, the search and the quiz from a memory-mapped snapshot when CATALOG_SNAPSHOT names its file.
+    SNAPSHOT_CHECK_INTERVAL and SNAPSHOT_REBUILD_DELAY override the defaults of the module.
+    @param app - the app itself.
+    """
+    path = app.config['CATALOG_SNAPSHOT'] = config_value(app, 'CATALOG_SNAPSHOT')
+    if not path:
+        return
+    #the trigram postings are in the snapshot, a search index of the process would be another copy of them.
+    #while the snapshot is stale the search scans the database instead.
+    app.extensions['question_index'] = None
+    app.extensions['catalog_snapshot'] = SnapshotManager(
+        app, path,
+        app.config.setdefault('SNAPSHOT_CHECK_INTERVAL', SNAPSHOT_CHECK_INTERVAL),
+        app.config.setdefault('SNAPSHOT_REBUILD_DELAY', SNAPSHOT_REBUILD_DELAY))
+    app.before_request(check_snapshot)
+    app.teardown_appcontext(flush_snapshot)
+
+
+def check_snapshot():
+    #a newer snapshot is mapped before the request, a conditional endpoint may answer from its cache without reading it.
+    current_app.extensions['catalog_snapshot'].current()
+
+
+def flush_snapshot(error=None):
+    #a command such as "flask import-questions" may exit before a background rebuild runs,
+    #its writes are rebuilt once when its app context ends.
+    current_app.extensions['catalog_snapshot'].flush()
+
+
+def catalog_snapshot():
+    """
+    @returns the snapshot the current app can serve from, or None.
+    """
+    manager = current_app.extensions.get('catalog_snapshot')
+    return manager.current() if manager is not None else None
+
+
+def build_snapshot(force=False):
+    #builds the snapshot of the current app now, in this thread.
+    current_app.extensions['catalog_snapshot'].build(force)
+
+
+def draw_quiz_questions(category, previous_questions, count, difficulty=None):
+    """
+    Draws distinct quiz questions from the snapshot when the app serves from one, else from the quiz pools.
+    @param category - the category id, 0 for all categories.
+    @param previous_questions - the ids already asked.
+    @param count - the number of questions wanted.
+    @param difficulty - the target difficulty of an adaptive quiz, any difficulty when None.
+    @returns a list of at most count formatted questions.
+    """
+    snapshot = catalog_snapshot()
+    if snapshot is not None:
+        return snapshot.sample(category, set(previous_questions), count, difficulty)
+    return [question.format() for question in next_quiz_questions(category, previous_questions, count, difficulty)]
+
+
+def invalidate_snapshot(action, record):
+    #any write to the questions or the categories is missing from the snapshot until it is rebuilt,
+    #outside a request the rebuild waits for the app context to end, so a script writing many questions rebuilds once.
+    if not has_app_context() or 'catalog_snapshot' not in current_app.extensions:
+        return
+    manager = current_app.extensions['catalog_snapshot']
+    if action == 'sync':
+        manager.follow()
+    else:
+        manager.invalidate(background=has_request_context())
+
+
+add_question_listener(invalidate_snapshot)
+add_category_listener(invalidate_snapshot)
@@ -0,0 +1,101 @@
+import threading
+import time
+from collections import Counter
+
+from flask import current_app, has_app_context
+from sqlalchemy import func
+
+from models import db, Question, add_question_listener, add_category_listener
+
+# Seconds after which the counts are loaded again, unless STATS_REFRESH says otherwise
+STATS_REFRESH = 60
+
+
+class QuestionStats:
+    """
+    Counts of the questions by category and difficulty, loaded with one GROUP BY
+    and then kept in step with Question.insert and delete.
+    Updates and bulk writes, whose previous values are not known, make the next use load them again,
+    and so does the first use after refresh seconds, which brings in the writes of the other processes.
+    """
+
+    def __init__(self, refresh=STATS_REFRESH):
+        self.lock = threading.RLock()
+        self.counts = Counter()
+        self.built = False
+        self.refresh = refresh
+        self.loaded_at = None
+
+    def build(self):
+        #the (category, difficulty) index answers the aggregate without reading the questions.
+        with self.lock:
+            rows = db.session.query(Question.category, Question.difficulty, func.count(Question.id)) \
+                .group_by(Question.category, Question.difficulty)
+            self.counts = Counter({(category, difficulty): count for category, difficulty, count in rows})
+            self.built = True
+            self.loaded_at = time.monotonic()
+
+    def reset(self):
+        with self.lock:
+            self.built = False
+
+    def ensure_built(self):
+        with self.lock:
+            if not self.built or time.monotonic() - self.loaded_at >= self.refresh:
+                self.build()
+
+    def add(self, category, difficulty, change):
+        with self.lock:
+            key = (category, difficulty)
+            self.counts[key] += change
+            if self.counts[key] <= 0:
+                del self.counts[key]
+
+    def summary(self):
+        """
+        @returns the total number of questions, then dicts of the counts by category,
+        by difficulty and by difficulty within each category.
+        """
+        with self.lock:
+            self.ensure_built()
+            by_category, by_difficulty, breakdown = Counter(), Counter(), {}
+            for (category, difficulty), count in self.counts.items():
+                by_difficulty[difficulty] += count
+                by_category[category] += count
+                breakdown.setdefault(category, Counter())[difficulty] += count
+            return sum(self.counts.values()), by_category, by_difficulty, breakdown
+
+
+def init_stats(app):
+    """
+    Attaches empty question statistics to the app, they are loaded by the first GET /stats
+    and again every STATS_REFRESH seconds.
+    @param app - the app itself.
+    """
+    app.extensions['question_stats'] = QuestionStats(app.config.setdefault('STATS_REFRESH', STATS_REFRESH))
+
+
+def question_stats():
+    return current_app.extensions['question_stats']
+
+
+@add_question_listener
+def sync_question_stats(action, question):
+    if not has_app_context():
+        return
+    stats = current_app.extensions.get('question_stats')
+    if stats is None or not stats.built:
+        return
+    if action == 'insert':
+        stats.add(question.category, question.difficulty, 1)
+    elif action == 'delete':
+        stats.add(question.category, question.difficulty, -1)
+    else:
+        stats.reset()
+
+
+@add_category_listener
+def reset_question_stats(action, category):
+    #deleting or renumbering a category moves its questions, the counts are loaded again.
+    if has_app_context() and 'question_stats' in current_app.extensions:
+        question_stats().reset()
@@ -0,0 +1,196 @@
+import functools
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from flask import Response, current_app, has_app_context, request
+from werkzeug.http import http_date, parse_date
+
+from models import add_question_listener, add_category_listener, notify_question_listeners, notify_category_listeners, read_revision, written_revision
+
+# Serialized responses kept by the response cache, unless RESPONSE_CACHE_SIZE says otherwise
+RESPONSE_CACHE_SIZE = 256
+# Seconds between two reads of the shared catalog revision, unless CATALOG_CHECK_INTERVAL says otherwise
+CATALOG_CHECK_INTERVAL = 1
+
+
+class CatalogVersion:
+    """
+    Monotonic version of the question bank as this process serves it, bumped by every question or category write of this process
+    and whenever the shared catalog revision shows a write of another process.
+    The ETag also carries an id of the process, so a tag handed out by one worker never matches another's.
+    """
+
+    def __init__(self, check_interval=CATALOG_CHECK_INTERVAL):
+        self.lock = threading.Lock()
+        self.boot = uuid.uuid4().hex[:8]
+        self.value = 0
+        #Last-Modified has a one second resolution.
+        self.modified = int(time.time())
+        self.check_interval = check_interval
+        self.checked_at = None
+        #the shared revision every write of which this process has taken in, None until it is first read.
+        self.revision = None
+
+    def bump(self, revision=None, reloaded=False):
+        """
+        Moves to a new version after a write of this process or a reload.
+        @param revision - the (value, modified) of the shared revision the write made, or read before the reload.
+        @param reloaded - everything mirroring the question bank loads it again, so no earlier write is left out.
+        """
+        with self.lock:
+            self.value += 1
+            #two versions never share a Last-Modified, even when written within the same second.
+            self.modified = max(int(time.time()), self.modified + 1)
+            if revision is None:
+                return
+            value, modified = revision
+            self.modified = max(self.modified, modified)
+            #a write right after the revision taken in leaves no write of another process out.
+            if reloaded or (self.revision is not None and value == self.revision + 1):
+                self.revision = value
+
+    def due(self):
+        #whether the shared revision is to be read again, at most every check_interval seconds.
+        now = time.monotonic()
+        with self.lock:
+            if self.checked_at is not None and now - self.checked_at < self.check_interval:
+                return False
+            self.checked_at = now
+            return True
+
+    def changed(self, revision):
+        """
+        @param revision - the (value, modified) of the shared revision.
+        @returns whether it counts writes this process has not taken in, the first revision read counting none.
+        """
+        with self.lock:
+            if self.revision is None:
+                self.revision = revision[0]
+                self.modified = max(self.modified, revision[1])
+                return False
+            return revision[0] != self.revision
+
+    def current(self):
+        with self.lock:
+            return self.value, self.modified
+
+    def etag(self, value):
+        return '"{}-{}"'.format(self.boot, value)
+
+
+class ResponseCache:
+    """
+    LRU of serialized response bodies, keyed by (version, endpoint, arguments).
+    Entries of older versions are never looked up again and age out of the LRU.
+    """
+
+    def __init__(self, size=RESPONSE_CACHE_SIZE):
+        self.size = size
+        self.lock = threading.Lock()
+        self.bodies = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            body = self.bodies.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.bodies.move_to_end(key)
+            return body
+
+    def put(self, key, body):
+        if self.size <= 0:
+            return
+        with self.lock:
+            self.bodies[key] = body
+            self.bodies.move_to_end(key)
+            while len(self.bodies) > self.size:
+                self.bodies.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.bodies.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+def init_versioning(app):
+    """
+    Attaches the catalog version and the response cache to the app, RESPONSE_CACHE_SIZE sets the size of the LRU
+    and CATALOG_CHECK_INTERVAL how often the shared catalog revision is read.
+    @param app - the app itself.
+    """
+    app.extensions['catalog_version'] = CatalogVersion(app.config.setdefault('CATALOG_CHECK_INTERVAL', CATALOG_CHECK_INTERVAL))
+    app.extensions['response_cache'] = ResponseCache(app.config.setdefault('RESPONSE_CACHE_SIZE', RESPONSE_CACHE_SIZE))
+    app.before_request(sync_catalog)
+
+
+def sync_catalog():
+    """
+    Reads the shared catalog revision, every CATALOG_CHECK_INTERVAL seconds at most, before a request.
+    When another process wrote to the questions or the categories, whatever mirrors them in this process reloads them.
+    """
+    catalog = current_app.extensions['catalog_version']
+    if not catalog.due():
+        return
+    revision = read_revision()
+    if revision is not None and catalog.changed(revision):
+        notify_category_listeners('sync', None)
+        notify_question_listeners('sync', None)
+
+
+def not_modified(etag, modified):
+    #If-None-Match takes precedence over If-Modified-Since, as in RFC 7232.
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag.strip('"'))
+    since = parse_date(request.headers.get('If-Modified-Since'))
+    return since is not None and int(since.timestamp()) >= modified
+
+
+def conditional(view):
+    """
+    Decorates a GET endpoint whose body only depends on the question bank and the request arguments.
+    It emits ETag and Last-Modified, answers a matching If-None-Match or If-Modified-Since with 304
+    without calling the endpoint, and otherwise serves the body from the response cache when it can.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        catalog = current_app.extensions['catalog_version']
+        cache = current_app.extensions['response_cache']
+        version, modified = catalog.current()
+        etag = catalog.etag(version)
+        headers = {'ETag': etag, 'Last-Modified': http_date(modified)}
+        if not_modified(etag, modified):
+            return Response(status=304, headers=headers)
+        key = (version, request.endpoint, tuple(sorted(kwargs.items())), tuple(sorted(request.args.items(multi=True))))
+        body = cache.get(key)
+        if body is not None:
+            return Response(body, mimetype='application/json', headers=headers)
+        response = current_app.make_response(view(*args, **kwargs))
+        #only successful responses are cached, errors are raised through abort and never get here.
+        if response.status_code == 200:
+            cache.put(key, response.get_data())
+            response.headers.extend(headers)
+        return response
+    return wrapper
+
+
+def bump_catalog_version(action, record):
+    #any write to the questions or the categories changes the bodies the conditional endpoints return.
+    if not has_app_context() or 'catalog_version' not in current_app.extensions:
+        return
+    catalog = current_app.extensions['catalog_version']
+    if action in ('reload', 'sync'):
+        catalog.bump(read_revision(), reloaded=True)
+    else:
+        catalog.bump(written_revision())
+
+
+add_question_listener(bump_catalog_version)
+add_category_listener(bump_catalog_version)
@@ -0,0 +1,36 @@
+--
+-- Makes questions.category an integer foreign key on categories.id and indexes
+-- the category filters of the category listing and the quiz.
+--
+-- Databases restored from trivia.psql already have the integer column and the
+-- foreign key, databases created by db.create_all() before this migration have
+-- a varchar column. Every step is skipped when it is already done, so it can be
+-- run on both:
+--
+--     psql trivia < migrations/001_question_category_foreign_key.sql
+--
+
+BEGIN;
+
+ALTER TABLE public.questions
+    ALTER COLUMN category TYPE integer USING category::integer;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint
+        WHERE conrelid = 'public.questions'::regclass AND contype = 'f'
+    ) THEN
+        ALTER TABLE ONLY public.questions
+            ADD CONSTRAINT category FOREIGN KEY (category) REFERENCES public.categories(id) ON UPDATE CASCADE ON DELETE SET NULL;
+    END IF;
+END
+$$;
+
+CREATE INDEX IF NOT EXISTS questions_category_id_idx ON public.questions USING btree (category, id);
+
+CREATE INDEX IF NOT EXISTS questions_category_difficulty_idx ON public.questions USING btree (category, difficulty);
+
+COMMIT;
+
+ANALYZE public.questions;
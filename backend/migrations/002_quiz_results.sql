@@ -0,0 +1,24 @@
+--
+-- Adds the quiz_results table behind POST /quiz/results and GET /leaderboard,
+-- with the (category, score) index the leaderboards are loaded from.
+--
+-- trivia.psql, db.create_all() and "flask init-db" create it as well. Every step is skipped
+-- when it is already done:
+--
+--     psql trivia < migrations/002_quiz_results.sql
+--
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS public.quiz_results (
+    id serial PRIMARY KEY,
+    player character varying NOT NULL,
+    category integer NOT NULL,
+    score integer NOT NULL,
+    questions integer NOT NULL,
+    created timestamp without time zone NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS quiz_results_category_score_idx ON public.quiz_results USING btree (category, score);
+
+COMMIT;
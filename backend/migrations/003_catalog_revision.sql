@@ -0,0 +1,21 @@
+--
+-- Adds the catalog_revision row every write to the questions or the categories
+-- bumps, from which the workers tell that another process changed the question bank.
+--
+-- trivia.psql, db.create_all() and "flask init-db" create it as well. Every step is skipped
+-- when it is already done:
+--
+--     psql trivia < migrations/003_catalog_revision.sql
+--
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS public.catalog_revision (
+    id integer PRIMARY KEY,
+    value integer NOT NULL,
+    modified integer NOT NULL
+);
+
+INSERT INTO public.catalog_revision (id, value, modified) VALUES (1, 0, 0) ON CONFLICT (id) DO NOTHING;
+
+COMMIT;
@@ -1,23 +1,190 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
-from flask_sqlalchemy import SQLAlchemy
+import functools
+import time
+from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Index, DDL, case, create_engine, event, orm, select
+from sqlalchemy.exc import SQLAlchemyError
+from flask import g, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
 import json
 
 database_name = 'trivia'
 database_path = "postgresql://{}:{}@{}/{}".format('cerberus', 'securePass1','localhost:5432', database_name)
+default_database_path = database_path
 
-db = SQLAlchemy()
+"""
+RoutingSession
+    sends the statements of read-only endpoints to the "replica" bind, when there is one,
+    and everything else, flushes included, to the primary database.
+"""
+class RoutingSession(SignallingSession):
+    def __init__(self, db, **options):
+        self.db = db
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and has_request_context() and g.get('db_read_only'):
+            app = self.app
+            if 'replica' in (app.config.get('SQLALCHEMY_BINDS') or {}):
+                return self.db.get_engine(app, bind='replica')
+        return super().get_bind(mapper, clause)
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+db = RoutingSQLAlchemy()
+
+"""
+read_only(view)
+    marks an endpoint whose queries may be served by the read replica.
+"""
+def read_only(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        g.db_read_only = True
+        return view(*args, **kwargs)
+    return wrapper
+
+"""
+Engine settings
+    read from the app config first, then from the environment, so each worker can size its pool.
+    Strings are cast wherever they come from, so "false" in the app config is as false as in the environment.
+"""
+def config_value(app, name, cast=str):
+    value = app.config.get(name)
+    if value is None:
+        value = os.environ.get(name)
+    return cast(value) if isinstance(value, str) else value
+
+def flag(value):
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+def engine_options(app, *urls):
+    #the options apply to the primary and the replica engines alike.
+    options = {}
+    pooled = not any(url.startswith('sqlite') for url in urls)
+    for name, option, cast in (
+        ('DB_POOL_SIZE', 'pool_size', int),
+        ('DB_MAX_OVERFLOW', 'max_overflow', int),
+        ('DB_POOL_TIMEOUT', 'pool_timeout', int),
+        ('DB_POOL_RECYCLE', 'pool_recycle', int),
+        ('DB_POOL_PRE_PING', 'pool_pre_ping', flag),
+    ):
+        value = config_value(app, name, cast)
+        #SQLite does not use a sized pool, only recycle and pre-ping apply to it.
+        if value is not None and (pooled or option in ('pool_recycle', 'pool_pre_ping')):
+            options[option] = value
+    timeout = config_value(app, 'DB_STATEMENT_TIMEOUT', int)
+    if timeout is not None and all(url.startswith('postgres') for url in urls):
+        #statement_timeout is in milliseconds, Postgres cancels any statement that runs longer.
+        options['connect_args'] = {'options': '-c statement_timeout={}'.format(timeout)}
+    return options
 
 """
 setup_db(app)
     binds a flask application and a SQLAlchemy service
+    the database is the one given, else DATABASE_URL from the app config or the environment, else database_path.
+    DATABASE_REPLICA_URL adds a read replica for the endpoints marked read_only.
+    create_tables=False skips db.create_all(), the tables are then created by "flask init-db".
 """
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=None, create_tables=True):
+    database_path = database_path or config_value(app, 'DATABASE_URL') or default_database_path
+    replica_path = config_value(app, 'DATABASE_REPLICA_URL')
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app, database_path, *filter(None, [replica_path]))
+    if replica_path:
+        app.config["SQLALCHEMY_BINDS"] = {'replica': replica_path}
     db.app = app
     db.init_app(app)
-    db.create_all()
+    if create_tables:
+        db.create_all()
+
+"""
+Question listeners
+    callbacks run after a question has been written to the database,
+    called with the action ("insert", "update" or "delete") and the question,
+    with "reload" and None after this process wrote many questions at once,
+    or with "sync" and None after another process wrote to them.
+"""
+question_listeners = []
+
+def add_question_listener(listener):
+    question_listeners.append(listener)
+    return listener
+
+def notify_question_listeners(action, question):
+    for listener in question_listeners:
+        listener(action, question)
+
+"""
+Category listeners
+    the same, for writes to the categories.
+"""
+category_listeners = []
+
+def add_category_listener(listener):
+    category_listeners.append(listener)
+    return listener
+
+def notify_category_listeners(action, category):
+    for listener in category_listeners:
+        listener(action, category)
+
+"""
+CatalogRevision
+    a single row counting the writes to the questions and the categories, and when the last one was made.
+    Every write bumps it in its own transaction, whichever process makes it, so the Flask workers,
+    the CLI and the ASGI app can tell when the question bank changed behind their back.
+"""
+class CatalogRevision(db.Model):
+    __tablename__ = 'catalog_revision'
+
+    id = Column(Integer, primary_key=True)
+    value = Column(Integer, nullable=False)
+    modified = Column(Integer, nullable=False)
+
+event.listen(CatalogRevision.__table__, 'after_create', DDL('INSERT INTO catalog_revision (id, value, modified) VALUES (1, 0, 0)'))
+
+def bump_revision(connection):
+    """
+    Counts a write to the questions or the categories, in the transaction of the write.
+    The row stays locked until that transaction ends, so concurrent writers get consecutive values,
+    and the modified time, in seconds, goes up by at least one with every write.
+    @param connection - the session or connection making the write.
+    @returns the (value, modified) of the revision the write makes, or None when the row is missing.
+    """
+    table = CatalogRevision.__table__
+    now = int(time.time())
+    connection.execute(table.update().where(table.c.id == 1).values(
+        value=table.c.value + 1,
+        modified=case([(table.c.modified >= now, table.c.modified + 1)], else_=now)))
+    row = connection.execute(select([table.c.value, table.c.modified]).where(table.c.id == 1)).first()
+    return tuple(row) if row is not None else None
+
+def read_revision():
+    """
+    @returns the (value, modified) of the catalog revision, from the primary database,
+    or None when the table has not been created yet.
+    """
+    table = CatalogRevision.__table__
+    try:
+        row = db.session.execute(select([table.c.value, table.c.modified]).where(table.c.id == 1), bind=db.engine).first()
+    except SQLAlchemyError:
+        db.session.rollback()
+        return None
+    return tuple(row) if row is not None else None
+
+def commit_write():
+    #commits a write of the models, with the catalog revision it makes, which written_revision hands to the listeners.
+    db.session.info['catalog_revision'] = bump_revision(db.session)
+    db.session.commit()
+
+def written_revision():
+    """
+    @returns the (value, modified) of the catalog revision of the last commit_write of the session, once.
+    """
+    return db.session.info.pop('catalog_revision', None)
 
 """
 Question
@@ -25,11 +192,15 @@ Question
 """
 class Question(db.Model):
     __tablename__ = 'questions'
+    __table_args__ = (
+        Index('questions_category_id_idx', 'category', 'id'),
+        Index('questions_category_difficulty_idx', 'category', 'difficulty'),
+    )
 
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(String)
+    category = Column(Integer, ForeignKey('categories.id', name='category', onupdate='CASCADE', ondelete='SET NULL'))
     difficulty = Column(Integer)
 
     def __init__(self, question, answer, category, difficulty):
@@ -40,14 +211,17 @@ class Question(db.Model):
 
     def insert(self):
         db.session.add(self)
-        db.session.commit()
+        commit_write()
+        notify_question_listeners('insert', self)
 
     def update(self):
-        db.session.commit()
+        commit_write()
+        notify_question_listeners('update', self)
 
     def delete(self):
         db.session.delete(self)
-        db.session.commit()
+        commit_write()
+        notify_question_listeners('delete', self)
 
     def format(self):
         return {
@@ -71,8 +245,49 @@ class Category(db.Model):
     def __init__(self, type):
         self.type = type
 
+    def insert(self):
+        db.session.add(self)
+        commit_write()
+        notify_category_listeners('insert', self)
+
+    def update(self):
+        commit_write()
+        notify_category_listeners('update', self)
+
+    def delete(self):
+        db.session.delete(self)
+        commit_write()
+        notify_category_listeners('delete', self)
+
     def format(self):
         return {
             'id': self.id,
             'type': self.type
             }
+
+"""
+QuizResult
+    the score of a finished quiz round, category 0 being a quiz of all categories.
+    Results are written in batches by flaskr.results, not one by one.
+"""
+class QuizResult(db.Model):
+    __tablename__ = 'quiz_results'
+    __table_args__ = (
+        Index('quiz_results_category_score_idx', 'category', 'score'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    player = Column(String, nullable=False)
+    category = Column(Integer, nullable=False)
+    score = Column(Integer, nullable=False)
+    questions = Column(Integer, nullable=False)
+    created = Column(DateTime, nullable=False)
+
+    def format(self):
+        return {
+            'player': self.player,
+            'category': self.category,
+            'score': self.score,
+            'questions': self.questions,
+            'created': self.created.isoformat()
+            }
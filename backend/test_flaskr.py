@@ -1,10 +1,25 @@
+import asyncio
+import gzip
+import importlib.util
 import os
+import tempfile
+import time
 import unittest
 import json
+from array import array
+from flask import g, jsonify
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import create_engine
 
 from flaskr import create_app
-from models import setup_db, Question, Category
+from flaskr.asgi import create_asgi_app
+from flaskr.bulk import import_questions
+from flaskr.quiz import quiz_pools, next_quiz_questions
+from flaskr.search import QuestionIndex, intersect
+from flaskr.serialization import json_response
+from flaskr.snapshot import read_generation
+from flaskr.stats import question_stats
+from models import setup_db, engine_options, db, Question, Category, QuizResult
 
 
 class TriviaTestCase(unittest.TestCase):
@@ -65,6 +80,230 @@ class TriviaTestCase(unittest.TestCase):
         # Executed at end of test
         pass
 
+    # Pool settings come from the app config, and those SQLite cannot use are left out for it.
+    def test_engine_options(self):
+        self.app.config.update(DB_POOL_SIZE=5, DB_POOL_PRE_PING=True, DB_STATEMENT_TIMEOUT=1000)
+        postgres = engine_options(self.app, 'postgresql://localhost/trivia')
+        sqlite = engine_options(self.app, 'sqlite://')
+
+        self.assertEqual(postgres['pool_size'], 5)
+        self.assertTrue(postgres['pool_pre_ping'])
+        self.assertEqual(postgres['connect_args'], {'options': '-c statement_timeout=1000'})
+        self.assertEqual(sqlite, {'pool_pre_ping': True})
+
+    # Settings given as strings in the app config are cast as those of the environment.
+    def test_string_config_values(self):
+        app = create_app({'FAST_START': 'false', 'WARM_CACHES': 'false', 'METRICS': '0', 'DB_POOL_SIZE': '5'})
+        options = engine_options(app, 'postgresql://localhost/trivia')
+
+        self.assertFalse(app.config['FAST_START'])
+        self.assertFalse(app.config['WARM_CACHES'])
+        self.assertFalse(app.config['METRICS'])
+        self.assertEqual(options['pool_size'], 5)
+
+    # With a replica, the read-only endpoints read from it while the writes go to the primary.
+    def test_replica_routing(self):
+        with tempfile.TemporaryDirectory() as directory:
+            replica_path = 'sqlite:///' + os.path.join(directory, 'replica.db')
+            replica = create_engine(replica_path)
+            db.Model.metadata.create_all(replica)
+            replica.execute(Category.__table__.insert(), id=1, type='Replica')
+            replica.execute(Question.__table__.insert(), question='Only on the replica?', answer='Yes', category=1, difficulty=1)
+            app = create_app({'DATABASE_REPLICA_URL': replica_path})
+            setup_db(app, self.database_path)
+            listing = json.loads(app.test_client().get('/categories/1/questions').data)
+            created = json.loads(app.test_client().post('/questions', json=self.new_question).data)['created']
+            with app.test_request_context('/questions'):
+                session = db.session()
+                read_bind = session.get_bind()
+                g.db_read_only = True
+                replica_bind = session.get_bind()
+                #a flush inside a read-only endpoint still writes to the primary.
+                session._flushing = True
+                flush_bind = session.get_bind()
+                session._flushing = False
+            with app.app_context():
+                on_primary = Question.query.get(created) is not None
+            on_replica = replica.execute(Question.__table__.select().where(Question.__table__.c.id == created)).first()
+            app.test_client().delete('/questions/{}'.format(created))
+            replica.dispose()
+
+        self.assertEqual([question['question'] for question in listing['questions']], ['Only on the replica?'])
+        self.assertTrue(on_primary)
+        self.assertIsNone(on_replica)
+        self.assertEqual(read_bind.url.database, self.database_name)
+        self.assertEqual(replica_bind.url.drivername, 'sqlite')
+        self.assertEqual(flush_bind.url.database, self.database_name)
+
+    # A question the replica does not have yet is skipped by the quiz but kept in the pools, a deleted one is dropped.
+    def test_quiz_replica_miss(self):
+        with tempfile.TemporaryDirectory() as directory:
+            replica_path = 'sqlite:///' + os.path.join(directory, 'replica.db')
+            replica = create_engine(replica_path)
+            db.Model.metadata.create_all(replica)
+            app = create_app({'DATABASE_REPLICA_URL': replica_path})
+            setup_db(app, self.database_path)
+            with app.test_request_context('/quiz'):
+                question = Question.query.get(2)
+                pools = quiz_pools()
+                pools.built = True
+                pools.add(question.id, question.category, question.difficulty)
+                pools.add(100000, question.category, question.difficulty)
+                g.db_read_only = True
+                drawn = next_quiz_questions(question.category, [], 2)
+                kept = set(pools.keys)
+            replica.dispose()
+
+        self.assertEqual(drawn, [])
+        self.assertEqual(kept, {question.id})
+
+
+    def test_fast_start_init_db(self):
+        app = create_app({'FAST_START': True})
+        setup_db(app, self.database_path, create_tables=False)
+        result = app.test_cli_runner().invoke(args=['init-db'])
+
+        self.assertTrue(app.config['FAST_START'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('created', result.output)
+
+    # An instrumented app times each request and exposes the metrics to Prometheus.
+    def test_metrics(self):
+        app = create_app({'METRICS': True})
+        setup_db(app, self.database_path)
+        res = app.test_client().get('/questions')
+        metrics = app.test_client().get('/metrics')
+
+        self.assertIn('db;dur=', res.headers['Server-Timing'])
+        self.assertEqual(metrics.status_code, 200)
+        self.assertIn('trivia_requests_total{endpoint="retrieve_questions",method="GET",status="200"} 1', metrics.get_data(as_text=True))
+        self.assertIn('trivia_cache_hit_ratio{cache="categories"}', metrics.get_data(as_text=True))
+
+    # Without METRICS there is no metrics endpoint.
+    def test_404_metrics_disabled(self):
+        res = self.client().get('/metrics')
+
+        self.assertEqual(res.status_code, 404)
+        self.assertNotIn('Server-Timing', res.headers)
+
+    # An app with a catalog snapshot lists the same questions as one reading the database.
+    def test_catalog_snapshot(self):
+        path = os.path.join(tempfile.mkdtemp(), 'catalog.snap')
+        app = create_app({'CATALOG_SNAPSHOT': path, 'RESPONSE_CACHE_SIZE': 0, 'QUERY_CACHE': 'off'})
+        setup_db(app, self.database_path)
+        result = app.test_cli_runner().invoke(args=['build-snapshot'])
+        res = app.test_client().get('/questions?page=2')
+        category = app.test_client().get('/categories/1/questions')
+        quiz = app.test_client().post('/quiz', json=self.quiz)
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(res.data, self.client().get('/questions?page=2').data)
+        self.assertEqual(category.data, self.client().get('/categories/1/questions').data)
+        self.assertNotIn(json.loads(quiz.data)['question']['id'], self.quiz['previous_questions'])
+
+    # An import from the command line rebuilds the snapshot before it exits, and a worker mapping the new snapshot drops its cached listings.
+    def test_catalog_snapshot_follows_cli_import(self):
+        path = os.path.join(tempfile.mkdtemp(), 'catalog.snap')
+        reader = create_app({'CATALOG_SNAPSHOT': path, 'SNAPSHOT_CHECK_INTERVAL': 0, 'CATALOG_CHECK_INTERVAL': 3600})
+        command = create_app({'CATALOG_SNAPSHOT': path})
+        for app in (reader, command):
+            setup_db(app, self.database_path)
+        reader.test_cli_runner().invoke(args=['build-snapshot'])
+        before = json.loads(reader.test_client().get('/categories/5/questions').data)
+        generation = read_generation(path)
+        source = os.path.join(os.path.dirname(path), 'questions.ndjson')
+        with open(source, 'w') as file:
+            file.write(json.dumps({'question': 'Which snapshot is this?', 'answer': 'The new one', 'category': 5, 'difficulty': 1}) + '\n')
+        result = command.test_cli_runner().invoke(args=['import-questions', source])
+        after = json.loads(reader.test_client().get('/categories/5/questions').data)
+        with self.app.app_context():
+            Question.query.filter(Question.question == 'Which snapshot is this?').delete()
+            self.db.session.commit()
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(read_generation(path), generation + 1)
+        self.assertEqual(after['total_results'], before['total_results'] + 1)
+
+    # An app with a catalog snapshot searches its trigram postings, with the ranking of the search index, and keeps no index of its own.
+    def test_catalog_snapshot_search(self):
+        path = os.path.join(tempfile.mkdtemp(), 'catalog.snap')
+        app = create_app({'CATALOG_SNAPSHOT': path})
+        setup_db(app, self.database_path)
+        app.test_cli_runner().invoke(args=['build-snapshot'])
+        searches = [{'searchTerm': term, 'searchMode': mode} for term in ('title', 'the', 'What IS', 'is', 'no such question') for mode in ('substring', 'words')]
+        served = [app.test_client().post('/questions/search?page=1', json=search) for search in searches]
+        expected = [self.client().post('/questions/search?page=1', json=search) for search in searches]
+
+        self.assertIsNone(app.extensions['question_index'])
+        self.assertEqual([res.status_code for res in served], [res.status_code for res in expected])
+        self.assertEqual([json.loads(res.data) for res in served], [json.loads(res.data) for res in expected])
+
+    # Several writes outside a request rebuild the snapshot once, and the workers that see them keep the file the writer wrote.
+    def test_catalog_snapshot_written_once(self):
+        path = os.path.join(tempfile.mkdtemp(), 'catalog.snap')
+        writer = create_app({'CATALOG_SNAPSHOT': path})
+        readers = [create_app({'CATALOG_SNAPSHOT': path, 'SNAPSHOT_CHECK_INTERVAL': 0, 'CATALOG_CHECK_INTERVAL': 0, 'SNAPSHOT_REBUILD_DELAY': 0}) for _ in range(3)]
+        for app in [writer] + readers:
+            setup_db(app, self.database_path)
+        writer.test_cli_runner().invoke(args=['build-snapshot'])
+        before = [json.loads(reader.test_client().get('/categories/5/questions').data) for reader in readers]
+        generation = read_generation(path)
+        with writer.app_context():
+            for _ in range(3):
+                Question(question='Which worker wrote this?', answer='The writer', category=5, difficulty=1).insert()
+        written = read_generation(path)
+        for reader in readers:
+            reader.test_client().get('/categories/5/questions')
+        for _ in range(100):
+            if not any(reader.extensions['catalog_snapshot'].rebuilding for reader in readers):
+                break
+            time.sleep(0.05)
+        after = [json.loads(reader.test_client().get('/categories/5/questions').data) for reader in readers]
+        with self.app.app_context():
+            Question.query.filter(Question.question == 'Which worker wrote this?').delete()
+            self.db.session.commit()
+
+        self.assertEqual(written, generation + 1)
+        self.assertEqual(read_generation(path), generation + 1)
+        self.assertEqual([page['total_results'] for page in after], [page['total_results'] + 3 for page in before])
+
+    async def asgi_request(self, app, method, path, body=None):
+        #calls the ASGI app as a server would, and collects the status and the body it sends.
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': json.dumps(body).encode() if body is not None else b''}
+
+        async def send(message):
+            messages.append(message)
+
+        await app({'type': 'http', 'method': method, 'path': path, 'query_string': b'', 'headers': [(b'content-type', b'application/json')]}, receive, send)
+        return messages[0]['status'], messages[1]['body']
+
+    # The ASGI app answers with the same bodies and errors as the Flask app.
+    @unittest.skipUnless(importlib.util.find_spec('asyncpg'), 'asyncpg is not installed')
+    def test_asgi_app(self):
+        app = create_asgi_app({'DATABASE_URL': self.database_path})
+        requests = (
+            ('GET', '/categories', None),
+            ('GET', '/questions', None),
+            ('GET', '/categories/1/questions', None),
+            ('POST', '/questions/search', {'searchTerm': 'title'}),
+            ('POST', '/questions/search', {'searchTerm': 'title', 'searchMode': 'fuzzy'}),
+            ('POST', '/quiz', self.quiz_invalid),
+            ('DELETE', '/questions/100000', None)
+        )
+        loop = asyncio.new_event_loop()
+        responses = [loop.run_until_complete(self.asgi_request(app, method, path, body)) for method, path, body in requests]
+        loop.run_until_complete(app.close())
+        loop.close()
+
+        for (method, path, body), (status, data) in zip(requests, responses):
+            res = self.client().open(path, method=method, json=body)
+            self.assertEqual(status, res.status_code)
+            self.assertEqual(data, res.data)
+
     """
     TODO
     Write at least one test for each test for successful operation and for expected errors.
@@ -84,6 +323,26 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(len(data['categories']))
         self.assertTrue(data['total_categories'])
 
+    # The second listing of the categories is served from the category cache.
+    def test_categories_cache(self):
+        cache = self.app.extensions['category_cache']
+        #with the response cache off, so every listing reaches the endpoint.
+        self.app.extensions['response_cache'].size = 0
+        self.client().get('/categories')
+        hits, misses = cache.hits, cache.misses
+        res = self.client().get('/categories')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(cache.hits, hits + 1)
+        self.assertEqual(cache.misses, misses)
+
+    # The fast JSON path sends the same bytes as jsonify, non-ASCII text included.
+    def test_json_response_matches_jsonify(self):
+        payload = {'success': True, 'questions': [{'id': 16, 'question': 'Which Dutch graphic artist\u2013initials M C?', 'category': 2}]}
+        with self.app.test_request_context():
+            self.assertEqual(json_response(payload).get_data(), jsonify(payload).get_data())
+            self.assertEqual(json_response(payload).mimetype, jsonify(payload).mimetype)
+
     # Retriving all questions
     def test_questions_retrieval(self):
         # Retrieve the list of questions from the server.
@@ -101,6 +360,65 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(len(data['questions']))
         self.assertTrue(data['categories'])
 
+    # Paging through the questions keeps the total of the whole table, not of the page.
+    def test_questions_second_page(self):
+        first = json.loads(self.client().get('/questions').data)
+        res = self.client().get('/questions?page=2')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_questions'], first['total_questions'])
+        self.assertTrue(len(data['questions']) <= 10)
+        self.assertNotEqual(data['questions'][0]['id'], first['questions'][0]['id'])
+
+    # Asking again with the ETag of the first answer gets a 304, until a question is written.
+    def test_questions_conditional_get(self):
+        etag = self.client().get('/questions').headers['ETag']
+        res = self.client().get('/questions', headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+
+        self.client().post('/questions', json=self.new_question)
+        res = self.client().get('/questions', headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+    # A question created through another app shows up at the next check of the shared revision.
+    def test_conditional_get_sees_other_app_writes(self):
+        reader = create_app({'CATALOG_CHECK_INTERVAL': 0})
+        setup_db(reader, self.database_path)
+        first = reader.test_client().get('/questions')
+        created = json.loads(self.client().post('/questions', json=self.new_question).data)['created']
+        res = reader.test_client().get('/questions', headers={'If-None-Match': first.headers['ETag']})
+        self.client().delete('/questions/{}'.format(created))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.data)['total_questions'], json.loads(first.data)['total_questions'] + 1)
+
+    # A client that accepts gzip gets a compressed page of questions, and a 304 for its weak ETag.
+    def test_questions_gzip(self):
+        plain = self.client().get('/questions')
+        res = self.client().get('/questions', headers={'Accept-Encoding': 'gzip'})
+        cached = self.client().get('/questions', headers={'If-None-Match': res.headers['ETag']})
+
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(res.data), plain.data)
+        self.assertLess(len(res.data), len(plain.data))
+        self.assertTrue(res.headers['ETag'].startswith('W/'))
+        self.assertIn('Accept-Encoding', res.headers['Vary'])
+        self.assertEqual(res.headers['Cache-Control'], 'public, max-age=30')
+        self.assertEqual(cached.status_code, 304)
+
+    # The categories are too small to compress, and may be cached for an hour.
+    def test_categories_not_compressed(self):
+        res = self.client().get('/categories', headers={'Accept-Encoding': 'gzip'})
+
+        self.assertNotIn('Content-Encoding', res.headers)
+        self.assertEqual(json.loads(res.data)['success'], True)
+        self.assertEqual(res.headers['Cache-Control'], 'public, max-age=3600')
+
     def test_404_no_questions_found(self):
         res = self.client().get('/questions?page=0')
         data = json.loads(res.data)
@@ -117,6 +435,27 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'resource not found')
 
+    # Walks the questions with cursor pagination until "next_cursor" runs out.
+    def test_questions_cursor_pagination(self):
+        res = self.client().get('/questions?limit=5')
+        data = json.loads(res.data)
+        ids = [question['id'] for question in data['questions']]
+        while data['next_cursor']:
+            data = json.loads(self.client().get('/questions?limit=5&after=' + data['next_cursor']).data)
+            ids += [question['id'] for question in data['questions']]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(ids), Question.query.count())
+
+    def test_400_questions_invalid_cursor(self):
+        res = self.client().get('/questions?after=not-a-cursor!')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'bad request')
+
     #Testing the deletion of questions from the database
     def test_question_deletion(self):
         res = self.client().delete('/questions/10')
@@ -137,6 +476,60 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'resource not found')
 
+    # Deletes two new questions in one request, the statistics follow.
+    def test_questions_bulk_delete(self):
+        ids = [json.loads(self.client().post('/questions', json=self.new_question).data)['created'] for _ in range(2)]
+        before = json.loads(self.client().get('/stats').data)['total_questions']
+        res = self.client().delete('/questions', json={'ids': ids})
+        data = json.loads(res.data)
+        after = json.loads(self.client().get('/stats').data)['total_questions']
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['deleted'], 2)
+        self.assertEqual(after, before - 2)
+        with self.app.app_context():
+            self.assertEqual(Question.query.filter(Question.id.in_(ids)).count(), 0)
+
+    # A bulk delete without any filter is refused, it would delete every question.
+    def test_400_bulk_delete_without_filter(self):
+        res = self.client().delete('/questions', json={})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    # A bulk delete or update whose body is not a JSON object is refused.
+    def test_400_bulk_body_not_an_object(self):
+        deleted = self.client().delete('/questions', json=[1, 2])
+        updated = self.client().patch('/questions', json=[1, 2])
+
+        self.assertEqual(deleted.status_code, 400)
+        self.assertEqual(json.loads(deleted.data)['success'], False)
+        self.assertEqual(updated.status_code, 400)
+        self.assertEqual(json.loads(updated.data)['success'], False)
+
+    # Moves a new question to another category and difficulty.
+    def test_questions_bulk_update(self):
+        created = json.loads(self.client().post('/questions', json=self.new_question).data)['created']
+        res = self.client().patch('/questions', json={'ids': [created], 'set': {'category': 2, 'difficulty': 5}})
+        data = json.loads(res.data)
+        with self.app.app_context():
+            question = Question.query.get(created)
+            moved = (question.category, question.difficulty)
+        #the question goes away again, the quiz tests expect the questions of category 2.
+        self.client().delete('/questions', json={'ids': [created]})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['updated'], 1)
+        self.assertEqual(moved, (2, 5))
+
+    def test_422_bulk_update_invalid_difficulty(self):
+        res = self.client().patch('/questions', json={'ids': [2], 'set': {'difficulty': 9}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+
     # creates a new question and posts it to the server.
     def test_question_creation(self):
         res = self.client().post('/questions', json=self.new_question)
@@ -145,6 +538,23 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
         self.assertTrue(data['total_questions'])
+        self.assertEqual(data['question']['id'], data['created'])
+        self.assertNotIn('questions', data)
+
+    # Asks for the last page along with the new question, which is the last one on it.
+    def test_question_creation_tail_page(self):
+        res = self.client().post('/questions?response=tail', json=self.new_question)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['questions'][-1]['id'], data['created'])
+        self.assertEqual(data['page'], (data['total_questions'] - 1) // 10 + 1)
+
+    def test_question_creation_full_response(self):
+        res = self.client().post('/questions?response=full', json=self.new_question)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
         self.assertTrue(len(data['questions']))
 
     def test_400_question_creation_data_missing(self):
@@ -163,6 +573,91 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'request cannot be processed')
 
+    # Imports two questions as NDJSON, the invalid line is reported and skipped.
+    def test_questions_import(self):
+        total = Question.query.count()
+        body = '\n'.join([
+            json.dumps(self.new_question),
+            json.dumps(self.new_question_invalid),
+            json.dumps(self.new_question),
+        ])
+        res = self.client().post('/questions/import', data=body, content_type='application/x-ndjson')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['imported'], 2)
+        self.assertEqual(data['total_errors'], 1)
+        self.assertEqual(data['errors'][0]['line'], 2)
+        self.assertEqual(Question.query.count(), total + 2)
+
+    # Lines that are not UTF-8, and CSV lines the reader refuses, are reported like invalid rows.
+    def test_questions_import_undecodable_lines(self):
+        ndjson = b'\n'.join([json.dumps(self.new_question).encode(), b'\xff\xfe'])
+        csv = b'question,answer,category,difficulty\n\xff,b,5,1\nx\x00y,b,5,1\nWhat?,This,5,1\n'
+        res = self.client().post('/questions/import', data=ndjson, content_type='application/x-ndjson')
+        data = json.loads(res.data)
+        res_csv = self.client().post('/questions/import?format=csv', data=csv)
+        data_csv = json.loads(res_csv.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['imported'], 1)
+        self.assertEqual([error['line'] for error in data['errors']], [2])
+        self.assertEqual(res_csv.status_code, 200)
+        self.assertEqual(data_csv['imported'], 1)
+        self.assertEqual([error['line'] for error in data_csv['errors']], [2, 3])
+
+    # Chunks committed before reading the rows fails are still announced, the catalog version moves on.
+    def test_questions_import_failure_notifies(self):
+        def rows():
+            yield 1, dict(self.new_question)
+            raise RuntimeError('connection reset')
+
+        with self.app.app_context():
+            version, _ = self.app.extensions['catalog_version'].current()
+            with self.assertRaises(RuntimeError):
+                import_questions(rows(), {5}, chunk_size=1)
+            after, _ = self.app.extensions['catalog_version'].current()
+
+        self.assertGreater(after, version)
+
+    # Floats and booleans are not integers, they are rejected rather than truncated.
+    def test_questions_import_rejects_floats_and_booleans(self):
+        rows = [dict(self.new_question, category=1.9), dict(self.new_question, difficulty=True), dict(self.new_question, category='1.9')]
+        body = '\n'.join(json.dumps(row) for row in rows)
+        res = self.client().post('/questions/import', data=body, content_type='application/x-ndjson')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['imported'], 0)
+        self.assertEqual([error['line'] for error in data['errors']], [1, 2, 3])
+
+    def test_400_questions_import_unknown_format(self):
+        res = self.client().post('/questions/import?format=xml', data='')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'bad request')
+
+    # Exports the questions of category 2 as NDJSON, one question per line.
+    def test_questions_export(self):
+        res = self.client().get('/questions/export?category=2')
+        questions = [json.loads(line) for line in res.data.decode().splitlines()]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertEqual(len(questions), Question.query.filter(Question.category == 2).count())
+        self.assertTrue(all(int(question['category']) == 2 for question in questions))
+
+    # An export filter that is not a number is refused instead of exporting every question.
+    def test_400_questions_export_invalid_filter(self):
+        category = self.client().get('/questions/export?category=abc')
+        difficulty = self.client().get('/questions/export?difficulty=')
+
+        self.assertEqual(category.status_code, 400)
+        self.assertEqual(json.loads(category.data)['success'], False)
+        self.assertEqual(difficulty.status_code, 400)
+
     # The code is trying to search a question to the /questions/search endpoint
     def test_questions_search(self):
         res = self.client().post('/questions/search', json={'searchTerm': 'title'})
@@ -173,6 +668,109 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['total_results'])
         self.assertTrue(len(data['questions']))
 
+    # Searching for every word of a term, the question with "title" at the start of a word ranks first.
+    def test_questions_search_words(self):
+        res = self.client().post('/questions/search', json={'searchTerm': 'title fantasy', 'searchMode': 'words'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_results'], 1)
+        self.assertEqual(data['questions'][0]['id'], 6)
+
+    # An unknown search mode is a client error, not a missing resource.
+    def test_422_search_unknown_mode(self):
+        res = self.client().post('/questions/search', json={'searchTerm': 'title', 'searchMode': 'fuzzy'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['message'], 'request cannot be processed')
+
+    # The posting lists of the index stay sorted whatever the order of the writes, so their intersections find every match.
+    def test_question_index_postings(self):
+        index = QuestionIndex()
+        for question_id, text in ((9, 'Which title won?'), (3, 'A title of a king'), (5, 'No match here'), (7, 'Title king')):
+            index.add(question_id, text)
+        index.remove(7)
+        index.add(1, 'The king title')
+
+        self.assertEqual(list(index.postings['tit']), [1, 3, 9])
+        self.assertEqual(sorted(index.search('king', 'substring')), [1, 3])
+        self.assertEqual(index.search('title king', 'words'), [3, 1])
+        self.assertEqual(sorted(intersect(array('I', [3]), array('I', range(1, 100)))), [3])
+
+    # A search for page 0 finds no questions on the page but counts all the matches, whatever the search backend.
+    def test_search_page_zero(self):
+        scan = create_app({'SEARCH_BACKEND': 'scan'})
+        setup_db(scan, self.database_path)
+        res = self.client().post('/questions/search?page=0', json={'searchTerm': 'title'})
+        scanned = scan.test_client().post('/questions/search?page=0', json={'searchTerm': 'title'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['questions'], [])
+        self.assertGreater(data['total_results'], 0)
+        self.assertEqual(scanned.status_code, 200)
+        self.assertEqual(json.loads(scanned.data)['total_results'], data['total_results'])
+
+    # A repeated search is served from the query cache, until a new question may match it.
+    def test_questions_search_cache(self):
+        cache = self.app.extensions['query_cache']
+        self.client().post('/questions/search', json={'searchTerm': 'title'})
+        hits, misses = cache.hits, cache.misses
+        res = self.client().post('/questions/search', json={'searchTerm': 'Title'})
+        self.client().post('/questions', json={'question': 'Which title is this?', 'answer': 'This', 'category': 5, 'difficulty': 1})
+        after = self.client().post('/questions/search', json={'searchTerm': 'title'})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(cache.hits, hits + 1)
+        self.assertEqual(cache.misses, misses + 1)
+        self.assertEqual(json.loads(after.data)['total_results'], json.loads(res.data)['total_results'] + 1)
+
+    # With a shared query cache, a worker whose index lags behind a write does not publish its stale ranking to the others.
+    def test_shared_query_cache_keeps_index_results_local(self):
+        writer = create_app({'QUERY_CACHE': 'redis', 'CATALOG_CHECK_INTERVAL': 3600})
+        lagging = create_app({'QUERY_CACHE': 'redis', 'CATALOG_CHECK_INTERVAL': 3600})
+        scanning = create_app({'QUERY_CACHE': 'redis', 'SEARCH_BACKEND': 'scan'})
+        for app in (writer, lagging, scanning):
+            setup_db(app, self.database_path)
+        #the three apps share one backend, as workers sharing a Redis server.
+        shared = writer.extensions['query_cache'].backend
+        lagging.extensions['query_cache'].backend = scanning.extensions['query_cache'].backend = shared
+        writer.test_client().post('/questions/search', json={'searchTerm': 'title'})
+        lagging.test_client().post('/questions/search', json={'searchTerm': 'boxer'})
+        question = {'question': 'Which quagga is striped?', 'answer': 'All', 'category': 5, 'difficulty': 1}
+        created = json.loads(writer.test_client().post('/questions', json=question).data)['created']
+        stale = lagging.test_client().post('/questions/search', json={'searchTerm': 'quagga'})
+        res = writer.test_client().post('/questions/search', json={'searchTerm': 'quagga'})
+        index_keys = [key for key in shared.client.values if key.startswith('trivia:query:search')]
+        #a search answered by the database is shared.
+        scanning.test_client().post('/questions/search', json={'searchTerm': 'quagga'})
+        scan_keys = [key for key in shared.client.values if key.startswith('trivia:query:search')]
+        writer.test_client().delete('/questions/{}'.format(created))
+
+        self.assertEqual(stale.status_code, 404)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.data)['questions'][0]['id'], created)
+        self.assertEqual(index_keys, [])
+        self.assertEqual(len(scan_keys), 1)
+
+    # A question created through another app is found by the search index and drawn by the quiz pools, once they reload.
+    def test_index_and_pools_follow_other_app_writes(self):
+        reader = create_app({'CATALOG_CHECK_INTERVAL': 0})
+        setup_db(reader, self.database_path)
+        client = reader.test_client()
+        before = client.post('/questions/search', json={'searchTerm': 'zebra crossing'})
+        client.post('/quiz', json={'previous_questions': [], 'category': 5})
+        question = dict(self.new_question, question='Where does a zebra crossing lead?')
+        created = json.loads(self.client().post('/questions', json=question).data)['created']
+        search = client.post('/questions/search', json={'searchTerm': 'zebra crossing'})
+        quiz = client.post('/quiz', json={'previous_questions': [], 'category': 5, 'count': 50})
+        self.client().delete('/questions/{}'.format(created))
+
+        self.assertEqual(before.status_code, 404)
+        self.assertEqual([question['id'] for question in json.loads(search.data)['questions']], [created])
+        self.assertIn(created, [question['id'] for question in json.loads(quiz.data)['questions']])
+
     def test_400_no_search_term(self):
         res = self.client().post('/questions/search')
         data = json.loads(res.data)
@@ -216,6 +814,41 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'resource not found')
 
+    # The statistics follow question writes without reading the questions again.
+    def test_stats(self):
+        res = self.client().get('/stats')
+        data = json.loads(res.data)
+        self.client().post('/questions', json=self.new_question)
+        after = json.loads(self.client().get('/stats').data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual(data['total_questions'], sum(data['difficulties'].values()))
+        self.assertEqual(after['total_questions'], data['total_questions'] + 1)
+        self.assertEqual(after['categories']['5']['total_questions'], data['categories']['5']['total_questions'] + 1)
+
+    # The statistics of a worker count the questions another app writes, and are counted again once STATS_REFRESH has passed.
+    def test_stats_follow_other_app_writes(self):
+        reader = create_app({'CATALOG_CHECK_INTERVAL': 0, 'STATS_REFRESH': 0})
+        setup_db(reader, self.database_path)
+        first = json.loads(reader.test_client().get('/stats').data)
+        created = json.loads(self.client().post('/questions', json=self.new_question).data)['created']
+        res = json.loads(reader.test_client().get('/stats').data)
+        self.client().delete('/questions/{}'.format(created))
+        with reader.app_context():
+            stats = question_stats()
+            before = stats.summary()[0]
+            #a row written without going through the models is only counted by the refresh.
+            table = Question.__table__
+            inserted = db.session.execute(table.insert().values(question='Counted?', answer='Yes', category=5, difficulty=1).returning(table.c.id)).scalar()
+            db.session.commit()
+            refreshed = stats.summary()[0]
+            db.session.execute(table.delete().where(table.c.id == inserted))
+            db.session.commit()
+
+        self.assertEqual(res['total_questions'], first['total_questions'] + 1)
+        self.assertEqual(refreshed, before + 1)
+
     # The code is trying to play a quiz and test whether the request was successful.
     def test_random_quiz(self):
         res = self.client().post('/quiz', json=self.quiz)
@@ -225,6 +858,135 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertTrue(len(data['question']))
 
+    # Plays a whole quiz round in category 2, every question is asked exactly once.
+    def test_quiz_never_repeats(self):
+        previous_questions = []
+        while True:
+            data = json.loads(self.client().post('/quiz', json={'previous_questions': previous_questions, 'category': 2}).data)
+            if 'question' not in data:
+                break
+            self.assertEqual(int(data['question']['category']), 2)
+            previous_questions.append(data['question']['id'])
+
+        self.assertEqual(sorted(previous_questions), sorted(set(previous_questions)))
+        self.assertEqual(len(previous_questions), Question.query.filter(Question.category == 2).count())
+
+    # Plays a quiz round through a session, the server remembers the questions already asked.
+    def test_quiz_session(self):
+        res = self.client().post('/quiz/sessions', json={'category': 2})
+        token = json.loads(res.data)['session']
+        asked = []
+        while True:
+            data = json.loads(self.client().post('/quiz/sessions/{}/next'.format(token)).data)
+            if 'question' not in data:
+                break
+            asked.append(data['question']['id'])
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(sorted(asked), sorted(set(asked)))
+        self.assertEqual(len(asked), Question.query.filter(Question.category == 2).count())
+        self.assertEqual(self.client().delete('/quiz/sessions/' + token).status_code, 200)
+
+    # A session category that does not fit the stored integer, or a boolean, is refused, with the Redis store too.
+    def test_422_quiz_session_invalid_category(self):
+        app = create_app({'QUIZ_SESSION_STORE': 'redis'})
+        setup_db(app, self.database_path)
+        for category in (2 ** 31, True, -1, '2'):
+            res = app.test_client().post('/quiz/sessions', json={'category': category})
+
+            self.assertEqual(res.status_code, 422)
+            self.assertEqual(json.loads(res.data)['success'], False)
+
+    def test_404_quiz_session_not_found(self):
+        res = self.client().post('/quiz/sessions/unknown/next')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'resource not found')
+
+    # Prefetches a quiz round in one request, no question is repeated or among the previous ones.
+    def test_quiz_batch(self):
+        res = self.client().post('/quiz', json={'previous_questions': [16], 'category': 2, 'count': 5})
+        data = json.loads(res.data)
+        ids = [question['id'] for question in data['questions']]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(sorted(ids), [17, 18, 19])
+
+    def test_422_quiz_batch_invalid_count(self):
+        res = self.client().post('/quiz', json={'previous_questions': [], 'category': 2, 'count': 0})
+        data = json.loads(res.data)
+        boolean = self.client().post('/quiz', json={'previous_questions': [], 'category': 2, 'count': True})
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'request cannot be processed')
+        self.assertEqual(boolean.status_code, 422)
+
+    # Right answers move the adaptive quiz to a harder question, from the pools of that difficulty.
+    def test_adaptive_quiz(self):
+        res = self.client().post('/quiz', json={'previous_questions': [], 'category': 0, 'recent_answers': [True] * 5, 'difficulty': 3})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['target_difficulty'], 4)
+        self.assertEqual(data['question']['difficulty'], 4)
+
+    # Answers that are not booleans are rejected.
+    def test_422_adaptive_quiz_invalid_answers(self):
+        res = self.client().post('/quiz', json={'previous_questions': [], 'category': 0, 'recent_answers': 'yes'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+
+    # A difficulty of true is not difficulty 1.
+    def test_422_adaptive_quiz_boolean_difficulty(self):
+        res = self.client().post('/quiz', json={'previous_questions': [], 'category': 0, 'recent_answers': [True], 'difficulty': True})
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(json.loads(res.data)['success'], False)
+
+    # A recorded result is ranked at once and written by the next flush.
+    def test_quiz_result_and_leaderboard(self):
+        with self.app.app_context():
+            before = QuizResult.query.count()
+        res = self.client().post('/quiz/results', json={'player': 'tester', 'category': 2, 'score': 5, 'questions': 5})
+        data = json.loads(res.data)
+        board = json.loads(self.client().get('/leaderboard?category=2').data)
+        with self.app.app_context():
+            self.app.extensions['quiz_results'].flush()
+            after = QuizResult.query.count()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIsNotNone(data['rank'])
+        self.assertIn('tester', [result['player'] for result in board['leaderboard']])
+        self.assertEqual(after, before + 1)
+
+    # A worker that only serves the leaderboards loads them again after LEADERBOARD_REFRESH, with the results of other apps.
+    def test_leaderboard_follows_other_app_results(self):
+        reader = create_app({'LEADERBOARD_REFRESH': 0})
+        setup_db(reader, self.database_path)
+        first = json.loads(reader.test_client().get('/leaderboard?category=3').data)
+        self.client().post('/quiz/results', json={'player': 'other worker', 'category': 3, 'score': 1000, 'questions': 1000})
+        with self.app.app_context():
+            self.app.extensions['quiz_results'].flush()
+        board = json.loads(reader.test_client().get('/leaderboard?category=3').data)
+
+        self.assertNotIn('other worker', [result['player'] for result in first['leaderboard']])
+        self.assertEqual(board['leaderboard'][0]['player'], 'other worker')
+        self.assertIsNone(reader.extensions['quiz_results'].thread)
+
+    # A score above the number of questions is rejected.
+    def test_422_quiz_result_invalid_score(self):
+        res = self.client().post('/quiz/results', json={'player': 'tester', 'category': 2, 'score': 6, 'questions': 5})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+
     def test_400_quiz_missing_data(self):
         res = self.client().post('/quiz')
         data = json.loads(res.data)